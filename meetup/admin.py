@@ -1,7 +1,25 @@
 from django.contrib import admin
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.html import format_html
 
-from .models import Event, Talk, Question, UserProfile
+from .models import Event, Talk, Question, UserProfile, OutboxMessage, MediaAsset
+
+
+def _count_by_user(model, field):
+    """Число строк model пользователя профиля: коррелированный подзапрос вместо JOIN.
+
+    Два Count по разным обратным связям в одном запросе перемножают строки.
+    """
+    counts = (
+        model.objects.filter(**{field: OuterRef("user")})
+        .order_by()
+        .values(field)
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
 
 
 @admin.register(Event)
@@ -13,9 +31,20 @@ class EventAdmin(admin.ModelAdmin):
     ordering = ("-date",)
     list_display_links = ("title",)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_last_talk_end().annotate(
+            _talks_count=Count("talks", distinct=True),
+        )
+
+    def is_active(self, obj):
+        return obj.is_active_at(timezone.now())
+    is_active.short_description = "Активно"
+    is_active.boolean = True
+
     def talks_count(self, obj):
-        return obj.talks.count()
+        return obj._talks_count
     talks_count.short_description = "Количество докладов"
+    talks_count.admin_order_field = "_talks_count"
 
 
 @admin.register(Talk)
@@ -28,9 +57,20 @@ class TalkAdmin(admin.ModelAdmin):
     list_display_links = ("title",)
     date_hierarchy = "event__date"
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_event_last_talk_end().annotate(
+            _questions_count=Count("questions", distinct=True),
+        )
+
+    def is_active(self, obj):
+        return obj.is_active_at(timezone.now())
+    is_active.short_description = "Активен"
+    is_active.boolean = True
+
     def questions_count(self, obj):
-        return obj.questions.count()
+        return obj._questions_count
     questions_count.short_description = "Количество вопросов"
+    questions_count.admin_order_field = "_questions_count"
 
 
 @admin.register(Question)
@@ -60,16 +100,41 @@ class QuestionAdmin(admin.ModelAdmin):
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ("user", "telegram_id", "is_speaker", "is_organizer", "subscribed_to_notifications", "talks_count", "questions_count")
-    list_filter = ("is_speaker", "is_organizer", "subscribed_to_notifications")
+    list_filter = ("is_speaker", "is_organizer", "subscribed_to_notifications", "question_digest", "unreachable_at")
     search_fields = ("user__username", "user__email", "telegram_id")
     raw_id_fields = ("user",)
     list_display_links = ("user",)
     list_editable = ("is_speaker", "is_organizer", "subscribed_to_notifications")
+    list_select_related = ("user",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            _talks_count=_count_by_user(Talk, "speaker"),
+            _questions_count=_count_by_user(Question, "user"),
+        )
 
     def talks_count(self, obj):
-        return obj.user.speaker_talks.count()
+        return obj._talks_count
     talks_count.short_description = "Количество докладов"
+    talks_count.admin_order_field = "_talks_count"
 
     def questions_count(self, obj):
-        return obj.user.asked_questions.count()
-    questions_count.short_description = "Количество вопросов"
\ No newline at end of file
+        return obj._questions_count
+    questions_count.short_description = "Количество вопросов"
+    questions_count.admin_order_field = "_questions_count"
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "chat_id", "status", "attempts", "created_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("chat_id", "text")
+    date_hierarchy = "created_at"
+    readonly_fields = ("created_at", "sent_at")
+
+
+@admin.register(MediaAsset)
+class MediaAssetAdmin(admin.ModelAdmin):
+    list_display = ("path", "content_hash", "file_id", "uploaded_at")
+    search_fields = ("path",)
+    readonly_fields = ("uploaded_at",)
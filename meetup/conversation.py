@@ -0,0 +1,129 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+ASK_QUESTION = "question"
+ANSWER_QUESTION = "answer"
+BROADCAST = "broadcast"
+
+
+class ConversationStore:
+    """Состояние диалога «ждём ввод» для каждого пользователя бота.
+
+    У пользователя одно состояние за раз; состояния истекают через ttl секунд.
+    Так как ttl общий, порядок вставки совпадает с порядком истечения, и
+    просроченные записи вычищаются с начала OrderedDict. Если задан path,
+    состояния дублируются в SQLite-файл и переживают перезапуск бота.
+    """
+
+    def __init__(self, ttl=900, path=None):
+        self.ttl = ttl
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_state ("
+                "user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, "
+                "payload TEXT, expires REAL NOT NULL)"
+            )
+            self._load()
+
+    def _load(self):
+        now = time.time()
+        self._db.execute("DELETE FROM conversation_state WHERE expires <= ?", (now,))
+        rows = self._db.execute(
+            "SELECT user_id, state, payload, expires FROM conversation_state ORDER BY expires"
+        )
+        for user_id, state, payload, expires in rows:
+            self._states[user_id] = (state, json.loads(payload), expires)
+
+    def _evict(self, now):
+        expired = []
+        while self._states:
+            user_id, (_, _, expires) = next(iter(self._states.items()))
+            if expires > now:
+                break
+            self._states.popitem(last=False)
+            expired.append((user_id,))
+        if expired and self._db:
+            self._db.executemany("DELETE FROM conversation_state WHERE user_id = ?", expired)
+
+    def set(self, user_id, state, payload=None):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._states.pop(user_id, None)
+            self._states[user_id] = (state, payload, expires)
+            self._evict(time.time())
+            if self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO conversation_state VALUES (?, ?, ?, ?)",
+                    (user_id, state, json.dumps(payload), expires),
+                )
+
+    def get(self, user_id):
+        """Возвращает (state, payload) или None."""
+        with self._lock:
+            entry = self._states.get(user_id)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                self._evict(time.time())
+                return None
+            return entry[0], entry[1]
+
+    def pop(self, user_id):
+        """Забирает состояние пользователя: (state, payload) или None."""
+        with self._lock:
+            entry = self._states.pop(user_id, None)
+            if self._db and entry is not None:
+                self._db.execute("DELETE FROM conversation_state WHERE user_id = ?", (user_id,))
+            if entry is None or entry[2] <= time.time():
+                return None
+            return entry[0], entry[1]
+
+    def discard(self, user_id):
+        self.pop(user_id)
+
+    def count(self, state=None):
+        with self._lock:
+            self._evict(time.time())
+            if state is None:
+                return len(self._states)
+            return sum(1 for s, _, _ in self._states.values() if s == state)
+
+
+class StateRouter:
+    """Маршрутизирует сообщение по состоянию пользователя одним поиском в хранилище."""
+
+    def __init__(self, store):
+        self.store = store
+        self._handlers = {}
+
+    def route(self, state):
+        def decorator(func):
+            self._handlers[state] = func
+            return func
+        return decorator
+
+    def dispatch(self, message, default=None):
+        entry = self.store.pop(message.from_user.id)
+        if entry is not None:
+            state, payload = entry
+            handler = self._handlers.get(state)
+            if handler:
+                return handler(message, payload)
+        if default:
+            return default(message)
+        return None
+
+
+conversations = ConversationStore(
+    ttl=getattr(settings, "CONVERSATION_TTL", 900),
+    path=getattr(settings, "CONVERSATION_STORE_PATH", None),
+)
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+from telebot.asyncio_handler_backends import BaseMiddleware as AsyncBaseMiddleware
+from telebot.handler_backends import BaseMiddleware
+
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", 5000),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("cache_size", -64 * 1024),
+    ("temp_store", "MEMORY"),
+)
+
+_last_optimize = 0.0
+_optimize_lock = threading.Lock()
+
+
+def tune_sqlite(conn):
+    """Применяет SQLITE_PRAGMAS к новому подключению SQLite (если включён SQLITE_TUNING).
+
+    PRAGMA optimize сюда не входит: его раз в SQLITE_OPTIMIZE_INTERVAL
+    запускает optimize_sqlite из воркера очереди исходящих.
+    """
+    if conn.vendor != "sqlite" or not getattr(settings, "SQLITE_TUNING", False):
+        return
+    with conn.cursor() as cursor:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def optimize_sqlite(force=False):
+    """Запускает PRAGMA optimize (ANALYZE по необходимости) не чаще SQLITE_OPTIMIZE_INTERVAL."""
+    global _last_optimize
+    if connection.vendor != "sqlite" or not getattr(settings, "SQLITE_TUNING", False):
+        return False
+    interval = getattr(settings, "SQLITE_OPTIMIZE_INTERVAL", 3600)
+    with _optimize_lock:
+        now = time.monotonic()
+        if not force and now - _last_optimize < interval:
+            return False
+        _last_optimize = now
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA optimize")
+    return True
+
+
+class DbConnectionMiddleware(BaseMiddleware):
+    """Закрывает устаревшие подключения к БД до и после каждого обработчика бота.
+
+    Обработчики выполняются в потоках TeleBot, которые живут всё время работы
+    бота; без этого подключение потока не возвращается в пул и не
+    переоткрывается после CONN_MAX_AGE.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ["message", "callback_query"]
+
+    def pre_process(self, message, data):
+        close_old_connections()
+
+    def post_process(self, message, data, exception):
+        close_old_connections()
+
+
+class AsyncDbConnectionMiddleware(AsyncBaseMiddleware):
+    """То же для AsyncTeleBot: подключения живут в потоке sync_to_async."""
+
+    def __init__(self):
+        super().__init__()
+        self.update_types = ["message", "callback_query"]
+
+    async def pre_process(self, message, data):
+        await sync_to_async(close_old_connections)()
+
+    async def post_process(self, message, data, exception):
+        await sync_to_async(close_old_connections)()
+
+
+@contextmanager
+def db_task():
+    """Граница единицы работы в долгоживущем потоке (таймер, воркер очереди)."""
+    close_old_connections()
+    try:
+        yield
+    finally:
+        close_old_connections()
+
+
+@contextmanager
+def temporary_test_database():
+    """Создаёт временную тестовую БД для нагрузочных прогонов и удаляет её после."""
+    tmpdir = None
+    if connection.vendor == "sqlite":
+        # Файл, а не :memory:, чтобы потоки работали с одной и той же базой
+        tmpdir = tempfile.mkdtemp()
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(tmpdir, "test.sqlite3")
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
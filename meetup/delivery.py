@@ -0,0 +1,202 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from django.conf import settings
+from telebot.apihelper import ApiTelegramException as TelegramError
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate токенов в секунду, не более capacity."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, reserve: float = 0.0) -> float:
+        """Забирает токен и возвращает 0, либо возвращает время ожидания в секундах.
+
+        reserve — сколько токенов должно остаться в bucket после выдачи.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= 1 + reserve:
+                self._tokens -= 1
+                return 0.0
+            return (1 + reserve - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Запрещает выдачу токенов на seconds секунд (например, после 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    @property
+    def idle(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens >= self.capacity
+
+
+class DeliveryResult(NamedTuple):
+    chat_id: str
+    ok: bool
+    attempts: int
+    error: str = None
+    error_code: int = None
+    # Чат упёрся в свой лимит: сообщение не отправлялось, повторить не раньше чем через столько секунд
+    retry_in: float = None
+
+
+def retry_after(exc: TelegramError):
+    """Возвращает retry_after из ответа 429 или None."""
+    if exc.error_code != 429:
+        return None
+    params = (exc.result_json or {}).get("parameters") or {}
+    return params.get("retry_after", 1)
+
+
+class DeliveryEngine:
+    """Рассылает сообщения через пул потоков с учётом лимитов Telegram.
+
+    Глобальный bucket ограничивает общий поток сообщений (~30/с), отдельные
+    bucket'ы на каждый чат — частоту сообщений в один чат. На ответ 429
+    движок приостанавливает глобальный bucket на retry_after и повторяет отправку.
+    Лимита отдельного чата рабочие потоки не ждут: такое сообщение откладывается.
+    С global_rate=None общий лимит и паузу после 429 берёт на себя PriorityGate
+    транспорта, и рассылка не ограничивается дважды.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, workers=8, max_attempts=3):
+        self.global_bucket = TokenBucket(global_rate) if global_rate else None
+        self.chat_rate = chat_rate
+        self.max_attempts = max_attempts
+        self._chat_buckets = {}
+        self._chat_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="delivery")
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        with self._chat_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self._chat_buckets) >= 10000:
+                    self._chat_buckets = {
+                        k: b for k, b in self._chat_buckets.items() if not b.idle
+                    }
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+            return bucket
+
+    def send_one(self, send, chat_id, *args, **kwargs) -> DeliveryResult:
+        """Отправляет одно сообщение в текущем потоке, соблюдая лимиты и повторяя при 429."""
+        attempt = 1
+        while True:
+            result = self._attempt(send, chat_id, attempt, args, kwargs)
+            if result.retry_in is None:
+                return result
+            time.sleep(result.retry_in)
+            attempt = result.attempts + 1
+
+    def _attempt(self, send, chat_id, first_attempt, args, kwargs) -> DeliveryResult:
+        """Попытки отправки без ожидания лимита чата: рабочие потоки пула не спят
+        из-за одного чата, а возвращают результат с retry_in."""
+        chat_bucket = self._chat_bucket(chat_id)
+        error = error_code = None
+        attempt = first_attempt
+        for attempt in range(first_attempt, self.max_attempts + 1):
+            wait = chat_bucket.try_acquire()
+            if wait:
+                return DeliveryResult(chat_id, False, attempt - 1, retry_in=wait)
+            if self.global_bucket:
+                self.global_bucket.acquire()
+            try:
+                send(chat_id, *args, **kwargs)
+                return DeliveryResult(chat_id, True, attempt)
+            except TelegramError as e:
+                error, error_code = e.description, e.error_code
+                delay = retry_after(e)
+                if delay is None:
+                    break
+                if self.global_bucket:
+                    self.global_bucket.pause(delay)
+            except Exception as e:
+                error = str(e)
+                break
+        return DeliveryResult(chat_id, False, attempt, error, error_code)
+
+    def _submit(self, *args, **kwargs):
+        # Потоки пула наследуют контекст вызывающего, в том числе полосу qos
+        return self._executor.submit(contextvars.copy_context().run, *args, **kwargs)
+
+    def fan_out(self, send, chat_ids, *args, **kwargs) -> list:
+        """Отправляет сообщение каждому chat_id, возвращает результаты в исходном порядке.
+
+        Чаты, упёршиеся в свой лимит, отправляются следующим кругом; ждёт
+        вызывающий поток, а не рабочие потоки пула.
+        """
+        results = [None] * len(chat_ids)
+        todo = [(i, chat_id, 1) for i, chat_id in enumerate(chat_ids)]
+        while todo:
+            futures = [
+                (i, chat_id, self._submit(self._attempt, send, chat_id, first, args, kwargs))
+                for i, chat_id, first in todo
+            ]
+            todo, delay = [], 0.0
+            for i, chat_id, future in futures:
+                result = future.result()
+                if result.retry_in is None:
+                    results[i] = result
+                else:
+                    todo.append((i, chat_id, result.attempts + 1))
+                    delay = max(delay, result.retry_in)
+            if todo:
+                time.sleep(delay)
+        return results
+
+    def send_many(self, send, messages) -> list:
+        """Как fan_out, но для разных сообщений: messages — пары (chat_id, kwargs).
+
+        Не ждёт лимитов отдельных чатов: такие сообщения возвращаются с
+        retry_in, и вызывающий сам решает, когда их повторить.
+        """
+        futures = [
+            self._submit(self._attempt, send, chat_id, 1, (), kwargs)
+            for chat_id, kwargs in messages
+        ]
+        return [f.result() for f in futures]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_delivery_engine() -> DeliveryEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DeliveryEngine(
+                # Боты из meetup.transport отправляют через PriorityGate с общим лимитом процесса
+                global_rate=None,
+                chat_rate=getattr(settings, "TELEGRAM_CHAT_RATE", 1),
+                workers=getattr(settings, "TELEGRAM_DELIVERY_WORKERS", 8),
+            )
+        return _engine
@@ -0,0 +1,105 @@
+import itertools
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegramServer:
+    """Локальная замена Bot API для тестов и нагрузочных прогонов.
+
+    Записывает вызовы методов и отвечает успехом. Использование:
+    apihelper.API_URL = server.url + "/bot{0}/{1}".
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.bytes_received = 0
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                method = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+                with server._lock:
+                    server.calls.append(method)
+                    server.bytes_received += length
+                    message_id = next(server._message_ids)
+                result = {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": 1, "type": "private"},
+                }
+                if method == "sendPhoto":
+                    result["photo"] = [{"file_id": f"photo-{message_id}", "file_unique_id": "photo",
+                                        "width": 320, "height": 320}]
+                body = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "Тест", "username": f"user{user_id}"}
+
+
+def make_update(update_id, text, user_id=1):
+    """Обновление с текстовым сообщением от пользователя user_id."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def make_callback(update_id, data, user_id=1, message_id=1):
+    """Обновление с нажатием inline-кнопки data под сообщением message_id."""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "",
+            },
+        },
+    }
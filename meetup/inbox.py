@@ -0,0 +1,171 @@
+import html
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .delivery import get_delivery_engine, retry_after
+from .models import Question, Talk, UserProfile
+from .qos import NOTIFICATION, lane
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+PREVIEW_LENGTH = 200
+
+
+def encode_cursor(question):
+    """Курсор страницы для callback_data (лимит 64 байта): микросекунды created_at и id."""
+    return f"{(question.created_at - EPOCH) // timedelta(microseconds=1)}_{question.id}"
+
+
+def decode_cursor(cursor):
+    micros, pk = cursor.split("_")
+    return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+
+
+def unanswered_page(talk_id, speaker_id, cursor=None, limit=None):
+    """Страница неотвеченных вопросов доклада по индексу question_unanswered_idx.
+
+    Возвращает (вопросы, курсор следующей страницы или None).
+    """
+    limit = limit or getattr(settings, "INBOX_PAGE_SIZE", 5)
+    qs = (
+        Question.objects.unanswered()
+        .filter(talk_id=talk_id, talk__speaker_id=speaker_id)
+        .select_related("user")
+        .order_by("created_at", "id")
+    )
+    if cursor:
+        qs = qs.after(*decode_cursor(cursor))
+    rows = list(qs[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def speaker_talks(speaker_id):
+    return (
+        Talk.objects.filter(speaker_id=speaker_id)
+        .annotate(unanswered=Count("questions", filter=Q(questions__answer__isnull=True)))
+        .order_by("-event__date", "start_time")
+    )
+
+
+def _preview(question):
+    text = question.text if len(question.text) <= PREVIEW_LENGTH else question.text[:PREVIEW_LENGTH] + "…"
+    author = f"@{question.user.username}" if question.user else "аноним"
+    return f"<b>#{question.id}</b> {html.escape(author)}: {html.escape(text)}"
+
+
+def render_talk_list(profile):
+    """Экран /inbox: доклады докладчика с числом неотвеченных вопросов."""
+    talks = list(speaker_talks(profile.user_id)[:20])
+    markup = InlineKeyboardMarkup()
+    for talk in talks:
+        markup.add(InlineKeyboardButton(f"{talk.title} ({talk.unanswered})",
+                                        callback_data=f"inbox_{talk.id}"))
+    digest = "выключить" if profile.question_digest else "включить"
+    markup.add(InlineKeyboardButton(f"Сводка вопросов: {digest}", callback_data="digest_toggle"))
+    text = "📥 <b>Входящие вопросы</b>" if talks else "У вас нет докладов."
+    return text, markup
+
+
+def render_page(talk, speaker_id, cursor=None):
+    questions, next_cursor = unanswered_page(talk.id, speaker_id, cursor)
+    lines = [f"📥 <b>{html.escape(talk.title)}</b>", ""]
+    lines += [_preview(q) for q in questions] or ["Неотвеченных вопросов нет."]
+    markup = InlineKeyboardMarkup()
+    for q in questions:
+        markup.add(InlineKeyboardButton(f"Ответить на #{q.id}", callback_data=f"reply_{q.id}"))
+    nav = [InlineKeyboardButton("◀ К докладам", callback_data="inbox")]
+    if next_cursor:
+        nav.append(InlineKeyboardButton("Далее ▶", callback_data=f"inbox_{talk.id}_{next_cursor}"))
+    markup.row(*nav)
+    return "\n\n".join(lines), markup
+
+
+def render_digest(talks, latest):
+    lines = ["📥 <b>Сводка вопросов</b>", ""]
+    lines += [f"«{html.escape(talk.title)}»: {talk.unanswered} без ответа" for talk in talks]
+    if latest:
+        lines += ["", "Последние:"] + [_preview(q) for q in latest]
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton("Открыть входящие", callback_data="inbox")]])
+    return "\n".join(lines), markup
+
+
+def send_digests(now=None):
+    """Обновляет сводку у докладчиков, у которых появились новые вопросы.
+
+    Одна сводка на докладчика: сообщение редактируется на месте, а если его
+    больше нельзя отредактировать — отправляется заново. Возвращает число
+    обновлённых сводок.
+    """
+    from .transport import get_bot
+
+    bot = get_bot()
+    if not bot:
+        return 0
+    now = now or timezone.now()
+    talks = (
+        Talk.objects.filter(speaker__userprofile__question_digest=True)
+        .annotate(
+            unanswered=Count("questions", filter=Q(questions__answer__isnull=True)),
+            newest=Max("questions__created_at", filter=Q(questions__answer__isnull=True)),
+        )
+        .filter(unanswered__gt=0)
+        .order_by("start_time")
+    )
+    by_speaker = {}
+    for talk in talks:
+        by_speaker.setdefault(talk.speaker_id, []).append(talk)
+    if not by_speaker:
+        return 0
+
+    profiles = UserProfile.objects.filter(
+        user_id__in=by_speaker, unreachable_at__isnull=True
+    ).exclude(telegram_id="")
+    engine = get_delivery_engine()
+    updated = []
+    for profile in profiles:
+        own_talks = by_speaker[profile.user_id]
+        newest = max(talk.newest for talk in own_talks)
+        if profile.digest_updated_at and newest <= profile.digest_updated_at:
+            continue
+        latest = list(
+            Question.objects.unanswered()
+            .filter(talk__speaker_id=profile.user_id)
+            .select_related("user")
+            .order_by("-created_at")[:5]
+        )
+        text, markup = render_digest(own_talks, latest)
+        with lane(NOTIFICATION):
+            result = engine.send_one(_publish_digest, profile.telegram_id,
+                                     bot=bot, profile=profile, text=text, markup=markup)
+        if result.ok:
+            profile.digest_updated_at = now
+            updated.append(profile)
+        else:
+            logger.warning("Не удалось обновить сводку для %s: %s", profile.telegram_id, result.error)
+    # bulk_update не шлёт post_save: кеш ролей эти поля не затрагивают
+    UserProfile.objects.bulk_update(updated, ["digest_message_id", "digest_updated_at"])
+    return len(updated)
+
+
+def _publish_digest(chat_id, bot, profile, text, markup):
+    if profile.digest_message_id:
+        try:
+            bot.edit_message_text(chat_id=chat_id, message_id=profile.digest_message_id,
+                                  text=text, reply_markup=markup)
+            return
+        except ApiTelegramException as e:
+            if retry_after(e) is not None:
+                raise
+            if "message is not modified" in str(e):
+                return
+            logger.info("Сводка %s не редактируется, отправляем заново", chat_id)
+    message = bot.send_message(chat_id, text, reply_markup=markup)
+    profile.digest_message_id = message.message_id
@@ -0,0 +1,167 @@
+import atexit
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from .db import db_task
+from .models import Question, Talk
+from .outbox import enqueue_many
+
+logger = logging.getLogger(__name__)
+
+# Пауза между повторами записи после ошибки (например, «database is locked»)
+MAX_RETRY_DELAY = 5.0
+CLOSE_ATTEMPTS = 5
+
+
+class PendingQuestion(NamedTuple):
+    talk_id: int
+    user_id: int
+    text: str
+
+
+class QuestionBuffer:
+    """Буфер отложенной записи вопросов слушателей.
+
+    Обработчик кладёт вопрос в буфер и сразу отвечает пользователю. Фоновый
+    поток раз в flush_interval секунд (или как только набралось max_batch
+    вопросов) записывает их одним bulk_create и в той же транзакции ставит в
+    очередь исходящих уведомления докладчикам. Если запись не удалась, пачка
+    возвращается в начало буфера и повторяется с нарастающей паузой; отбрасываются
+    только вопросы к удалённым докладам. close() дописывает остаток, поэтому при
+    остановке бота вопросы не теряются.
+    """
+
+    def __init__(self, flush_interval=0.25, max_batch=200):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._items = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def submit(self, talk_id, user_id, text):
+        item = PendingQuestion(talk_id, user_id, text)
+        with self._cond:
+            if not self._closed:
+                self._items.append(item)
+                self._ensure_thread()
+                if len(self._items) >= self.max_batch:
+                    self._cond.notify()
+                return
+        # После остановки буфера пишем сразу
+        self._write([item])
+
+    def flush(self):
+        """Записывает накопленные вопросы в текущем потоке и возвращает их число."""
+        with self._flush_lock:
+            with self._cond:
+                items, self._items = self._items, []
+            if items:
+                try:
+                    self._write(items)
+                except Exception:
+                    # Пользователям уже ответили «отправлен»: вернуть пачку и повторить
+                    with self._cond:
+                        self._items[:0] = items
+                    raise
+            return len(items)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+        delay = self.flush_interval
+        for attempt in range(1, CLOSE_ATTEMPTS + 1):
+            try:
+                self.flush()
+                return
+            except Exception:
+                if attempt == CLOSE_ATTEMPTS:
+                    raise
+                logger.exception("Ошибка записи вопросов при остановке, повтор через %.1f с", delay)
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="question-buffer", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        delay = 0.0
+        while True:
+            with self._cond:
+                if delay:
+                    self._cond.wait_for(lambda: self._closed, timeout=delay)
+                self._cond.wait_for(lambda: self._items or self._closed)
+                if self._closed:
+                    return
+                self._cond.wait_for(
+                    lambda: len(self._items) >= self.max_batch or self._closed,
+                    timeout=self.flush_interval,
+                )
+                if self._closed:
+                    return
+            try:
+                with db_task():
+                    self.flush()
+                delay = 0.0
+            except Exception:
+                delay = min(max(delay * 2, self.flush_interval), MAX_RETRY_DELAY)
+                logger.exception("Ошибка записи пачки вопросов, повтор через %.1f с", delay)
+
+    def _write(self, items):
+        from .services import speaker_notification
+
+        talks = Talk.objects.select_related("speaker__userprofile").in_bulk(
+            {item.talk_id for item in items}
+        )
+        users = User.objects.in_bulk({item.user_id for item in items if item.user_id})
+        questions = []
+        for item in items:
+            talk = talks.get(item.talk_id)
+            if talk is None:
+                logger.warning("Доклад %s удалён, вопрос отброшен", item.talk_id)
+                continue
+            questions.append(Question(talk=talk, user=users.get(item.user_id), text=item.text))
+        if not questions:
+            return
+
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                Question.objects.bulk_create(questions)
+                # bulk_create не шлёт post_save, поэтому уведомления ставим здесь
+                enqueue_many(filter(None, map(speaker_notification, questions)))
+            else:
+                # Без RETURNING у строк не будет id для кнопки «Ответить»:
+                # сохраняем по одной, уведомления поставит post_save
+                for question in questions:
+                    question.save()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_question_buffer() -> QuestionBuffer:
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = QuestionBuffer(
+                flush_interval=getattr(settings, "QUESTION_FLUSH_INTERVAL", 0.25),
+                max_batch=getattr(settings, "QUESTION_BATCH_SIZE", 200),
+            )
+            atexit.register(_buffer.close)
+        return _buffer
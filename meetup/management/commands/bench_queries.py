@@ -0,0 +1,78 @@
+import time
+from datetime import time as dtime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from meetup.db import temporary_test_database
+from meetup.models import Event, Question, Talk, UserProfile
+from meetup.outbox import due_messages
+from meetup.render_cache import get_program, invalidate_program
+from meetup.roles import RoleCache
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет горячие ORM-запросы обработчиков бота на текущем бэкенде БД "
+        "(временная тестовая база). Запустите с DB_ENGINE=sqlite3 и DB_ENGINE=postgresql, "
+        "чтобы сравнить бэкенды."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=500)
+        parser.add_argument("--users", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with temporary_test_database():
+            self.run(options["iterations"], options["users"])
+
+    def run(self, iterations, users):
+        speaker = User.objects.create(username="bench_speaker")
+        User.objects.bulk_create(User(username=f"bench{i}") for i in range(users))
+        user_ids = list(User.objects.filter(username__startswith="bench").values_list("id", flat=True))
+        UserProfile.objects.bulk_create(
+            UserProfile(user_id=user_id, telegram_id=str(100000 + n))
+            for n, user_id in enumerate(user_ids)
+        )
+        event = Event.objects.create(
+            title="Бенчмарк", date=timezone.now() + timedelta(hours=1), description=""
+        )
+        talks = [
+            Talk.objects.create(
+                event=event, speaker=speaker, title=f"Доклад {n}", description="",
+                start_time=dtime(10 + n), end_time=dtime(10 + n, 45),
+            )
+            for n in range(8)
+        ]
+        roles = RoleCache(ttl=0)
+
+        def program():
+            invalidate_program(event.id)
+            get_program(event.id)
+
+        benchmarks = [
+            ("роль пользователя", lambda i: roles.get(100000 + i % users)),
+            ("активное мероприятие", lambda i: Event.objects.active_event()),
+            ("идущие доклады", lambda i: list(Talk.objects.live())),
+            ("программа мероприятия", lambda i: program()),
+            ("карточка доклада", lambda i: Talk.objects.select_related("event", "speaker")
+                .get(id=talks[i % len(talks)].id)),
+            ("новый вопрос", lambda i: Question.objects.create(
+                talk=talks[i % len(talks)], user_id=user_ids[i % users], text="Вопрос")),
+            ("пачка очереди исходящих", lambda i: due_messages(100)),
+        ]
+
+        self.stdout.write(f"Бэкенд: {connection.vendor}, итераций: {iterations}")
+        self.stdout.write(f"{'запрос':<26} {'сред. мкс':>10} {'p95 мкс':>10}")
+        for name, func in benchmarks:
+            timings = []
+            for i in range(iterations):
+                started = time.perf_counter()
+                func(i)
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            mean = sum(timings) / len(timings)
+            p95 = timings[int(0.95 * (len(timings) - 1))]
+            self.stdout.write(f"{name:<26} {mean * 1e6:>10.0f} {p95 * 1e6:>10.0f}")
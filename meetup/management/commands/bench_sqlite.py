@@ -0,0 +1,89 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from meetup.db import SQLITE_PRAGMAS
+
+DEFAULT_PRAGMAS = (("busy_timeout", 5000),)
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает пропускную способность записи SQLite с настройками по умолчанию "
+        "и с профилем DB_SQLITE_TUNING (WAL, synchronous=NORMAL и т.д.) при конкурентных писателях. "
+        "Работает через sqlite3 напрямую, без ORM Django: хук tune_sqlite и transaction_mode "
+        "не участвуют, обе конфигурации пишут транзакциями BEGIN IMMEDIATE"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=8, help="Число пишущих потоков")
+        parser.add_argument("--rows", type=int, default=500, help="Вставок на поток")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'профиль':<12} {'вставок/с':>10} {'p95 мс':>8} {'блокировок':>11}")
+        for name, pragmas in (("default", DEFAULT_PRAGMAS), ("tuned", SQLITE_PRAGMAS)):
+            rate, p95, locked = self.run(pragmas, options["writers"], options["rows"])
+            self.stdout.write(f"{name:<12} {rate:>10.0f} {p95 * 1000:>8.1f} {locked:>11}")
+
+    def run(self, pragmas, writers, rows):
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "bench.sqlite3")
+
+        def connect():
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+            for pragma, value in pragmas:
+                conn.execute(f"PRAGMA {pragma} = {value}")
+            return conn
+
+        setup = connect()
+        # Имитирует вставку вопроса: одна строка на транзакцию, как в обработчике бота
+        setup.execute(
+            "CREATE TABLE question (id INTEGER PRIMARY KEY, talk_id INTEGER, user_id INTEGER, "
+            "text TEXT, created_at REAL)"
+        )
+        setup.execute("CREATE INDEX question_talk ON question (talk_id, created_at)")
+        setup.close()
+
+        timings = []
+        locked = []
+        lock = threading.Lock()
+
+        def writer(n):
+            conn = connect()
+            local, errors = [], 0
+            for i in range(rows):
+                started = time.perf_counter()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute(
+                        "INSERT INTO question (talk_id, user_id, text, created_at) VALUES (?, ?, ?, ?)",
+                        (i % 8, n, "Вопрос докладчику", time.time()),
+                    )
+                    conn.execute("COMMIT")
+                except sqlite3.OperationalError:
+                    errors += 1
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                local.append(time.perf_counter() - started)
+            conn.close()
+            with lock:
+                timings.extend(local)
+                locked.append(errors)
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+        timings.sort()
+        p95 = timings[int(0.95 * (len(timings) - 1))]
+        return len(timings) / elapsed, p95, sum(locked)
@@ -0,0 +1,262 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import time as dtime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from telebot import TeleBot, apihelper
+from telebot.types import Update
+
+from meetup.db import temporary_test_database
+from meetup.fake_telegram import FakeTelegramServer, make_callback, make_update
+from meetup.ingest import get_question_buffer
+from meetup.models import Event, OutboxMessage, Question, Talk, UserProfile
+from meetup.metrics import timed_api_request
+from meetup.transport import configure_asyncio_helper, get_session
+
+SPEAKER_TG_ID = 1
+FIRST_USER_TG_ID = 100000
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def _per_update(totals, kind, count, width, digits):
+    if kind not in totals:
+        return f"{'—':>{width}}"
+    return f"{totals[kind] / count:>{width}.{digits}f}"
+
+
+class Stats:
+    """Задержка, число запросов к БД и вызовов Bot API по видам обновлений."""
+
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.api_calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds, queries, api_calls, failed):
+        with self._lock:
+            self.latency[kind].append(seconds)
+            if queries is not None:
+                self.queries[kind] += queries
+                self.api_calls[kind] += api_calls
+            self.errors[kind] += failed
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный прогон AskTheSpeakerBot против локального фейкового Bot API "
+        "на временной тестовой базе данных"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Число участников")
+        parser.add_argument("--talks", type=int, default=5, help="Число докладов в программе")
+        parser.add_argument("--answers", type=int, default=100,
+                            help="Сколько вопросов докладчик ответит")
+        parser.add_argument("--concurrency", type=int, default=16,
+                            help="Сколько участников действуют одновременно")
+        parser.add_argument("--async", dest="async_runtime", action="store_true",
+                            help="Гонять обработчики режима --async в одном event loop")
+        parser.add_argument("--ungated", action="store_true",
+                            help="Отправлять в фейковый API мимо PriorityGate, без лимита "
+                                 "TELEGRAM_QOS_RATE: измеряется только стоимость обработчиков")
+
+    def handle(self, *args, **options):
+        with temporary_test_database(), FakeTelegramServer() as server:
+            if options["async_runtime"]:
+                asyncio.run(self.run_async(server, options))
+            else:
+                self.run(server, options)
+
+    def run(self, server, options):
+        from meetup.management.commands.run_askthespeakerbot import register_handlers, stop_updater
+
+        session = get_session()
+        apihelper.API_URL = server.url + "/bot{0}/{1}"
+        local = threading.local()
+        # По умолчанию тот же путь, что в работе бота: полосы QoS и метрики вызовов
+        sender = apihelper.CUSTOM_REQUEST_SENDER
+        if options["ungated"]:
+            sender = timed_api_request(session.request)
+
+        def counting_sender(*args, **kwargs):
+            local.api_calls = getattr(local, "api_calls", 0) + 1
+            return sender(*args, **kwargs)
+
+        apihelper.CUSTOM_REQUEST_SENDER = counting_sender
+
+        bot = TeleBot("0:loadtest", parse_mode="HTML", threaded=False)
+        register_handlers(bot)
+        talk_ids = self.create_program(options["talks"])
+        stats = Stats()
+        update_ids = iter(range(1, 10 ** 9))
+        ids_lock = threading.Lock()
+
+        def feed(kind, payload_factory, *args, **kwargs):
+            with ids_lock:
+                update_id = next(update_ids)
+            update = Update.de_json(payload_factory(update_id, *args, **kwargs))
+            local.api_calls = 0
+            failed = 0
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as ctx:
+                try:
+                    bot.process_new_updates([update])
+                except Exception:
+                    failed = 1
+            stats.add(kind, time.perf_counter() - started, len(ctx.captured_queries),
+                      local.api_calls, failed)
+
+        def attendee(i):
+            tg_id = FIRST_USER_TG_ID + i
+            talk_id = talk_ids[i % len(talk_ids)]
+            try:
+                feed("/start", make_update, "/start", user_id=tg_id)
+                feed("register", make_callback, "register", user_id=tg_id)
+                feed("open talk", make_callback, f"talk_{talk_id}", user_id=tg_id)
+                feed("ask", make_callback, f"ask_{talk_id}", user_id=tg_id)
+                feed("question", make_update, f"Вопрос №{i}", user_id=tg_id)
+            finally:
+                stop_updater(tg_id)
+                connections.close_all()
+
+        def answer(question_id):
+            try:
+                feed("reply", make_callback, f"reply_{question_id}", user_id=SPEAKER_TG_ID)
+                feed("answer", make_update, f"Ответ на {question_id}", user_id=SPEAKER_TG_ID)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            list(pool.map(attendee, range(options["users"])))
+        get_question_buffer().flush()
+        question_ids = list(
+            Question.objects.order_by("id").values_list("id", flat=True)[:options["answers"]]
+        )
+        # Ответы одного докладчика идут последовательно, как в реальном чате
+        for question_id in question_ids:
+            answer(question_id)
+        elapsed = time.perf_counter() - started
+
+        self.report(stats, elapsed, OutboxMessage.objects.count(), len(server.calls),
+                    server.bytes_received)
+
+    async def run_async(self, server, options):
+        """То же на AsyncTeleBot: участники — корутины одного event loop.
+
+        Запросы к БД идут в потоке sync_to_async, поэтому по видам
+        обновлений считаются только задержки и ошибки.
+        """
+        from asgiref.sync import sync_to_async
+        from telebot import asyncio_helper
+        from telebot.async_telebot import AsyncTeleBot
+
+        from meetup.management.commands.run_askthespeakerbot import (
+            astop_updater, register_async_handlers,
+        )
+
+        if not options["ungated"]:
+            configure_asyncio_helper()
+        asyncio_helper.API_URL = server.url + "/bot{0}/{1}"
+        bot = AsyncTeleBot("0:loadtest", parse_mode="HTML")
+        register_async_handlers(bot)
+        talk_ids = await sync_to_async(self.create_program)(options["talks"])
+        stats = Stats()
+        update_ids = itertools.count(1)
+        slots = asyncio.Semaphore(options["concurrency"])
+
+        async def feed(kind, payload_factory, *args, **kwargs):
+            update = Update.de_json(payload_factory(next(update_ids), *args, **kwargs))
+            failed = 0
+            started = time.perf_counter()
+            try:
+                await bot.process_new_updates([update])
+            except Exception:
+                failed = 1
+            stats.add(kind, time.perf_counter() - started, None, None, failed)
+
+        async def attendee(i):
+            tg_id = FIRST_USER_TG_ID + i
+            talk_id = talk_ids[i % len(talk_ids)]
+            async with slots:
+                try:
+                    await feed("/start", make_update, "/start", user_id=tg_id)
+                    await feed("register", make_callback, "register", user_id=tg_id)
+                    await feed("open talk", make_callback, f"talk_{talk_id}", user_id=tg_id)
+                    await feed("ask", make_callback, f"ask_{talk_id}", user_id=tg_id)
+                    await feed("question", make_update, f"Вопрос №{i}", user_id=tg_id)
+                finally:
+                    astop_updater(tg_id)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(attendee(i) for i in range(options["users"])))
+        await sync_to_async(get_question_buffer().flush)()
+        question_ids = await sync_to_async(list)(
+            Question.objects.order_by("id").values_list("id", flat=True)[:options["answers"]]
+        )
+        for question_id in question_ids:
+            await feed("reply", make_callback, f"reply_{question_id}", user_id=SPEAKER_TG_ID)
+            await feed("answer", make_update, f"Ответ на {question_id}", user_id=SPEAKER_TG_ID)
+        elapsed = time.perf_counter() - started
+        await bot.close_session()
+
+        outbox_rows = await OutboxMessage.objects.acount()
+        await sync_to_async(connections.close_all)()
+        self.report(stats, elapsed, outbox_rows, len(server.calls), server.bytes_received)
+
+    def create_program(self, talks):
+        speaker = User.objects.create(username="loadtest_speaker")
+        UserProfile.objects.create(user=speaker, telegram_id=str(SPEAKER_TG_ID), is_speaker=True)
+        event = Event.objects.create(
+            title="Нагрузочный митап",
+            date=timezone.now() + timedelta(hours=1),
+            description="",
+        )
+        return [
+            Talk.objects.create(
+                event=event, speaker=speaker, title=f"Доклад {n}", description="",
+                start_time=dtime(10 + n % 12), end_time=dtime(10 + n % 12, 45),
+            ).id
+            for n in range(talks)
+        ]
+
+    def report(self, stats, elapsed, outbox_rows, api_calls, api_bytes):
+        header = f"{'обновление':<12} {'кол-во':>7} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} " \
+                 f"{'БД/upd':>7} {'API/upd':>8} {'ошибок':>7}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        total = 0
+        for kind, values in stats.latency.items():
+            count = len(values)
+            total += count
+            self.stdout.write(
+                f"{kind:<12} {count:>7} "
+                f"{percentile(values, 50) * 1000:>8.1f} "
+                f"{percentile(values, 95) * 1000:>8.1f} "
+                f"{percentile(values, 99) * 1000:>8.1f} "
+                f"{_per_update(stats.queries, kind, count, 7, 1)} "
+                f"{_per_update(stats.api_calls, kind, count, 8, 2)} "
+                f"{stats.errors[kind]:>7}"
+            )
+        self.stdout.write("-" * len(header))
+        self.stdout.write(
+            f"Обновлений: {total} за {elapsed:.1f} с ({total / max(elapsed, 1e-9):.0f}/с), "
+            f"вызовов Bot API: {api_calls} ({api_bytes / 1024:.0f} КБ), "
+            f"строк в очереди исходящих: {outbox_rows}"
+        )
@@ -0,0 +1,71 @@
+import json
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Показывает метрики работающего AskTheSpeakerBot: задержки, запросы к БД, вызовы API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", help="Адрес /metrics.json; по умолчанию localhost:METRICS_PORT")
+        parser.add_argument("--prometheus", action="store_true",
+                            help="Вывести метрики в формате Prometheus как есть")
+
+    def handle(self, *args, **options):
+        url = options["url"]
+        if not url:
+            port = getattr(settings, "METRICS_PORT", None)
+            if not port:
+                raise CommandError("METRICS_PORT не задан в settings.py, укажите --url")
+            url = f"http://127.0.0.1:{port}/metrics.json"
+        if options["prometheus"]:
+            url = url.replace("/metrics.json", "/metrics")
+        try:
+            with urlopen(url, timeout=5) as response:
+                body = response.read().decode()
+        except URLError as e:
+            raise CommandError(f"Не удалось получить метрики: {e}")
+        if options["prometheus"]:
+            self.stdout.write(body)
+            return
+
+        stats = json.loads(body)
+        histograms = stats["histograms"]
+        errors = stats["counters"].get("meetup_handler_errors_total", {})
+        durations = histograms.get("meetup_handler_duration_seconds", {})
+        queries = histograms.get("meetup_handler_db_queries", {})
+        db_time = histograms.get("meetup_handler_db_duration_seconds", {})
+
+        self.stdout.write(
+            f"{'обработчик':<28} {'вызовов':>8} {'сред. мс':>9} {'p95 мс':>8} "
+            f"{'БД/вызов':>9} {'БД мс':>7} {'ошибок':>7}"
+        )
+        for name, hist in sorted(durations.items()):
+            count = hist["count"] or 1
+            self.stdout.write(
+                f"{name:<28} {hist['count']:>8} {hist['sum'] / count * 1000:>9.1f} "
+                f"{hist['p95'] * 1000:>8.0f} "
+                f"{queries.get(name, {}).get('sum', 0) / count:>9.1f} "
+                f"{db_time.get(name, {}).get('sum', 0) / count * 1000:>7.1f} "
+                f"{errors.get(name, 0):>7}"
+            )
+
+        api = histograms.get("meetup_telegram_api_duration_seconds", {})
+        api_errors = stats["counters"].get("meetup_telegram_api_errors_total", {})
+        if api:
+            self.stdout.write("")
+            self.stdout.write(f"{'метод Bot API':<28} {'вызовов':>8} {'сред. мс':>9} {'p95 мс':>8} {'ошибок':>7}")
+            for name, hist in sorted(api.items()):
+                count = hist["count"] or 1
+                self.stdout.write(
+                    f"{name:<28} {hist['count']:>8} {hist['sum'] / count * 1000:>9.1f} "
+                    f"{hist['p95'] * 1000:>8.0f} {api_errors.get(name, 0):>7}"
+                )
+
+        if stats["gauges"]:
+            self.stdout.write("")
+            for name, value in sorted(stats["gauges"].items()):
+                self.stdout.write(f"{name}: {value}")
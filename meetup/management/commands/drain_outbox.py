@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from meetup.outbox import run_worker
+from meetup.transport import get_bot
+
+
+class Command(BaseCommand):
+    help = "Доставляет сообщения из очереди исходящих (OutboxMessage) в Telegram"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100,
+                            help="Сколько строк очереди обрабатывать за проход")
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="Пауза в секундах, когда очередь пуста")
+        parser.add_argument("--once", action="store_true",
+                            help="Обработать очередь один раз и выйти")
+
+    def handle(self, *args, **options):
+        if not get_bot():
+            raise CommandError("TELEGRAM_BOT_TOKEN не задан в settings.py")
+        self.stdout.write(self.style.SUCCESS("Воркер очереди исходящих запущен."))
+        run_worker(options["batch_size"], options["interval"], options["once"])
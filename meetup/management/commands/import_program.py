@@ -0,0 +1,54 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from meetup.models import Event
+from meetup.program_import import PARSERS, ProgramImportError, import_program, parse_datetime
+
+
+class Command(BaseCommand):
+    help = (
+        "Импортирует мероприятие, доклады и докладчиков из CSV, JSON или ICS одной транзакцией. "
+        "Вместо уведомления на каждый доклад ставит одну рассылку и по сообщению каждому докладчику."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл программы (.csv, .json или .ics)")
+        parser.add_argument("--format", choices=sorted(PARSERS),
+                            help="Формат файла; по умолчанию по расширению")
+        parser.add_argument("--event-id", type=int,
+                            help="Обновить существующее мероприятие вместо создания нового")
+        parser.add_argument("--title", help="Название мероприятия")
+        parser.add_argument("--date", help="Дата и время мероприятия, например 2025-06-01 18:00")
+        parser.add_argument("--description", help="Описание мероприятия")
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or os.path.splitext(options["path"])[1].lstrip(".").lower()
+        if fmt not in PARSERS:
+            raise CommandError(f"Неизвестный формат {fmt!r}, укажите --format")
+        event = None
+        if options["event_id"]:
+            event = Event.objects.filter(id=options["event_id"]).first()
+            if event is None:
+                raise CommandError(f"Мероприятие {options['event_id']} не найдено")
+
+        started = time.perf_counter()
+        try:
+            with open(options["path"], encoding="utf-8", newline="") as stream:
+                event_data, rows = PARSERS[fmt](stream)
+            for field in ("title", "description"):
+                if options[field] is not None:
+                    event_data[field] = options[field]
+            if options["date"]:
+                event_data["date"] = parse_datetime(options["date"])
+            result = import_program(event_data, rows, event=event)
+        except (OSError, ProgramImportError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Создано' if result.event_created else 'Обновлено'} мероприятие «{result.event.title}» "
+            f"(id {result.event.id}): новых докладов {len(result.created)}, "
+            f"изменённых {len(result.updated)}, новых докладчиков {result.speakers_created} "
+            f"за {time.perf_counter() - started:.2f} с"
+        ))
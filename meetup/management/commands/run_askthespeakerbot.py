@@ -1,30 +1,57 @@
+import asyncio
+import hashlib
+import inspect
 import os
+import re
+import secrets
+import signal
 import threading
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 import django
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-import telebot
 from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
 django.setup()
 
+from meetup.conversation import ANSWER_QUESTION, ASK_QUESTION, BROADCAST, StateRouter, conversations
+from meetup.db import db_task
+from meetup.inbox import render_page, render_talk_list
+from meetup.ingest import get_question_buffer
+from meetup.media import media_cache
+from meetup.metrics import instrumented, registry, start_metrics_server
 from meetup.models import Event, Talk, Question, UserProfile
-from meetup.signals import PENDING_ANSWER
+from meetup.outbox import run_worker
+from meetup.qos import NOTIFICATION, TIMER, get_gate, lane, share_rate
+from meetup.recipients import mark_reachable
+from meetup.render_cache import get_active_event, get_program, get_talk
+from meetup.roles import get_roles
+from meetup.scheduler import get_async_scheduler, get_scheduler
+from meetup.sharding import ShardedDispatcher, serve_shard
+from meetup.transport import get_async_bot, get_bot
 
 LOGO_PATH = os.path.join(settings.BASE_DIR, "logo2.png")
-PENDING_QUESTION = {}
-UPDATERS = {}
-PENDING_BROADCAST = set()
+UPDATE_INTERVAL = 60
+POLLING_TIMEOUT = 20
+RE_ANSWER = re.compile(
+    r"^ответ\s+на\s+вопрос\s*#(?P<qid>\d+):\s*(?P<answer>.+)",
+    re.IGNORECASE | re.DOTALL
+)
+LAST_RENDER = {}
 
 
 def stop_updater(chat_id: int) -> None:
-    ev = UPDATERS.pop(chat_id, None)
-    if ev:
-        ev.set()
+    get_scheduler().cancel(chat_id)
+    LAST_RENDER.pop(chat_id, None)
+
+
+def astop_updater(chat_id: int) -> None:
+    get_async_scheduler().cancel(chat_id)
+    LAST_RENDER.pop(chat_id, None)
 
 
 def format_timedelta(td: timedelta) -> str:
@@ -58,11 +85,7 @@ def build_program_text(event: Event) -> str:
 
 def build_progress_bar(talk: Talk, length: int = 10) -> str:
     now = timezone.localtime()
-    start = timezone.make_aware(datetime.combine(talk.event.date.date(), talk.start_time))
-    end = timezone.make_aware(datetime.combine(talk.event.date.date(), talk.end_time))
-    if end <= start:
-        end += timedelta(days=1)
-    start, end = map(timezone.localtime, (start, end))
+    start, end = talk.starts_at, talk.ends_at
     total   = max((end - start).total_seconds(), 1)
     elapsed = (now - start).total_seconds()
     ratio   = max(0.0, min(elapsed / total, 1.0))
@@ -87,13 +110,11 @@ def build_talk_text(talk: Talk) -> str:
 
 
 def program_markup(event: Event, is_organizer: bool = False) -> InlineKeyboardMarkup:
-    now = timezone.localtime()
+    now = timezone.now()
     markup = InlineKeyboardMarkup()
-    for talk in event.talks.order_by("start_time"):
-        start = timezone.make_aware(datetime.combine(event.date.date(), talk.start_time))
-        end = timezone.make_aware(datetime.combine(event.date.date(), talk.end_time))
-        start, end = map(timezone.localtime, (start, end))
-        indicator = "🟢 " if start <= now <= end else ""
+    _, talks = get_program(event.id)
+    for talk in talks:
+        indicator = "🟢 " if talk.starts_at <= now <= talk.ends_at else ""
         time_str = talk.start_time.strftime("%H:%M")
         speaker = talk.speaker.get_full_name() or talk.speaker.username
         title = talk.title
@@ -114,252 +135,738 @@ def talk_markup(talk_id: int) -> InlineKeyboardMarkup:
     ])
 
 
-def schedule_program_timer(bot, chat_id, message_id, event, is_organizer: bool = False):
-    stop_updater(chat_id)
-    stop_event = threading.Event()
-    UPDATERS[chat_id] = stop_event
+def render_fingerprint(message_id, text, markup) -> str:
+    payload = f"{message_id}\0{text}\0{markup.to_json() if markup else ''}"
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
 
-    def worker():
-        while not stop_event.is_set():
-            try:
-                bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=build_program_text(event),
-                    reply_markup=program_markup(event, is_organizer=is_organizer),
-                )
-            except Exception:
-                pass
-            if timezone.localtime() >= timezone.localtime(event.date):
-                break
-            stop_event.wait(60)
 
-    threading.Thread(target=worker, daemon=True).start()
+def remember_render(chat_id, message_id, text, markup) -> None:
+    """Запоминает отпечаток последнего содержимого, отправленного в чат."""
+    LAST_RENDER[chat_id] = render_fingerprint(message_id, text, markup)
 
 
-def schedule_talk_timer(bot, chat_id, message_id, talk):
-    stop_updater(chat_id)
-    stop_event = threading.Event()
-    UPDATERS[chat_id] = stop_event
-    def worker():
-        while not stop_event.is_set():
-            try:
-                bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=build_talk_text(talk),
-                    reply_markup=talk_markup(talk.id),
-                )
-            except Exception:
-                pass
-            end = timezone.make_aware(datetime.combine(talk.event.date.date(), talk.end_time))
-            if timezone.localtime() >= timezone.localtime(end):
-                break
-            stop_event.wait(60)
-    threading.Thread(target=worker, daemon=True).start()
+def edit_if_changed(bot, chat_id, message_id, text, markup) -> bool:
+    """Редактирует сообщение, только если текст или клавиатура изменились."""
+    fingerprint = render_fingerprint(message_id, text, markup)
+    if LAST_RENDER.get(chat_id) == fingerprint:
+        return False
+    bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=markup)
+    LAST_RENDER[chat_id] = fingerprint
+    return True
 
 
-class Command(BaseCommand):
-    help = "Запускает AskTheSpeakerBot"
+async def aedit_if_changed(bot, chat_id, message_id, text, markup) -> bool:
+    fingerprint = render_fingerprint(message_id, text, markup)
+    if LAST_RENDER.get(chat_id) == fingerprint:
+        return False
+    await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=markup)
+    LAST_RENDER[chat_id] = fingerprint
+    return True
 
-    def handle(self, *args, **options):
-        token = getattr(settings, "TELEGRAM_BOT_TOKEN", None)
-        if not token:
-            raise CommandError("TELEGRAM_BOT_TOKEN не задан в settings.py")
-        bot = telebot.TeleBot(token, parse_mode="HTML")
-
-        def show_program(chat_id, *, via_edit=None, is_organizer: bool = False):
-            now = timezone.now()
-            upcoming = Event.objects.filter(date__gte=now - timedelta(days=1)).order_by("date")
-            active = next((e for e in upcoming if e.is_active), None)
-            if not active:
-                text = "Митапов не запланировано."
-                markup = None
-                if is_organizer:
-                    markup = InlineKeyboardMarkup()
-                    markup.add(InlineKeyboardButton("Массовая рассылка", callback_data="mass_broadcast"))
-                if via_edit:
-                    try:
-                        bot.edit_message_text(chat_id=chat_id, message_id=via_edit.id,
-                                              text=text, reply_markup=markup)
-                    except Exception:
-                        bot.send_message(chat_id, text, reply_markup=markup)
-                else:
-                    bot.send_message(chat_id, text, reply_markup=markup)
-                stop_updater(chat_id)
-                return
-            text = build_program_text(active)
-            markup = program_markup(active, is_organizer=is_organizer)
+
+def schedule_program_timer(bot, chat_id, message_id, event, is_organizer: bool = False):
+    def refresh():
+        current, _ = get_program(event.id)
+        if current is None:
+            LAST_RENDER.pop(chat_id, None)
+            return False
+        try:
+            with lane(TIMER):
+                edit_if_changed(bot, chat_id, message_id, build_program_text(current),
+                                program_markup(current, is_organizer=is_organizer))
+        except Exception:
+            pass
+        keep = timezone.localtime() < timezone.localtime(current.date)
+        if not keep:
+            LAST_RENDER.pop(chat_id, None)
+        return keep
+
+    get_scheduler().schedule(chat_id, refresh, interval=UPDATE_INTERVAL)
+
+
+def schedule_talk_timer(bot, chat_id, message_id, talk):
+    def refresh():
+        current = get_talk(talk.event_id, talk.id)
+        if current is None:
+            LAST_RENDER.pop(chat_id, None)
+            return False
+        try:
+            with lane(TIMER):
+                edit_if_changed(bot, chat_id, message_id, build_talk_text(current), talk_markup(current.id))
+        except Exception:
+            pass
+        keep = timezone.now() < current.ends_at
+        if not keep:
+            LAST_RENDER.pop(chat_id, None)
+        return keep
+
+    get_scheduler().schedule(chat_id, refresh, interval=UPDATE_INTERVAL)
+
+
+def aschedule_program_timer(bot, chat_id, message_id, event, is_organizer: bool = False):
+    async def refresh():
+        current, _ = await sync_to_async(get_program)(event.id)
+        if current is None:
+            LAST_RENDER.pop(chat_id, None)
+            return False
+        try:
+            markup = await sync_to_async(program_markup)(current, is_organizer=is_organizer)
+            await aedit_if_changed(bot, chat_id, message_id, build_program_text(current), markup)
+        except Exception:
+            pass
+        keep = timezone.localtime() < timezone.localtime(current.date)
+        if not keep:
+            LAST_RENDER.pop(chat_id, None)
+        return keep
+
+    get_async_scheduler().schedule(chat_id, refresh, interval=UPDATE_INTERVAL)
+
+
+def aschedule_talk_timer(bot, chat_id, message_id, talk):
+    async def refresh():
+        current = await sync_to_async(get_talk)(talk.event_id, talk.id)
+        if current is None:
+            LAST_RENDER.pop(chat_id, None)
+            return False
+        try:
+            await aedit_if_changed(bot, chat_id, message_id, build_talk_text(current), talk_markup(current.id))
+        except Exception:
+            pass
+        keep = timezone.now() < current.ends_at
+        if not keep:
+            LAST_RENDER.pop(chat_id, None)
+        return keep
+
+    get_async_scheduler().schedule(chat_id, refresh, interval=UPDATE_INTERVAL)
+
+
+def register_handlers(bot):
+    """Регистрирует обработчики AskTheSpeakerBot на экземпляре бота."""
+
+    def show_program(chat_id, *, via_edit=None, is_organizer: bool = False):
+        active = get_active_event()
+        if not active:
+            text = "Митапов не запланировано."
+            markup = None
+            if is_organizer:
+                markup = InlineKeyboardMarkup()
+                markup.add(InlineKeyboardButton("Массовая рассылка", callback_data="mass_broadcast"))
             if via_edit:
                 try:
                     bot.edit_message_text(chat_id=chat_id, message_id=via_edit.id,
                                           text=text, reply_markup=markup)
-                    msg_id = via_edit.id
                 except Exception:
-                    msg = bot.send_message(chat_id, text, reply_markup=markup)
-                    msg_id = msg.message_id
+                    bot.send_message(chat_id, text, reply_markup=markup)
             else:
+                bot.send_message(chat_id, text, reply_markup=markup)
+            stop_updater(chat_id)
+            return
+        text = build_program_text(active)
+        markup = program_markup(active, is_organizer=is_organizer)
+        if via_edit:
+            try:
+                bot.edit_message_text(chat_id=chat_id, message_id=via_edit.id,
+                                      text=text, reply_markup=markup)
+                msg_id = via_edit.id
+            except Exception:
                 msg = bot.send_message(chat_id, text, reply_markup=markup)
                 msg_id = msg.message_id
-            schedule_program_timer(bot, chat_id, msg_id, active, is_organizer=is_organizer)
-
-        @bot.message_handler(commands=["start"])
-        def start_handler(msg):
-            chat_id = msg.chat.id
-            tg_user = msg.from_user
-            is_organizer = UserProfile.objects.filter(
-                telegram_id=str(tg_user.id),
-                is_organizer=True
-            ).exists()
-            if UserProfile.objects.filter(telegram_id=str(tg_user.id)).exists():
-                show_program(chat_id, is_organizer=is_organizer)
-                return
-            caption = "Если хотите принять участие, нажмите \"Продолжить\"."
-            markup = InlineKeyboardMarkup(
-                [[InlineKeyboardButton("Продолжить", callback_data="register")]]
-            )
-            if os.path.isfile(LOGO_PATH):
-                with open(LOGO_PATH, "rb") as p:
-                    bot.send_photo(chat_id, p, caption=caption, reply_markup=markup)
-            else:
-                bot.send_message(chat_id, caption, reply_markup=markup)
-
-        @bot.callback_query_handler(func=lambda c: c.data == "register")
-        def cb_register(call):
-            chat_id = call.message.chat.id
-            tg_user = call.from_user
-            if not UserProfile.objects.filter(telegram_id=str(tg_user.id)).exists():
-                from django.contrib.auth.models import User
-                username = tg_user.username or f"tg_{tg_user.id}"
-                user, _ = User.objects.get_or_create(username=username)
-                UserProfile.objects.create(user=user, telegram_id=str(tg_user.id))
-            is_organizer = UserProfile.objects.filter(
-                telegram_id=str(tg_user.id),
-                is_organizer=True
-            ).exists()
-            bot.answer_callback_query(call.id, text="Регистрация завершена")
-            show_program(chat_id, via_edit=call.message, is_organizer=is_organizer)
-
-        @bot.callback_query_handler(func=lambda c: c.data.startswith("talk_"))
-        def cb_talk(call):
-            chat_id = call.message.chat.id
-            talk_id = int(call.data.split("_")[1])
-            talk = Talk.objects.select_related("event", "speaker").get(id=talk_id)
-            bot.edit_message_text(chat_id=chat_id, message_id=call.message.id,
-                                  text=build_talk_text(talk), reply_markup=talk_markup(talk.id))
-            bot.answer_callback_query(call.id)
-            schedule_talk_timer(bot, chat_id, call.message.id, talk)
-
-        @bot.callback_query_handler(func=lambda c: c.data == "back_program")
-        def cb_back(call):
-            is_organizer = UserProfile.objects.filter(
-                telegram_id=str(call.from_user.id),
-                is_organizer=True
-            ).exists()
-            bot.answer_callback_query(call.id)
-            show_program(call.message.chat.id, via_edit=call.message, is_organizer=is_organizer)
-
-        @bot.callback_query_handler(func=lambda c: c.data.startswith("ask_"))
-        def cb_ask(call):
-            talk_id = int(call.data.split("_")[1])
-            PENDING_QUESTION[call.from_user.id] = talk_id
-            bot.answer_callback_query(call.id)
-            bot.send_message(call.message.chat.id, "Напишите свой вопрос:")
-
-        @bot.callback_query_handler(func=lambda c: c.data.startswith("reply_"))
-        def cb_reply_to_question(call):
-            question_id = int(call.data.split("_")[1])
-            PENDING_ANSWER[call.from_user.id] = question_id
-            bot.answer_callback_query(call.id)
-            bot.send_message(call.message.chat.id, "Напишите ваш ответ:")
-
-        @bot.message_handler(func=lambda m: m.from_user.id in PENDING_QUESTION)
-        def handle_question(msg):
-            user_id = msg.from_user.id
-            talk_id = PENDING_QUESTION.pop(user_id)
-            talk = Talk.objects.select_related("speaker", "speaker__userprofile").get(id=talk_id)
-            user_obj = None
-            try:
-                profile = UserProfile.objects.get(telegram_id=str(msg.from_user.id))
-                user_obj = profile.user
-            except UserProfile.DoesNotExist:
-                pass
-            Question.objects.create(talk=talk, user=user_obj, text=msg.text.strip())
-            bot.reply_to(msg, "Вопрос отправлен докладчику.")
+        else:
+            msg = bot.send_message(chat_id, text, reply_markup=markup)
+            msg_id = msg.message_id
+        remember_render(chat_id, msg_id, text, markup)
+        schedule_program_timer(bot, chat_id, msg_id, active, is_organizer=is_organizer)
+
+    @bot.message_handler(commands=["start"])
+    @instrumented("start")
+    def start_handler(msg):
+        chat_id = msg.chat.id
+        roles = get_roles(msg.from_user.id)
+        if roles:
+            mark_reachable(msg.from_user.id)
+            show_program(chat_id, is_organizer=roles.is_organizer)
+            return
+        caption = "Если хотите принять участие, нажмите \"Продолжить\"."
+        markup = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("Продолжить", callback_data="register")]]
+        )
+        if os.path.isfile(LOGO_PATH):
+            media_cache.send_photo(bot, chat_id, LOGO_PATH, caption=caption, reply_markup=markup)
+        else:
+            bot.send_message(chat_id, caption, reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "register")
+    @instrumented("register")
+    def cb_register(call):
+        chat_id = call.message.chat.id
+        tg_user = call.from_user
+        roles = get_roles(tg_user.id)
+        if not roles:
+            from django.contrib.auth.models import User
+            username = tg_user.username or f"tg_{tg_user.id}"
+            user, _ = User.objects.get_or_create(username=username)
+            UserProfile.objects.create(user=user, telegram_id=str(tg_user.id))
+        bot.answer_callback_query(call.id, text="Регистрация завершена")
+        show_program(chat_id, via_edit=call.message, is_organizer=bool(roles and roles.is_organizer))
+
+    @bot.callback_query_handler(func=lambda c: c.data.startswith("talk_"))
+    @instrumented("talk")
+    def cb_talk(call):
+        chat_id = call.message.chat.id
+        talk_id = int(call.data.split("_")[1])
+        talk = Talk.objects.select_related("event", "speaker").get(id=talk_id)
+        text, markup = build_talk_text(talk), talk_markup(talk.id)
+        bot.edit_message_text(chat_id=chat_id, message_id=call.message.id,
+                              text=text, reply_markup=markup)
+        remember_render(chat_id, call.message.id, text, markup)
+        bot.answer_callback_query(call.id)
+        schedule_talk_timer(bot, chat_id, call.message.id, talk)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "back_program")
+    @instrumented("back_program")
+    def cb_back(call):
+        roles = get_roles(call.from_user.id)
+        bot.answer_callback_query(call.id)
+        show_program(call.message.chat.id, via_edit=call.message,
+                     is_organizer=bool(roles and roles.is_organizer))
+
+    @bot.callback_query_handler(func=lambda c: c.data.startswith("ask_"))
+    @instrumented("ask")
+    def cb_ask(call):
+        talk_id = int(call.data.split("_")[1])
+        conversations.set(call.from_user.id, ASK_QUESTION, talk_id)
+        bot.answer_callback_query(call.id)
+        bot.send_message(call.message.chat.id, "Напишите свой вопрос:")
+
+    @bot.callback_query_handler(func=lambda c: c.data.startswith("reply_"))
+    @instrumented("reply")
+    def cb_reply_to_question(call):
+        question_id = int(call.data.split("_")[1])
+        conversations.set(call.from_user.id, ANSWER_QUESTION, question_id)
+        bot.answer_callback_query(call.id)
+        bot.send_message(call.message.chat.id, "Напишите ваш ответ:")
+
+    router = StateRouter(conversations)
+
+    @router.route(ASK_QUESTION)
+    @instrumented("question")
+    def handle_question(msg, talk_id):
+        roles = get_roles(msg.from_user.id)
+        # Запись в БД и уведомление докладчика делает буфер пачками
+        get_question_buffer().submit(talk_id, roles.user_id if roles else None, msg.text.strip())
+        bot.reply_to(msg, "Вопрос отправлен докладчику.")
+    
+    @router.route(ANSWER_QUESTION)
+    @instrumented("answer")
+    def handle_answer(msg, question_id):
+        try:
+            question = Question.objects.select_related("user", "talk").get(id=question_id)
+            question.answer = msg.text.strip()
+            question.save()
+            bot.reply_to(msg, "Ответ сохранён и отправлен слушателю.")
+        except Question.DoesNotExist:
+            bot.reply_to(msg, "Вопрос не найден.")
+
+    @instrumented("speaker_answer")
+    def handle_speaker_answer(message):
+        roles = get_roles(message.from_user.id)
+        if not (roles and roles.is_speaker):
+            return
+        match = RE_ANSWER.match(message.text.strip())
+        if not match:
+            return
+        qid = match.group("qid")
+        answer = match.group("answer").strip()
+        try:
+            question = Question.objects.select_related("talk", "user").get(id=qid)
+        except Question.DoesNotExist:
+            bot.send_message(message.chat.id, f"Вопрос с ID #{qid} не найден.")
+            return
+        if roles.user_id != question.talk.speaker_id:
+            bot.send_message(message.chat.id, "Вы не являетесь спикером этого доклада.")
+            return
+        question.answer = answer
+        question.save()
+        bot.send_message(message.chat.id, "Ответ сохранён.")
+        if question.user:
             try:
-                profile = talk.speaker.userprofile
+                listener_profile = question.user.userprofile
+                if listener_profile.telegram_id:
+                    with lane(NOTIFICATION):
+                        bot.send_message(
+                            listener_profile.telegram_id,
+                            f"Ответ на ваш вопрос к докладу «{question.talk.title}»:\n\n{answer}"
+                        )
             except UserProfile.DoesNotExist:
                 pass
-        
-        @bot.message_handler(func=lambda m: m.from_user.id in PENDING_ANSWER)
-        def handle_answer(msg):
-            speaker_id = msg.from_user.id
-            question_id = PENDING_ANSWER.pop(speaker_id)
+
+    @bot.message_handler(commands=["inbox"])
+    @instrumented("inbox")
+    def inbox_handler(msg):
+        roles = get_roles(msg.from_user.id)
+        if not (roles and roles.is_speaker):
+            bot.reply_to(msg, "Входящие вопросы доступны только докладчикам.")
+            return
+        text, markup = render_talk_list(UserProfile.objects.get(id=roles.profile_id))
+        bot.send_message(msg.chat.id, text, reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "inbox" or c.data.startswith("inbox_"))
+    @instrumented("inbox_page")
+    def cb_inbox(call):
+        roles = get_roles(call.from_user.id)
+        if not (roles and roles.is_speaker):
+            bot.answer_callback_query(call.id, text="Недостаточно прав")
+            return
+        if call.data == "inbox":
+            text, markup = render_talk_list(UserProfile.objects.get(id=roles.profile_id))
+        else:
+            _, talk_id, *cursor = call.data.split("_", 2)
+            talk = Talk.objects.filter(id=talk_id, speaker_id=roles.user_id).first()
+            if talk is None:
+                bot.answer_callback_query(call.id, text="Доклад не найден")
+                return
+            text, markup = render_page(talk, roles.user_id, cursor[0] if cursor else None)
+        bot.answer_callback_query(call.id)
+        bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.id,
+                              text=text, reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "digest_toggle")
+    @instrumented("digest_toggle")
+    def cb_digest_toggle(call):
+        roles = get_roles(call.from_user.id)
+        if not (roles and roles.is_speaker):
+            bot.answer_callback_query(call.id, text="Недостаточно прав")
+            return
+        profile = UserProfile.objects.get(id=roles.profile_id)
+        profile.question_digest = not profile.question_digest
+        profile.save(update_fields=["question_digest"])
+        bot.answer_callback_query(
+            call.id, text="Сводка включена" if profile.question_digest else "Сводка выключена"
+        )
+        text, markup = render_talk_list(profile)
+        bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.id,
+                              text=text, reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "mass_broadcast")
+    @instrumented("mass_broadcast")
+    def cb_mass_broadcast(call):
+        user_id = call.from_user.id
+        roles = get_roles(user_id)
+        if not (roles and roles.is_organizer):
+            bot.answer_callback_query(call.id, text="Недостаточно прав")
+            return
+        conversations.set(user_id, BROADCAST)
+        bot.answer_callback_query(call.id)
+        bot.send_message(call.message.chat.id, "Введите сообщение для рассылки:")
+    
+    @router.route(BROADCAST)
+    @instrumented("mass_broadcast_text")
+    def handle_mass_broadcast(msg, payload):
+        from meetup.services import broadcast
+        result = broadcast(msg.text.strip())
+        bot.reply_to(
+            msg,
+            f"Рассылка завершена. Успешно отправлено: {result.sent}, "
+            f"не доставлено: {result.failed}",
+        )
+
+    @bot.message_handler(content_types=["text"])
+    def route_text(msg):
+        router.dispatch(msg, default=handle_speaker_answer)
+
+
+def _listener_chat(question):
+    """telegram_id автора вопроса или None (читает профиль, поэтому синхронная)."""
+    if not question.user:
+        return None
+    try:
+        return question.user.userprofile.telegram_id or None
+    except UserProfile.DoesNotExist:
+        return None
+
+
+def register_async_handlers(bot):
+    """Те же обработчики для AsyncTeleBot (режим --async).
+
+    Работа с Telegram идёт в event loop, запросы к БД — через async ORM и
+    sync_to_async, кешируемые помощники (роли, программа) вызываются так же
+    через sync_to_async.
+    """
+
+    async def show_program(chat_id, *, via_edit=None, is_organizer: bool = False):
+        active = await sync_to_async(get_active_event)()
+        if not active:
+            text = "Митапов не запланировано."
+            markup = None
+            if is_organizer:
+                markup = InlineKeyboardMarkup()
+                markup.add(InlineKeyboardButton("Массовая рассылка", callback_data="mass_broadcast"))
+            if via_edit:
+                try:
+                    await bot.edit_message_text(chat_id=chat_id, message_id=via_edit.id,
+                                                text=text, reply_markup=markup)
+                except Exception:
+                    await bot.send_message(chat_id, text, reply_markup=markup)
+            else:
+                await bot.send_message(chat_id, text, reply_markup=markup)
+            astop_updater(chat_id)
+            return
+        text = build_program_text(active)
+        markup = await sync_to_async(program_markup)(active, is_organizer=is_organizer)
+        if via_edit:
             try:
-                question = Question.objects.select_related("user", "talk").get(id=question_id)
-                question.answer = msg.text.strip()
-                question.save()
-                bot.reply_to(msg, "Ответ сохранён и отправлен слушателю.")
-            except Question.DoesNotExist:
-                bot.reply_to(msg, "Вопрос не найден.")
-
-        @bot.message_handler(func=lambda m: (UserProfile.objects.filter(telegram_id=str(m.from_user.id), is_speaker=True).exists() and m.from_user.id not in PENDING_BROADCAST))
-        def handle_speaker_answer(message):
-            import re
+                await bot.edit_message_text(chat_id=chat_id, message_id=via_edit.id,
+                                            text=text, reply_markup=markup)
+                msg_id = via_edit.id
+            except Exception:
+                msg = await bot.send_message(chat_id, text, reply_markup=markup)
+                msg_id = msg.message_id
+        else:
+            msg = await bot.send_message(chat_id, text, reply_markup=markup)
+            msg_id = msg.message_id
+        remember_render(chat_id, msg_id, text, markup)
+        aschedule_program_timer(bot, chat_id, msg_id, active, is_organizer=is_organizer)
+
+    @bot.message_handler(commands=["start"])
+    @instrumented("start")
+    async def start_handler(msg):
+        chat_id = msg.chat.id
+        roles = await sync_to_async(get_roles)(msg.from_user.id)
+        if roles:
+            await sync_to_async(mark_reachable)(msg.from_user.id)
+            await show_program(chat_id, is_organizer=roles.is_organizer)
+            return
+        caption = "Если хотите принять участие, нажмите \"Продолжить\"."
+        markup = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("Продолжить", callback_data="register")]]
+        )
+        if os.path.isfile(LOGO_PATH):
+            await media_cache.asend_photo(bot, chat_id, LOGO_PATH, caption=caption, reply_markup=markup)
+        else:
+            await bot.send_message(chat_id, caption, reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "register")
+    @instrumented("register")
+    async def cb_register(call):
+        chat_id = call.message.chat.id
+        tg_user = call.from_user
+        roles = await sync_to_async(get_roles)(tg_user.id)
+        if not roles:
             from django.contrib.auth.models import User
-            RE_ANSWER = re.compile(
-                r"^ответ\s+на\s+вопрос\s*#(?P<qid>\d+):\s*(?P<answer>.+)",
-                re.IGNORECASE | re.DOTALL
+            username = tg_user.username or f"tg_{tg_user.id}"
+            user, _ = await User.objects.aget_or_create(username=username)
+            await UserProfile.objects.acreate(user=user, telegram_id=str(tg_user.id))
+        await bot.answer_callback_query(call.id, text="Регистрация завершена")
+        await show_program(chat_id, via_edit=call.message, is_organizer=bool(roles and roles.is_organizer))
+
+    @bot.callback_query_handler(func=lambda c: c.data.startswith("talk_"))
+    @instrumented("talk")
+    async def cb_talk(call):
+        chat_id = call.message.chat.id
+        talk_id = int(call.data.split("_")[1])
+        talk = await Talk.objects.select_related("event", "speaker").aget(id=talk_id)
+        text, markup = build_talk_text(talk), talk_markup(talk.id)
+        await bot.edit_message_text(chat_id=chat_id, message_id=call.message.id,
+                                    text=text, reply_markup=markup)
+        remember_render(chat_id, call.message.id, text, markup)
+        await bot.answer_callback_query(call.id)
+        aschedule_talk_timer(bot, chat_id, call.message.id, talk)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "back_program")
+    @instrumented("back_program")
+    async def cb_back(call):
+        roles = await sync_to_async(get_roles)(call.from_user.id)
+        await bot.answer_callback_query(call.id)
+        await show_program(call.message.chat.id, via_edit=call.message,
+                           is_organizer=bool(roles and roles.is_organizer))
+
+    @bot.callback_query_handler(func=lambda c: c.data.startswith("ask_"))
+    @instrumented("ask")
+    async def cb_ask(call):
+        talk_id = int(call.data.split("_")[1])
+        conversations.set(call.from_user.id, ASK_QUESTION, talk_id)
+        await bot.answer_callback_query(call.id)
+        await bot.send_message(call.message.chat.id, "Напишите свой вопрос:")
+
+    @bot.callback_query_handler(func=lambda c: c.data.startswith("reply_"))
+    @instrumented("reply")
+    async def cb_reply_to_question(call):
+        question_id = int(call.data.split("_")[1])
+        conversations.set(call.from_user.id, ANSWER_QUESTION, question_id)
+        await bot.answer_callback_query(call.id)
+        await bot.send_message(call.message.chat.id, "Напишите ваш ответ:")
+
+    router = StateRouter(conversations)
+
+    @router.route(ASK_QUESTION)
+    @instrumented("question")
+    async def handle_question(msg, talk_id):
+        roles = await sync_to_async(get_roles)(msg.from_user.id)
+        get_question_buffer().submit(talk_id, roles.user_id if roles else None, msg.text.strip())
+        await bot.reply_to(msg, "Вопрос отправлен докладчику.")
+
+    @router.route(ANSWER_QUESTION)
+    @instrumented("answer")
+    async def handle_answer(msg, question_id):
+        try:
+            question = await Question.objects.select_related("user", "talk").aget(id=question_id)
+        except Question.DoesNotExist:
+            await bot.reply_to(msg, "Вопрос не найден.")
+            return
+        question.answer = msg.text.strip()
+        await question.asave()
+        await bot.reply_to(msg, "Ответ сохранён и отправлен слушателю.")
+
+    @instrumented("speaker_answer")
+    async def handle_speaker_answer(message):
+        roles = await sync_to_async(get_roles)(message.from_user.id)
+        if not (roles and roles.is_speaker):
+            return
+        match = RE_ANSWER.match(message.text.strip())
+        if not match:
+            return
+        qid = match.group("qid")
+        answer = match.group("answer").strip()
+        try:
+            question = await Question.objects.select_related("talk", "user").aget(id=qid)
+        except Question.DoesNotExist:
+            await bot.send_message(message.chat.id, f"Вопрос с ID #{qid} не найден.")
+            return
+        if roles.user_id != question.talk.speaker_id:
+            await bot.send_message(message.chat.id, "Вы не являетесь спикером этого доклада.")
+            return
+        question.answer = answer
+        await question.asave()
+        await bot.send_message(message.chat.id, "Ответ сохранён.")
+        listener_chat = await sync_to_async(_listener_chat)(question)
+        if listener_chat:
+            await bot.send_message(
+                listener_chat,
+                f"Ответ на ваш вопрос к докладу «{question.talk.title}»:\n\n{answer}"
             )
-            match = RE_ANSWER.match(message.text.strip())
-            if not match:
-                return
-            qid = match.group("qid")
-            answer = match.group("answer").strip()
-            try:
-                question = Question.objects.select_related("talk", "user").get(id=qid)
-            except Question.DoesNotExist:
-                bot.send_message(message.chat.id, f"Вопрос с ID #{qid} не найден.")
-                return
-            speaker_profile = UserProfile.objects.get(telegram_id=str(message.from_user.id))
-            if speaker_profile.user != question.talk.speaker:
-                bot.send_message(message.chat.id, "Вы не являетесь спикером этого доклада.")
+
+    @bot.message_handler(commands=["inbox"])
+    @instrumented("inbox")
+    async def inbox_handler(msg):
+        roles = await sync_to_async(get_roles)(msg.from_user.id)
+        if not (roles and roles.is_speaker):
+            await bot.reply_to(msg, "Входящие вопросы доступны только докладчикам.")
+            return
+        profile = await UserProfile.objects.aget(id=roles.profile_id)
+        text, markup = await sync_to_async(render_talk_list)(profile)
+        await bot.send_message(msg.chat.id, text, reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "inbox" or c.data.startswith("inbox_"))
+    @instrumented("inbox_page")
+    async def cb_inbox(call):
+        roles = await sync_to_async(get_roles)(call.from_user.id)
+        if not (roles and roles.is_speaker):
+            await bot.answer_callback_query(call.id, text="Недостаточно прав")
+            return
+        if call.data == "inbox":
+            profile = await UserProfile.objects.aget(id=roles.profile_id)
+            text, markup = await sync_to_async(render_talk_list)(profile)
+        else:
+            _, talk_id, *cursor = call.data.split("_", 2)
+            talk = await Talk.objects.filter(id=talk_id, speaker_id=roles.user_id).afirst()
+            if talk is None:
+                await bot.answer_callback_query(call.id, text="Доклад не найден")
                 return
-            question.answer = answer
-            question.save()
-            bot.send_message(message.chat.id, "Ответ сохранён.")
-            if question.user:
-                try:
-                    listener_profile = question.user.userprofile
-                    if listener_profile.telegram_id:
-                        bot.send_message(
-                            listener_profile.telegram_id,
-                            f"Ответ на ваш вопрос к докладу «{question.talk.title}»:\n\n{answer}"
-                        )
-                except UserProfile.DoesNotExist:
-                    pass
-
-        @bot.callback_query_handler(func=lambda c: c.data == "mass_broadcast")
-        def cb_mass_broadcast(call):
-            user_id = call.from_user.id
-            if not UserProfile.objects.filter(telegram_id=str(user_id), is_organizer=True).exists():
-                bot.answer_callback_query(call.id, text="Недостаточно прав")
+            text, markup = await sync_to_async(render_page)(talk, roles.user_id,
+                                                            cursor[0] if cursor else None)
+        await bot.answer_callback_query(call.id)
+        await bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.id,
+                                    text=text, reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "digest_toggle")
+    @instrumented("digest_toggle")
+    async def cb_digest_toggle(call):
+        roles = await sync_to_async(get_roles)(call.from_user.id)
+        if not (roles and roles.is_speaker):
+            await bot.answer_callback_query(call.id, text="Недостаточно прав")
+            return
+        profile = await UserProfile.objects.aget(id=roles.profile_id)
+        profile.question_digest = not profile.question_digest
+        await profile.asave(update_fields=["question_digest"])
+        await bot.answer_callback_query(
+            call.id, text="Сводка включена" if profile.question_digest else "Сводка выключена"
+        )
+        text, markup = await sync_to_async(render_talk_list)(profile)
+        await bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.id,
+                                    text=text, reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda c: c.data == "mass_broadcast")
+    @instrumented("mass_broadcast")
+    async def cb_mass_broadcast(call):
+        user_id = call.from_user.id
+        roles = await sync_to_async(get_roles)(user_id)
+        if not (roles and roles.is_organizer):
+            await bot.answer_callback_query(call.id, text="Недостаточно прав")
+            return
+        conversations.set(user_id, BROADCAST)
+        await bot.answer_callback_query(call.id)
+        await bot.send_message(call.message.chat.id, "Введите сообщение для рассылки:")
+
+    @router.route(BROADCAST)
+    @instrumented("mass_broadcast_text")
+    async def handle_mass_broadcast(msg, payload):
+        from meetup.services import broadcast
+
+        def run_broadcast(text):
+            # Поток отдельный и не управляется Django: подключение закрываем сами
+            with db_task():
+                return broadcast(text)
+
+        # Рассылка идёт через DeliveryEngine с его лимитами; свой поток, чтобы
+        # не занимать общий поток sync_to_async на всё время рассылки
+        result = await sync_to_async(run_broadcast, thread_sensitive=False)(msg.text.strip())
+        await bot.reply_to(
+            msg,
+            f"Рассылка завершена. Успешно отправлено: {result.sent}, "
+            f"не доставлено: {result.failed}",
+        )
+
+    @bot.message_handler(content_types=["text"])
+    async def route_text(msg):
+        result = router.dispatch(msg, default=handle_speaker_answer)
+        if inspect.isawaitable(result):
+            await result
+
+
+def register_gauges(async_runtime=False):
+    scheduler = get_async_scheduler if async_runtime else get_scheduler
+    registry.gauge("meetup_live_updaters", lambda: len(scheduler()),
+                   help="Сообщения с живым обновлением")
+    registry.gauge(
+        "meetup_pending_states",
+        lambda: {state: conversations.count(state)
+                 for state in (ASK_QUESTION, ANSWER_QUESTION, BROADCAST)},
+        help="Пользователи, от которых бот ждёт ввод",
+    )
+    registry.gauge("meetup_pending_questions", lambda: len(get_question_buffer()),
+                   help="Вопросы в буфере, ещё не записанные в БД")
+    registry.gauge("meetup_telegram_lane_depth", lambda: get_gate().depth(),
+                   help="Вызовы Bot API в очереди по полосам", label="lane")
+
+
+def run_shard(queue, rate_parts=1):
+    """Точка входа процесса-обработчика в режиме --workers."""
+    # Ctrl+C получает вся группа процессов; шард останавливает приёмник
+    # через ShardedDispatcher.stop, когда очередь будет разобрана
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    share_rate(rate_parts)
+    bot = get_bot()
+    # Внутри шарда обновления обрабатываются строго по очереди
+    bot.threaded = False
+    register_handlers(bot)
+    try:
+        serve_shard(queue, bot)
+    finally:
+        get_question_buffer().close()
+
+
+class Command(BaseCommand):
+    help = "Запускает AskTheSpeakerBot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--webhook", action="store_true",
+                            help="Принимать обновления через webhook вместо long polling")
+        parser.add_argument("--host", default="0.0.0.0", help="Адрес ASGI-сервера webhook")
+        parser.add_argument("--port", type=int, default=8443, help="Порт ASGI-сервера webhook")
+        parser.add_argument("--metrics-port", type=int,
+                            default=getattr(settings, "METRICS_PORT", None),
+                            help="Порт HTTP-эндпоинта метрик (/metrics, /metrics.json)")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Число процессов-обработчиков, между которыми делятся чаты")
+        parser.add_argument("--async", dest="async_runtime", action="store_true",
+                            help="Обрабатывать обновления в одном event loop (AsyncTeleBot)")
+        parser.add_argument("--outbox", action="store_true",
+                            help="Доставлять очередь исходящих в этом процессе, с общим лимитом вызовов")
+
+    def handle(self, *args, **options):
+        token = getattr(settings, "TELEGRAM_BOT_TOKEN", None)
+        if not token:
+            raise CommandError("TELEGRAM_BOT_TOKEN не задан в settings.py")
+        async_runtime = options["async_runtime"]
+        if async_runtime and options["workers"] > 1:
+            raise CommandError("--async нельзя сочетать с --workers")
+        rate_parts = 1
+        if options["workers"] > 1:
+            # Лимит Telegram делят шарды и, с --outbox, воркер очереди в приёмнике
+            rate_parts = options["workers"] + (1 if options["outbox"] else 0)
+            share_rate(rate_parts)
+        try:
+            bot = get_async_bot() if async_runtime else get_bot()
+        except ImportError:
+            raise CommandError("Для режима --async установите aiohttp")
+
+        dispatcher = None
+        if async_runtime:
+            register_async_handlers(bot)
+        elif options["workers"] > 1:
+            dispatcher = ShardedDispatcher(options["workers"], run_shard, worker_args=(rate_parts,))
+            dispatcher.start()
+            # Процесс-приёмник только раздаёт обновления по шардам
+            bot.process_new_updates = dispatcher.process_new_updates
+        else:
+            register_handlers(bot)
+
+        if options["outbox"]:
+            threading.Thread(target=run_worker, name="outbox", daemon=True).start()
+
+        if options["metrics_port"]:
+            if dispatcher is not None:
+                self.stderr.write("Метрики обработчиков собираются в процессах-шардах; "
+                                  "эндпоинт покажет только метрики процесса-приёмника.")
+            register_gauges(async_runtime)
+            start_metrics_server(options["metrics_port"])
+
+        try:
+            if options["webhook"]:
+                self.run_webhook(bot, options["host"], options["port"])
                 return
-            PENDING_BROADCAST.add(user_id)
-            bot.answer_callback_query(call.id)
-            bot.send_message(call.message.chat.id, "Введите сообщение для рассылки:")
-        
-        @bot.message_handler(func=lambda m: m.from_user.id in PENDING_BROADCAST, content_types=['text'])
-        def handle_mass_broadcast(msg):
-            from meetup.services import send_telegram_message
-            PENDING_BROADCAST.discard(msg.from_user.id)
-            text = msg.text.strip()
-            recipients = UserProfile.objects.exclude(telegram_id__isnull=True)
-            success = 0
-            for profile in recipients:
-                if send_telegram_message(profile.telegram_id, text):
-                    success += 1
-            bot.reply_to(msg, f"Рассылка завершена. Успешно отправлено: {success}")
-
-        self.stdout.write(self.style.SUCCESS("AskTheSpeakerBot запущен."))
-        bot.infinity_polling(skip_pending=True)
\ No newline at end of file
+            self.stdout.write(self.style.SUCCESS("AskTheSpeakerBot запущен."))
+            if async_runtime:
+                # Таймаут HTTP-запроса должен перекрывать long polling getUpdates
+                request_timeout = POLLING_TIMEOUT + getattr(settings, "TELEGRAM_READ_TIMEOUT", 15)
+                asyncio.run(bot.infinity_polling(timeout=POLLING_TIMEOUT, skip_pending=True,
+                                                 request_timeout=request_timeout))
+            else:
+                bot.infinity_polling(skip_pending=True)
+        finally:
+            if dispatcher is not None:
+                # Шарды разбирают оставшиеся в очередях обновления и сбрасывают свои буферы вопросов
+                dispatcher.stop()
+            # Дописать в БД вопросы, принятые перед остановкой
+            get_question_buffer().close()
+
+    def run_webhook(self, bot, host, port):
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError("Для режима --webhook установите uvicorn")
+        from meetup.webhook import WebhookApp
+
+        url = getattr(settings, "TELEGRAM_WEBHOOK_URL", None)
+        if not url:
+            raise CommandError("TELEGRAM_WEBHOOK_URL не задан в settings.py")
+        # Без заданного секрета генерируем свой: Telegram передаёт его в каждом запросе,
+        # и обновления без него отклоняются
+        secret = getattr(settings, "TELEGRAM_WEBHOOK_SECRET", None) or secrets.token_urlsafe(32)
+        app = WebhookApp(
+            bot,
+            secret_token=secret,
+            path=getattr(settings, "TELEGRAM_WEBHOOK_PATH", "/"),
+            queue_size=getattr(settings, "TELEGRAM_WEBHOOK_QUEUE_SIZE", 1000),
+            workers=getattr(settings, "TELEGRAM_WEBHOOK_WORKERS", 4),
+        )
+        if app.is_async:
+            async def setup_webhook():
+                await bot.remove_webhook()
+                await bot.set_webhook(url=url, secret_token=secret)
+            asyncio.run(setup_webhook())
+        else:
+            bot.remove_webhook()
+            bot.set_webhook(url=url, secret_token=secret)
+        self.stdout.write(self.style.SUCCESS(f"AskTheSpeakerBot слушает webhook на {host}:{port}."))
+        uvicorn.run(app, host=host, port=port, lifespan="on")
\ No newline at end of file
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from telebot.apihelper import ApiTelegramException
+
+from .models import MediaAsset
+
+logger = logging.getLogger(__name__)
+
+# Ошибки Bot API, после которых сохранённый file_id нужно забыть и загрузить файл заново
+STALE_FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference expired",
+    "file_reference_expired",
+)
+
+
+def is_stale_file_id(error):
+    """Telegram не принял file_id (например, после смены токена бота)."""
+    description = (error.description or "").lower()
+    return error.error_code == 400 and any(text in description for text in STALE_FILE_ID_ERRORS)
+
+
+class MediaCache:
+    """Кеш file_id отправленных файлов.
+
+    Файл загружается в Telegram один раз, дальше отправляется по file_id,
+    сохранённому в MediaAsset по пути и хешу содержимого. Хеш пересчитывается
+    только при смене mtime или размера файла, поэтому изменённый файл будет
+    загружен заново. Одновременные первые отправки одного файла ждут одну
+    загрузку, а не загружают его каждая.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._file_ids = {}
+        self._locks = {}
+        self._async_locks = {}
+        self._lock = threading.Lock()
+
+    def content_hash(self, path):
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+        digest = hashlib.blake2b(digest_size=32)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+        self._hashes[path] = (version, digest.hexdigest())
+        return digest.hexdigest()
+
+    def send_photo(self, bot, chat_id, path, **kwargs):
+        key = (_relative(path), self.content_hash(path))
+        file_id = self._lookup(key)
+        if file_id:
+            message = self._send_cached(bot, chat_id, key, file_id, **kwargs)
+            if message:
+                return message
+        with self._key_lock(key):
+            file_id = self._lookup(key)
+            if file_id:
+                message = self._send_cached(bot, chat_id, key, file_id, **kwargs)
+                if message:
+                    return message
+            with open(path, "rb") as f:
+                message = bot.send_photo(chat_id, f, **kwargs)
+            self._remember(key, message.photo[-1].file_id)
+            return message
+
+    async def asend_photo(self, bot, chat_id, path, **kwargs):
+        """То же для AsyncTeleBot; запросы к MediaAsset идут через sync_to_async."""
+        key = (_relative(path), self.content_hash(path))
+        file_id = await sync_to_async(self._lookup)(key)
+        if file_id:
+            message = await self._asend_cached(bot, chat_id, key, file_id, **kwargs)
+            if message:
+                return message
+        async with self._async_locks.setdefault(key, asyncio.Lock()):
+            file_id = await sync_to_async(self._lookup)(key)
+            if file_id:
+                message = await self._asend_cached(bot, chat_id, key, file_id, **kwargs)
+                if message:
+                    return message
+            with open(path, "rb") as f:
+                message = await bot.send_photo(chat_id, f, **kwargs)
+            await sync_to_async(self._remember)(key, message.photo[-1].file_id)
+            return message
+
+    def forget(self, key):
+        self._file_ids.pop(key, None)
+        MediaAsset.objects.filter(path=key[0], content_hash=key[1]).delete()
+
+    def _send_cached(self, bot, chat_id, key, file_id, **kwargs):
+        try:
+            return bot.send_photo(chat_id, file_id, **kwargs)
+        except ApiTelegramException as e:
+            # Прочие 400 ("chat not found" и т. п.) относятся к адресату, а не к файлу
+            if not is_stale_file_id(e):
+                raise
+            # file_id привязан к боту: после смены токена его нужно загрузить заново
+            logger.info("file_id для %s не принят, загружаем файл заново", key[0])
+            self.forget(key)
+            return None
+
+    async def _asend_cached(self, bot, chat_id, key, file_id, **kwargs):
+        from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException
+
+        try:
+            return await bot.send_photo(chat_id, file_id, **kwargs)
+        except AsyncApiTelegramException as e:
+            if not is_stale_file_id(e):
+                raise
+            logger.info("file_id для %s не принят, загружаем файл заново", key[0])
+            await sync_to_async(self.forget)(key)
+            return None
+
+    def _lookup(self, key):
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            file_id = (
+                MediaAsset.objects.filter(path=key[0], content_hash=key[1])
+                .values_list("file_id", flat=True)
+                .first()
+            )
+            if file_id:
+                self._file_ids[key] = file_id
+        return file_id
+
+    def _remember(self, key, file_id):
+        MediaAsset.objects.update_or_create(
+            path=key[0], content_hash=key[1], defaults={"file_id": file_id}
+        )
+        self._file_ids[key] = file_id
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+
+def _relative(path):
+    return os.path.relpath(os.path.abspath(path), settings.BASE_DIR)
+
+
+media_cache = MediaCache()
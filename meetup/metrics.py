@@ -0,0 +1,262 @@
+import functools
+import inspect
+import json
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connection
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Гистограмма в духе Prometheus: накопительные корзины, сумма и число наблюдений."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля по верхней границе корзины."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+            return float("inf")
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_labels = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, label, value, buckets=TIME_BUCKETS, help=""):
+        with self._lock:
+            self._help.setdefault(name, help)
+            hist = self._histograms.setdefault(name, {}).get(label)
+            if hist is None:
+                hist = self._histograms[name][label] = Histogram(buckets)
+        hist.observe(value)
+
+    def inc(self, name, label, amount=1, help=""):
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            series[label] = series.get(label, 0) + amount
+
+    def gauge(self, name, func, help="", label="state"):
+        """Регистрирует gauge; func возвращает число или словарь {значение метки label: число}."""
+        with self._lock:
+            self._help[name] = help
+            self._gauges[name] = func
+            self._gauge_labels[name] = label
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        """Текст в формате Prometheus exposition."""
+        lines = []
+        with self._lock:
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = dict(self._gauges)
+            gauge_labels = dict(self._gauge_labels)
+        for name, series in histograms.items():
+            lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} histogram"]
+            for (key, label), hist in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(hist.buckets + ("+Inf",), hist.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{key}="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{key}="{label}"}} {hist.sum}')
+                lines.append(f'{name}_count{{{key}="{label}"}} {hist.count}')
+        for name, series in counters.items():
+            lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} counter"]
+            for (key, label), value in sorted(series.items()):
+                lines.append(f'{name}{{{key}="{label}"}} {value}')
+        for name, func in gauges.items():
+            lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} gauge"]
+            value = func()
+            if isinstance(value, dict):
+                key = gauge_labels[name]
+                for label, item in sorted(value.items()):
+                    lines.append(f'{name}{{{key}="{label}"}} {item}')
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Сводка по обработчикам и вызовам API для команды bot_stats."""
+        with self._lock:
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = dict(self._gauges)
+        result = {"histograms": {}, "counters": {}, "gauges": {}}
+        for name, series in histograms.items():
+            result["histograms"][name] = {
+                label: {
+                    "count": hist.count,
+                    "sum": hist.sum,
+                    "p50": hist.quantile(0.5),
+                    "p95": hist.quantile(0.95),
+                    "p99": hist.quantile(0.99),
+                }
+                for (_, label), hist in series.items()
+            }
+        for name, series in counters.items():
+            result["counters"][name] = {label: value for (_, label), value in series.items()}
+        for name, func in gauges.items():
+            result["gauges"][name] = func()
+        return result
+
+
+registry = Registry()
+
+
+def instrumented(name):
+    """Декоратор: время выполнения, число и время запросов к БД, ошибки обработчика.
+
+    Для корутин считаются только время и ошибки: запросы к БД идут в потоке
+    sync_to_async, и execute_wrapper текущего потока их не видит.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                label = ("handler", name)
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    registry.inc("meetup_handler_errors_total", label,
+                                 help="Исключения в обработчиках")
+                    raise
+                finally:
+                    registry.histogram("meetup_handler_duration_seconds", label,
+                                       time.perf_counter() - started,
+                                       help="Время выполнения обработчика")
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            queries = [0, 0.0]
+
+            def count_query(execute, sql, params, many, context):
+                started = time.perf_counter()
+                try:
+                    return execute(sql, params, many, context)
+                finally:
+                    queries[0] += 1
+                    queries[1] += time.perf_counter() - started
+
+            label = ("handler", name)
+            started = time.perf_counter()
+            try:
+                with connection.execute_wrapper(count_query):
+                    return func(*args, **kwargs)
+            except Exception:
+                registry.inc("meetup_handler_errors_total", label,
+                             help="Исключения в обработчиках")
+                raise
+            finally:
+                registry.histogram("meetup_handler_duration_seconds", label,
+                                   time.perf_counter() - started,
+                                   help="Время выполнения обработчика")
+                registry.histogram("meetup_handler_db_queries", label, queries[0],
+                                   buckets=COUNT_BUCKETS, help="Запросов к БД за вызов")
+                registry.histogram("meetup_handler_db_duration_seconds", label, queries[1],
+                                   help="Время запросов к БД за вызов")
+        return wrapper
+    return decorator
+
+
+def timed_api_request(request):
+    """Оборачивает отправку HTTP-запросов к Bot API: время и ошибки по методам."""
+    if inspect.iscoroutinefunction(request):
+        @functools.wraps(request)
+        async def async_wrapper(token, url, *args, **kwargs):
+            # asyncio_helper передаёт имя метода, ошибки API приходят исключением
+            label = ("method", url.rsplit("/", 1)[-1])
+            started = time.perf_counter()
+            try:
+                return await request(token, url, *args, **kwargs)
+            except Exception:
+                registry.inc("meetup_telegram_api_errors_total", label,
+                             help="Ошибки вызовов Bot API")
+                raise
+            finally:
+                registry.histogram("meetup_telegram_api_duration_seconds", label,
+                                   time.perf_counter() - started,
+                                   help="Время вызова Bot API")
+        return async_wrapper
+
+    @functools.wraps(request)
+    def wrapper(method, url, *args, **kwargs):
+        label = ("method", url.rsplit("/", 1)[-1])
+        started = time.perf_counter()
+        try:
+            response = request(method, url, *args, **kwargs)
+        except Exception:
+            registry.inc("meetup_telegram_api_errors_total", label,
+                         help="Ошибки вызовов Bot API")
+            raise
+        finally:
+            registry.histogram("meetup_telegram_api_duration_seconds", label,
+                               time.perf_counter() - started,
+                               help="Время вызова Bot API")
+        if response.status_code != 200:
+            registry.inc("meetup_telegram_api_errors_total", label,
+                         help="Ошибки вызовов Bot API")
+        return response
+    return wrapper
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Отдаёт /metrics (Prometheus) и /metrics.json (для bot_stats) в фоновом потоке."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = registry.render().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.snapshot()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
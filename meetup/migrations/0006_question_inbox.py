@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meetup', '0005_outboxmessage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='digest_message_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='digest_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='question_digest',
+            field=models.BooleanField(default=False, help_text='Вместо сообщения на каждый вопрос докладчик получает одну обновляемую сводку', verbose_name='Получать вопросы сводкой'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(('answer__isnull', True)), fields=['talk', 'created_at', 'id'], name='question_unanswered_idx'),
+        ),
+    ]
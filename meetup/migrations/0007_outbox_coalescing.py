@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meetup', '0006_question_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='coalesce_key',
+            field=models.CharField(blank=True, db_index=True, help_text='Изменения с одним ключом до отправки собираются в одно сообщение', max_length=64, null=True, verbose_name='Ключ объединения'),
+        ),
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='payload',
+            field=models.JSONField(blank=True, null=True, verbose_name='Данные для объединения'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_schedule(apps, schema_editor):
+    Talk = apps.get_model("meetup", "Talk")
+    talks = list(Talk.objects.select_related("event"))
+    for talk in talks:
+        day = timezone.localdate(talk.event.date)
+        talk.starts_at = timezone.make_aware(datetime.combine(day, talk.start_time))
+        talk.ends_at = timezone.make_aware(datetime.combine(day, talk.end_time))
+        if talk.ends_at <= talk.starts_at:
+            talk.ends_at += timedelta(days=1)
+    Talk.objects.bulk_update(talks, ["starts_at", "ends_at"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meetup', '0007_outbox_coalescing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='talk',
+            name='starts_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Начало'),
+        ),
+        migrations.AddField(
+            model_name='talk',
+            name='ends_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Окончание'),
+        ),
+        migrations.RunPython(backfill_schedule, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='talk',
+            name='starts_at',
+            field=models.DateTimeField(editable=False, verbose_name='Начало'),
+        ),
+        migrations.AlterField(
+            model_name='talk',
+            name='ends_at',
+            field=models.DateTimeField(editable=False, verbose_name='Окончание'),
+        ),
+        migrations.AddIndex(
+            model_name='talk',
+            index=models.Index(fields=['ends_at', 'starts_at'], name='meetup_talk_ends_at_564323_idx'),
+        ),
+    ]
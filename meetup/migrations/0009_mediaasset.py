@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meetup', '0008_talk_starts_at_ends_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, verbose_name='Путь')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='Хеш содержимого')),
+                ('file_id', models.CharField(max_length=255, verbose_name='Telegram file_id')),
+                ('uploaded_at', models.DateTimeField(auto_now=True, verbose_name='Загружено')),
+            ],
+            options={
+                'verbose_name': 'Медиафайл',
+                'verbose_name_plural': 'Медиафайлы',
+                'constraints': [models.UniqueConstraint(fields=('path', 'content_hash'), name='unique_media_asset')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meetup', '0009_mediaasset'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='delivery_failures',
+            field=models.PositiveIntegerField(default=0, verbose_name='Неудачных доставок подряд'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='last_delivery_error',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Последняя ошибка доставки'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='unreachable_at',
+            field=models.DateTimeField(blank=True, help_text='Пользователь заблокировал бота или удалил аккаунт; рассылки его пропускают', null=True, verbose_name='Недоступен с'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(condition=models.Q(('subscribed_to_notifications', True), ('unreachable_at__isnull', True)), fields=['id'], name='profile_recipients_idx'),
+        ),
+    ]
@@ -4,13 +4,80 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 
 
-class Event(models.Model):
+class TrackedFieldsMixin:
+    """Запоминает значения TRACKED_FIELDS при загрузке из БД.
+
+    changed_fields() сравнивает текущие значения со снимком без лишнего
+    запроса. Снимок хранится в самом экземпляре, поэтому потоки не мешают
+    друг другу, а после успешного save() он обновляется.
+    """
+
+    TRACKED_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot(cls.TRACKED_FIELDS)
+        return instance
+
+    def _snapshot(self, fields):
+        loaded = self.__dict__.setdefault("_loaded_values", {})
+        for name in fields:
+            if name in self.__dict__:
+                loaded[name] = self.__dict__[name]
+
+    def changed_fields(self):
+        """Изменённые поля из TRACKED_FIELDS; для экземпляра не из БД — все поля."""
+        loaded = self.__dict__.get("_loaded_values")
+        if loaded is None:
+            return set(self.TRACKED_FIELDS)
+        return {
+            name for name in self.TRACKED_FIELDS
+            if name in self.__dict__ and (name not in loaded or loaded[name] != self.__dict__[name])
+        }
+
+    def _tracked(self, names=None):
+        if names is None:
+            return self.TRACKED_FIELDS
+        attnames = {self._meta.get_field(name).attname for name in names}
+        return [name for name in self.TRACKED_FIELDS if name in attnames]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot(self._tracked(kwargs.get("update_fields")))
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._snapshot(self._tracked(fields))
+
+
+EVENT_GRACE = timedelta(minutes=15)
+TALK_GRACE = timedelta(minutes=30)
+
+
+class EventQuerySet(models.QuerySet):
+    def with_last_talk_end(self):
+        """Добавляет last_talk_end — окончание последнего доклада (datetime)."""
+        return self.annotate(last_talk_end=models.Max("talks__ends_at"))
+
+    def active_event(self, now=None):
+        """Возвращает ближайшее активное мероприятие одним запросом или None."""
+        now = now or timezone.now()
+        running = Talk.objects.filter(ends_at__gte=now - EVENT_GRACE).values("event_id")
+        return self.filter(id__in=running).with_last_talk_end().order_by("date").first()
+
+
+class Event(TrackedFieldsMixin, models.Model):
     """Модель для хранения информации о мероприятиях."""
 
+    TRACKED_FIELDS = ("title", "date", "description")
+
     title = models.CharField(max_length=200, verbose_name="Название")
     date = models.DateTimeField(verbose_name="Дата и время", db_index=True)
     description = models.TextField(verbose_name="Описание")
 
+    objects = EventQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Мероприятие"
         verbose_name_plural = "Мероприятия"
@@ -20,28 +87,70 @@ class Event(models.Model):
     @property
     def is_active(self):
         """Мероприятие считается активным, если оно ещё не завершилось и содержит хотя бы один доклад."""
-        now = timezone.now()
-    
-        last_talk = self.talks.order_by("-end_time").first()
-        if not last_talk:
+        return self.is_active_at(timezone.now())
+
+    def is_active_at(self, now, last_talk_end=None):
+        """Как is_active, но на момент now; без запроса, если известно окончание последнего доклада."""
+        last_end = last_talk_end or getattr(self, "last_talk_end", None)
+        if last_end is None and not hasattr(self, "last_talk_end"):
+            last_end = self.talks.aggregate(last=models.Max("ends_at"))["last"]
+        if not last_end:
             return False
-    
-        end_dt = timezone.make_aware(
-            datetime.combine(self.date.date(), last_talk.end_time)
-        )
-        end_dt += timedelta(minutes=15)
-    
-        return now <= end_dt
+        return now <= last_end + EVENT_GRACE
 
+    def save(self, *args, **kwargs):
+        date_changed = self.pk is not None and "date" in self.changed_fields()
+        super().save(*args, **kwargs)
+        if date_changed:
+            self.sync_talk_schedule()
 
+    def sync_talk_schedule(self):
+        """Пересчитывает starts_at/ends_at докладов после смены даты мероприятия."""
+        talks = list(self.talks.all())
+        for talk in talks:
+            talk.set_schedule(self)
+        Talk.objects.bulk_update(talks, ["starts_at", "ends_at"])
 
     def __str__(self):
         return f"{self.title} ({self.date})"
 
 
-class Talk(models.Model):
+def talk_schedule(event, start_time, end_time):
+    day = timezone.localdate(event.date)
+    starts_at = timezone.make_aware(datetime.combine(day, start_time))
+    ends_at = timezone.make_aware(datetime.combine(day, end_time))
+    if ends_at <= starts_at:
+        ends_at += timedelta(days=1)
+    return starts_at, ends_at
+
+
+class TalkQuerySet(models.QuerySet):
+    def with_event_last_talk_end(self):
+        """Добавляет event_last_talk_end — окончание последнего доклада мероприятия."""
+        last_end = (
+            Talk.objects.filter(event=models.OuterRef("event"))
+            .order_by()
+            .values("event")
+            .annotate(last=models.Max("ends_at"))
+            .values("last")
+        )
+        return self.annotate(event_last_talk_end=models.Subquery(last_end))
+
+    def live(self, now=None):
+        """Доклады, идущие сейчас (с запасом TALK_GRACE после окончания), — диапазон по индексу."""
+        now = now or timezone.now()
+        return self.filter(ends_at__gte=now - TALK_GRACE, starts_at__lte=now)
+
+    def upcoming(self, now=None):
+        now = now or timezone.now()
+        return self.filter(starts_at__gt=now).order_by("starts_at")
+
+
+class Talk(TrackedFieldsMixin, models.Model):
     """Модель для хранения информации о докладах."""
-    
+
+    TRACKED_FIELDS = ("event_id", "speaker_id", "title", "description", "start_time", "end_time")
+
     event = models.ForeignKey(
         Event,
         on_delete=models.CASCADE,
@@ -58,32 +167,57 @@ class Talk(models.Model):
     description = models.TextField(verbose_name="Описание")
     start_time = models.TimeField(verbose_name="Время начала")
     end_time = models.TimeField(verbose_name="Время окончания")
+    # Денормализация start_time/end_time в дату мероприятия; пересчитывается при сохранении
+    starts_at = models.DateTimeField(editable=False, verbose_name="Начало")
+    ends_at = models.DateTimeField(editable=False, verbose_name="Окончание")
+
+    objects = TalkQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Доклад"
         verbose_name_plural = "Доклады"
         ordering = ["event", "start_time"]
-        indexes = [models.Index(fields=["event", "start_time"])]
-
-
+        indexes = [
+            models.Index(fields=["event", "start_time"]),
+            models.Index(fields=["ends_at", "starts_at"]),
+        ]
 
     @property
     def is_active(self):
         """Проверяет, активен ли доклад."""
-        now = timezone.now()
-        talk_start = timezone.make_aware(
-            datetime.combine(self.event.date.date(), self.start_time)
-        )
-        talk_end = timezone.make_aware(
-            datetime.combine(self.event.date.date(), self.end_time)
+        return self.is_active_at(timezone.now())
+
+    def is_active_at(self, now):
+        return self.starts_at <= now <= self.ends_at + TALK_GRACE and self.event.is_active_at(
+            now, last_talk_end=getattr(self, "event_last_talk_end", None)
         )
-        talk_end += timedelta(minutes=30)
-        return talk_start <= now <= talk_end and self.event.is_active
+
+    def set_schedule(self, event=None):
+        """Заполняет starts_at/ends_at; доклад, заканчивающийся после полуночи, уходит на следующий день."""
+        self.starts_at, self.ends_at = talk_schedule(event or self.event, self.start_time, self.end_time)
+
+    def save(self, *args, **kwargs):
+        self.set_schedule()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "starts_at", "ends_at"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.title} by {self.speaker.username}"
 
 
+class QuestionQuerySet(models.QuerySet):
+    def unanswered(self):
+        return self.filter(answer__isnull=True)
+
+    def after(self, created_at, pk):
+        """Keyset-пагинация: вопросы строго после (created_at, id)."""
+        return self.filter(
+            models.Q(created_at__gt=created_at) | models.Q(created_at=created_at, id__gt=pk)
+        )
+
+
 class Question(models.Model):
     talk = models.ForeignKey(
         'Talk',
@@ -106,11 +240,21 @@ class Question(models.Model):
         db_index=True,
     )
 
+    objects = QuestionQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Вопрос'
         verbose_name_plural = 'Вопросы'
         ordering = ['-created_at']
-        indexes = [models.Index(fields=['created_at'])]
+        indexes = [
+            models.Index(fields=['created_at']),
+            # Частичный индекс: входящие докладчика листаются по (created_at, id) среди неотвеченных
+            models.Index(
+                fields=['talk', 'created_at', 'id'],
+                condition=models.Q(answer__isnull=True),
+                name='question_unanswered_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"Question for {self.talk.title}"
@@ -127,10 +271,122 @@ class UserProfile(models.Model):
         default=True,
         verbose_name="Подписан на уведомления",
     )
+    question_digest = models.BooleanField(
+        default=False,
+        verbose_name="Получать вопросы сводкой",
+        help_text="Вместо сообщения на каждый вопрос докладчик получает одну обновляемую сводку",
+    )
+    digest_message_id = models.BigIntegerField(null=True, blank=True, editable=False)
+    digest_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
+    unreachable_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Недоступен с",
+        help_text="Пользователь заблокировал бота или удалил аккаунт; рассылки его пропускают",
+    )
+    delivery_failures = models.PositiveIntegerField(default=0, verbose_name="Неудачных доставок подряд")
+    last_delivery_error = models.CharField(
+        max_length=255, null=True, blank=True, verbose_name="Последняя ошибка доставки"
+    )
 
     class Meta:
         verbose_name = "Профиль пользователя"
         verbose_name_plural = "Профили пользователей"
+        indexes = [
+            # Получатели рассылок: keyset по id среди подписанных и доступных
+            models.Index(
+                fields=["id"],
+                condition=models.Q(subscribed_to_notifications=True, unreachable_at__isnull=True),
+                name="profile_recipients_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.user.username
+
+
+class OutboxMessage(models.Model):
+    """Исходящее сообщение Telegram, ожидающее доставки воркером drain_outbox."""
+
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    PARTIAL = "partial"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Ожидает отправки"),
+        (SENDING, "Отправляется"),
+        (SENT, "Отправлено"),
+        (PARTIAL, "Доставлено не всем"),
+        (FAILED, "Ошибка"),
+    ]
+
+    chat_id = models.CharField(
+        max_length=100,
+        null=True,
+        blank=True,
+        verbose_name="Telegram ID получателя",
+        help_text="Пусто — рассылка всем подписчикам",
+    )
+    text = models.TextField(verbose_name="Текст")
+    reply_markup = models.TextField(null=True, blank=True, verbose_name="Клавиатура (JSON)")
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        verbose_name="Статус",
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    last_error = models.TextField(null=True, blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Отправлено")
+    coalesce_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        db_index=True,
+        verbose_name="Ключ объединения",
+        help_text="Изменения с одним ключом до отправки собираются в одно сообщение",
+    )
+    payload = models.JSONField(null=True, blank=True, verbose_name="Данные для объединения")
+    claim_token = models.CharField(
+        max_length=32,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Метка воркера",
+        help_text="Какой проход воркера забрал строку на отправку",
+    )
+
+    class Meta:
+        verbose_name = "Исходящее сообщение"
+        verbose_name_plural = "Исходящие сообщения"
+        ordering = ["id"]
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    @property
+    def is_broadcast(self):
+        return not self.chat_id
+
+    def __str__(self):
+        return f"{self.chat_id or 'всем'}: {self.text[:30]}"
+
+
+class MediaAsset(models.Model):
+    """file_id, который Telegram вернул после первой загрузки файла."""
+
+    path = models.CharField(max_length=255, verbose_name="Путь")
+    content_hash = models.CharField(max_length=64, verbose_name="Хеш содержимого")
+    file_id = models.CharField(max_length=255, verbose_name="Telegram file_id")
+    uploaded_at = models.DateTimeField(auto_now=True, verbose_name="Загружено")
+
+    class Meta:
+        verbose_name = "Медиафайл"
+        verbose_name_plural = "Медиафайлы"
+        constraints = [
+            models.UniqueConstraint(fields=["path", "content_hash"], name="unique_media_asset"),
+        ]
+
+    def __str__(self):
+        return self.path
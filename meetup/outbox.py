@@ -0,0 +1,211 @@
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import OutboxMessage
+from .qos import NOTIFICATION, lane
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+# На сколько секунд строка закрепляется за проходом воркера; если воркер упал,
+# после этого срока строку заберёт другой (рассылка на тысячи адресатов идёт минутами)
+CLAIM_LEASE = 3600
+
+
+def enqueue(chat_id, text, reply_markup=None):
+    """Ставит личное сообщение в очередь. Вызывается внутри транзакции сохранения модели."""
+    if reply_markup is not None and not isinstance(reply_markup, str):
+        reply_markup = reply_markup.to_json()
+    return OutboxMessage.objects.create(chat_id=str(chat_id), text=text, reply_markup=reply_markup)
+
+
+def enqueue_many(messages):
+    """Ставит в очередь пачку личных сообщений (chat_id, text, reply_markup) одним запросом."""
+    return OutboxMessage.objects.bulk_create(
+        OutboxMessage(
+            chat_id=str(chat_id),
+            text=text,
+            reply_markup=reply_markup if reply_markup is None or isinstance(reply_markup, str)
+            else reply_markup.to_json(),
+        )
+        for chat_id, text, reply_markup in messages
+    )
+
+
+def enqueue_broadcast(text):
+    """Ставит в очередь рассылку всем подписчикам: одна строка вместо строки на получателя."""
+    return OutboxMessage.objects.create(chat_id=None, text=text)
+
+
+def coalesce_broadcast(key, window, merge):
+    """Объединяет рассылки с одним ключом в окне window секунд.
+
+    Ищет ещё не отправленную рассылку с ключом key, окно которой не закрылось,
+    или создаёт новую с отправкой через window секунд. merge(payload) обновляет
+    payload и возвращает текст сообщения. Окно отсчитывается от первого
+    изменения и не продлевается, поэтому задержка рассылки ограничена.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        row = (
+            OutboxMessage.objects.select_for_update()
+            .filter(coalesce_key=key, status=OutboxMessage.PENDING, attempts=0,
+                    next_attempt_at__gt=now)
+            .first()
+        )
+        if row is None:
+            row = OutboxMessage(chat_id=None, coalesce_key=key, payload={},
+                                next_attempt_at=now + timedelta(seconds=window))
+        row.text = merge(row.payload)
+        row.save()
+    return row
+
+
+def _due(now):
+    return OutboxMessage.objects.filter(
+        status__in=(OutboxMessage.PENDING, OutboxMessage.SENDING),
+        next_attempt_at__lte=now,
+    )
+
+
+def due_messages(batch_size):
+    return list(_due(timezone.now()).order_by("id")[:batch_size])
+
+
+def claim_messages(batch_size, lease=CLAIM_LEASE):
+    """Забирает пачку готовых к отправке строк себе и возвращает их.
+
+    Строки переводятся в SENDING с уникальной меткой прохода и сдвигом
+    next_attempt_at на lease, поэтому два воркера (drain_outbox и
+    run_askthespeakerbot --outbox, несколько реплик) не отправят одну строку
+    дважды. На PostgreSQL конкуренты пропускают заблокированные строки
+    (skip_locked); на SQLite запись и так последовательна, а условие по
+    next_attempt_at в UPDATE отсекает строки, уже забранные другим.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        ids = list(
+            _due(now).select_for_update(skip_locked=True)
+            .order_by("id").values_list("id", flat=True)[:batch_size]
+        )
+        _due(now).filter(id__in=ids).update(
+            status=OutboxMessage.SENDING, claim_token=token,
+            next_attempt_at=now + timedelta(seconds=lease),
+        )
+    return list(OutboxMessage.objects.filter(claim_token=token, status=OutboxMessage.SENDING))
+
+
+def drain(batch_size=100):
+    """Доставляет одну пачку сообщений из очереди и возвращает число обработанных строк."""
+    from .delivery import get_delivery_engine
+    from .recipients import is_unreachable, mark_unreachable
+    from .services import _send_html, broadcast, get_telegram_bot
+
+    bot = get_telegram_bot()
+    if not bot:
+        return 0
+    rows = claim_messages(batch_size)
+    direct = [row for row in rows if not row.is_broadcast]
+    with lane(NOTIFICATION):
+        results = get_delivery_engine().send_many(
+            _send_html,
+            [(row.chat_id, {"message": row.text, "bot": bot, "reply_markup": row.reply_markup})
+             for row in direct],
+        )
+    now = timezone.now()
+    unreachable = []
+    for row, result in zip(direct, results):
+        if result.retry_in is not None:
+            # Чат получил сообщение только что: отложить, не занимая поток пула
+            row.status = OutboxMessage.PENDING
+            row.attempts += result.attempts
+            row.next_attempt_at = now + timedelta(seconds=result.retry_in)
+            continue
+        row.attempts += 1
+        if result.ok:
+            row.status, row.sent_at, row.last_error = OutboxMessage.SENT, now, None
+        else:
+            row.last_error = result.error
+            if is_unreachable(result):
+                # Повторять бессмысленно: пользователь заблокировал бота
+                row.status = OutboxMessage.FAILED
+                unreachable.append(row.chat_id)
+            elif row.attempts >= MAX_ATTEMPTS:
+                row.status = OutboxMessage.FAILED
+            else:
+                row.status = OutboxMessage.PENDING
+                row.next_attempt_at = now + timedelta(seconds=10 * 2 ** row.attempts)
+
+    # Итоги личных сообщений сохраняются до рассылок: если рассылка упадёт,
+    # доставленные строки не останутся в SENDING и не уйдут повторно после lease
+    if unreachable:
+        mark_unreachable(unreachable)
+    _save_results(direct)
+
+    for row in rows:
+        if not row.is_broadcast:
+            continue
+        row.attempts += 1
+        try:
+            result = broadcast(row.text)
+        except Exception as e:
+            # Часть адресатов могла уже получить сообщение, поэтому без повтора
+            logger.exception("Ошибка рассылки %s", row.id)
+            row.status, row.last_error = OutboxMessage.FAILED, f"Рассылка прервана: {e}"
+        else:
+            row.sent_at = timezone.now()
+            if result.failed:
+                row.status = OutboxMessage.PARTIAL
+                row.last_error = (f"Не доставлено: {result.failed} из {result.sent + result.failed}, "
+                                  f"недоступны: {result.unreachable}")
+            else:
+                row.status, row.last_error = OutboxMessage.SENT, None
+        _save_results([row])
+    return len(rows)
+
+
+def _save_results(rows):
+    for row in rows:
+        row.claim_token = None
+    OutboxMessage.objects.bulk_update(
+        rows, ["status", "attempts", "last_error", "next_attempt_at", "sent_at", "claim_token"]
+    )
+
+
+def run_worker(batch_size=100, interval=1.0, once=False):
+    """Цикл воркера очереди: пачки из очереди, сводки докладчикам, обслуживание SQLite.
+
+    Работает в drain_outbox или фоновым потоком бота (run_askthespeakerbot
+    --outbox); во втором случае личные сообщения и рассылки делят с
+    интерактивными ответами один приоритетный лимит вызовов.
+    """
+    from .db import optimize_sqlite
+    from .inbox import send_digests
+
+    digest_interval = getattr(settings, "QUESTION_DIGEST_INTERVAL", 60)
+    last_digest = 0.0
+    while True:
+        close_old_connections()
+        try:
+            processed = drain(batch_size)
+            if time.monotonic() - last_digest >= digest_interval:
+                last_digest = time.monotonic()
+                send_digests()
+            optimize_sqlite()
+        except Exception:
+            # Одна ошибка БД не должна останавливать воркер (в --outbox это поток бота)
+            logger.exception("Ошибка прохода очереди исходящих")
+            processed = 0
+            if once:
+                raise
+        if once and processed < batch_size:
+            break
+        if not processed:
+            time.sleep(interval)
@@ -0,0 +1,284 @@
+import csv
+import json
+import re
+from datetime import datetime, time
+from typing import NamedTuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Event, Talk, UserProfile
+from .render_cache import invalidate_active_event, invalidate_program
+from .roles import role_cache
+
+TALK_FIELDS = ["speaker", "title", "description", "start_time", "end_time", "starts_at", "ends_at"]
+
+
+class ProgramImportError(ValueError):
+    """Ошибка в файле программы."""
+
+
+class TalkRow(NamedTuple):
+    title: str
+    start_time: time
+    end_time: time
+    speaker: str
+    description: str = ""
+    speaker_name: str = ""
+    telegram_id: str = ""
+
+
+class ImportResult(NamedTuple):
+    event: Event
+    event_created: bool
+    created: list
+    updated: list
+    speakers_created: int
+
+
+def parse_time(value):
+    try:
+        return time.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        raise ProgramImportError(f"Неверное время: {value!r}")
+
+
+def parse_datetime(value):
+    try:
+        value = datetime.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        raise ProgramImportError(f"Неверная дата: {value!r}")
+    return value if timezone.is_aware(value) else timezone.make_aware(value)
+
+
+def _talk_row(data, line):
+    try:
+        row = TalkRow(
+            title=data["title"].strip(),
+            start_time=parse_time(data["start_time"]),
+            end_time=parse_time(data["end_time"]),
+            speaker=data["speaker"].strip(),
+            description=(data.get("description") or "").strip(),
+            speaker_name=(data.get("speaker_name") or "").strip(),
+            telegram_id=str(data.get("telegram_id") or "").strip(),
+        )
+    except KeyError as e:
+        raise ProgramImportError(f"Строка {line}: нет поля {e.args[0]}")
+    except (AttributeError, TypeError):
+        raise ProgramImportError(f"Строка {line}: значения полей должны быть строками")
+    except ProgramImportError as e:
+        raise ProgramImportError(f"Строка {line}: {e}")
+    if not row.title:
+        raise ProgramImportError(f"Строка {line}: пустое название доклада")
+    if not row.speaker:
+        raise ProgramImportError(f"Строка {line}: не указан докладчик")
+    return row
+
+
+def parse_csv(stream):
+    """CSV с заголовком: title, start_time, end_time, speaker[, description, speaker_name, telegram_id]."""
+    reader = csv.DictReader(stream)
+    return {}, [_talk_row(row, n) for n, row in enumerate(reader, start=2)]
+
+
+def parse_json(stream):
+    """JSON вида {"event": {"title", "date", "description"}, "talks": [{...как в CSV}]}."""
+    try:
+        data = json.load(stream)
+    except ValueError as e:
+        raise ProgramImportError(f"Неверный JSON: {e}")
+    if not isinstance(data, dict):
+        raise ProgramImportError("Неверный JSON: ожидается объект с полями event и talks")
+    event = dict(data.get("event") or {})
+    if "date" in event:
+        event["date"] = parse_datetime(event["date"])
+    return event, [_talk_row(talk, n) for n, talk in enumerate(data.get("talks") or [], start=1)]
+
+
+def _ics_lines(stream):
+    """Строки iCalendar с развёрнутыми переносами (RFC 5545, 3.1)."""
+    lines = []
+    for raw in stream.read().splitlines():
+        if raw[:1] in (" ", "\t") and lines:
+            lines[-1] += raw[1:]
+        elif raw:
+            lines.append(raw)
+    return lines
+
+
+def _ics_unescape(value):
+    return re.sub(r"\\([\\;,nN])", lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _ics_datetime(value, params):
+    try:
+        parsed = datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+    except ValueError:
+        # В том числе VALUE=DATE: у доклада должно быть время начала и окончания
+        raise ProgramImportError(f"Неверные дата и время: {value!r}")
+    if value.endswith("Z"):
+        parsed = parsed.replace(tzinfo=ZoneInfo("UTC"))
+    elif "TZID" in params:
+        try:
+            parsed = parsed.replace(tzinfo=ZoneInfo(params["TZID"]))
+        except (ValueError, ZoneInfoNotFoundError):
+            raise ProgramImportError(f"Неизвестный часовой пояс: {params['TZID']!r}")
+    else:
+        parsed = timezone.make_aware(parsed)
+    return timezone.localtime(parsed)
+
+
+def parse_ics(stream):
+    """iCalendar: X-WR-CALNAME — мероприятие, VEVENT — доклады, ORGANIZER;CN= — логин докладчика."""
+    event, talks, current = {}, [], None
+    for line in _ics_lines(stream):
+        name, _, value = line.partition(":")
+        name, *param_parts = name.split(";")
+        params = dict(p.split("=", 1) for p in param_parts if "=" in p)
+        name = name.upper()
+        if name == "BEGIN" and value == "VEVENT":
+            current = {}
+        elif name == "END" and value == "VEVENT":
+            if "DTSTART" not in current or "DTEND" not in current:
+                raise ProgramImportError(f"VEVENT {current.get('title', '')!r} без DTSTART/DTEND")
+            talks.append(current)
+            current = None
+        elif current is not None:
+            if name == "SUMMARY":
+                current["title"] = _ics_unescape(value)
+            elif name == "DESCRIPTION":
+                current["description"] = _ics_unescape(value)
+            elif name in ("DTSTART", "DTEND"):
+                current[name] = _ics_datetime(value, params)
+            elif name == "ORGANIZER":
+                current["speaker"] = params.get("CN", "").strip('"')
+        elif name == "X-WR-CALNAME":
+            event["title"] = _ics_unescape(value)
+        elif name == "X-WR-CALDESC":
+            event["description"] = _ics_unescape(value)
+
+    if talks:
+        event["date"] = min(talk["DTSTART"] for talk in talks)
+    rows = []
+    for n, talk in enumerate(talks, start=1):
+        talk["start_time"] = talk.pop("DTSTART").time().isoformat()
+        talk["end_time"] = talk.pop("DTEND").time().isoformat()
+        rows.append(_talk_row(talk, n))
+    return event, rows
+
+
+PARSERS = {"csv": parse_csv, "json": parse_json, "ics": parse_ics}
+
+
+def _check_telegram_ids(telegram_ids, users, profiles):
+    """Telegram ID новых профилей не должны повторяться в файле и совпадать с чужими профилями."""
+    new_ids = {username: tg_id for username, tg_id in telegram_ids.items()
+               if users[username].id not in profiles}
+    owners = {}
+    for username, tg_id in new_ids.items():
+        if tg_id in owners:
+            raise ProgramImportError(
+                f"Telegram ID {tg_id} указан у докладчиков {owners[tg_id]} и {username}"
+            )
+        owners[tg_id] = username
+    taken = UserProfile.objects.filter(telegram_id__in=owners).select_related("user").first()
+    if taken is not None:
+        raise ProgramImportError(
+            f"Telegram ID {taken.telegram_id} ({owners[taken.telegram_id]}) "
+            f"уже принадлежит пользователю {taken.user.username}"
+        )
+
+
+def _ensure_speakers(rows):
+    """Находит или создаёт докладчиков пачкой и отмечает их профили is_speaker."""
+    usernames = {row.speaker for row in rows}
+    users = User.objects.in_bulk(usernames, field_name="username")
+    names = {row.speaker: row.speaker_name for row in rows if row.speaker_name}
+    missing = []
+    for username in usernames - users.keys():
+        first, _, last = names.get(username, "").partition(" ")
+        missing.append(User(username=username, first_name=first, last_name=last))
+    User.objects.bulk_create(missing)
+    if missing:
+        # Не все бэкенды возвращают id из bulk_create
+        users.update(User.objects.in_bulk([u.username for u in missing], field_name="username"))
+
+    telegram_ids = {row.speaker: row.telegram_id for row in rows if row.telegram_id}
+    profiles = {p.user_id: p for p in UserProfile.objects.filter(user__in=users.values())}
+    _check_telegram_ids(telegram_ids, users, profiles)
+    new_profiles, promoted = [], []
+    for username, user in users.items():
+        profile = profiles.get(user.id)
+        if profile is None:
+            if username in telegram_ids:
+                new_profiles.append(UserProfile(user=user, telegram_id=telegram_ids[username],
+                                                is_speaker=True))
+        elif not profile.is_speaker:
+            profile.is_speaker = True
+            promoted.append(profile)
+    UserProfile.objects.bulk_create(new_profiles)
+    UserProfile.objects.bulk_update(promoted, ["is_speaker"])
+    # bulk-операции не шлют сигналы: сбрасываем кеш ролей сами
+    for profile in new_profiles + promoted:
+        transaction.on_commit(lambda tg_id=profile.telegram_id: role_cache.invalidate(tg_id))
+    return users, len(missing)
+
+
+def import_program(event_data, rows, event=None):
+    """Создаёт или обновляет мероприятие и его доклады одной транзакцией.
+
+    Все записи идут через bulk_create/bulk_update, поэтому построчные
+    сигналы (уведомление докладчику и рассылка на каждый доклад) не
+    срабатывают. Вместо них в конце ставятся одна рассылка о программе и по
+    одному сообщению каждому докладчику.
+    """
+    from .services import notify_program_import
+
+    if not rows:
+        raise ProgramImportError("В файле нет докладов")
+    titles = [row.title for row in rows]
+    if len(set(titles)) != len(titles):
+        raise ProgramImportError("Названия докладов в файле должны быть уникальны")
+    with transaction.atomic():
+        event_created = event is None
+        if event_created:
+            missing = {"title", "date"} - event_data.keys()
+            if missing:
+                raise ProgramImportError(f"Не заданы поля мероприятия: {', '.join(sorted(missing))}")
+            event = Event(title=event_data["title"], date=event_data["date"],
+                          description=event_data.get("description", ""))
+            Event.objects.bulk_create([event])
+            if event.pk is None:
+                event = Event.objects.filter(title=event.title, date=event.date).latest("id")
+        else:
+            for field, value in event_data.items():
+                setattr(event, field, value)
+            changed = event.changed_fields()
+            if changed:
+                Event.objects.bulk_update([event], list(changed))
+            if "date" in changed:
+                event.sync_talk_schedule()
+
+        speakers, speakers_created = _ensure_speakers(rows)
+        existing = {talk.title: talk for talk in event.talks.all()}
+        created, updated = [], []
+        for row in rows:
+            talk = existing.get(row.title) or Talk(event=event, title=row.title)
+            talk.speaker = speakers[row.speaker]
+            talk.description = row.description
+            talk.start_time, talk.end_time = row.start_time, row.end_time
+            talk.set_schedule(event)
+            if talk.pk is None:
+                created.append(talk)
+            elif talk.changed_fields():
+                updated.append(talk)
+        Talk.objects.bulk_create(created)
+        if created and created[0].pk is None:
+            created = list(event.talks.filter(title__in=[talk.title for talk in created]))
+        Talk.objects.bulk_update(updated, TALK_FIELDS)
+
+        notify_program_import(event, event_created, created + updated)
+        transaction.on_commit(lambda: (invalidate_program(event.id), invalidate_active_event()))
+    return ImportResult(event, event_created, created, updated, speakers_created)
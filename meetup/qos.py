@@ -0,0 +1,245 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from django.conf import settings
+
+from .delivery import TokenBucket
+from .metrics import registry
+
+
+class Lane(NamedTuple):
+    name: str
+    # Доля ёмкости bucket, которую полоса оставляет свободной для полос выше
+    reserve: float = 0.0
+    # Сколько секунд вызов может ждать очереди, прежде чем его сбросят; None — ждать всегда
+    max_wait: float = None
+
+
+INTERACTIVE, NOTIFICATION, TIMER, BROADCAST = range(4)
+LANES = (
+    Lane("interactive"),
+    Lane("notification"),
+    Lane("timer", reserve=0.25),
+    Lane("broadcast", reserve=0.5),
+)
+
+# Служебные методы не расходуют лимит сообщений и не ждут в очереди
+UNGATED_METHODS = frozenset({
+    "getupdates", "getme", "getfile", "getwebhookinfo", "setwebhook", "deletewebhook",
+    "close", "logout",
+})
+
+# Как часто корутина, ждущая очереди, проверяет её: event loop нельзя усыпить на Condition
+ASYNC_POLL_INTERVAL = 0.01
+
+_current_lane = contextvars.ContextVar("telegram_lane", default=INTERACTIVE)
+
+
+class LaneShed(Exception):
+    """Вызов нижней полосы сброшен: он слишком долго ждал лимита Telegram."""
+
+
+@contextmanager
+def lane(value):
+    """Вызовы Bot API внутри блока идут по полосе value (по умолчанию INTERACTIVE)."""
+    token = _current_lane.set(value)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane():
+    return _current_lane.get()
+
+
+class PriorityGate:
+    """Общий для процесса лимит вызовов Bot API с приоритетными полосами.
+
+    Каждый вызов встаёт в очередь своей полосы. Токен из bucket получает
+    только голова самой приоритетной непустой очереди, поэтому нажатие кнопки
+    обгоняет ожидающие обновления таймеров и рассылку. Нижние полосы берут
+    токен, лишь пока в bucket остаётся их reserve, и так оставляют запас для
+    интерактивных ответов. Когда лимит близок, таймеры, прождавшие дольше
+    max_wait, сбрасываются (LaneShed), а рассылки только задерживаются.
+    """
+
+    def __init__(self, rate=30, capacity=None, lanes=LANES):
+        self.bucket = TokenBucket(rate, capacity)
+        self.lanes = lanes
+        self._reserves = [min(l.reserve * self.bucket.capacity, self.bucket.capacity - 1) for l in lanes]
+        self._queues = [deque() for _ in lanes]
+        self._cond = threading.Condition()
+
+    def depth(self):
+        with self._cond:
+            return {l.name: len(q) for l, q in zip(self.lanes, self._queues)}
+
+    def pause(self, seconds):
+        """Останавливает все полосы на seconds секунд (ответ 429)."""
+        self.bucket.pause(seconds)
+        with self._cond:
+            self._cond.notify_all()
+
+    def acquire(self, lane_id):
+        started = time.monotonic()
+        deadline = self._deadline(lane_id, started)
+        with self._cond:
+            ticket = self._enqueue(lane_id)
+            try:
+                while True:
+                    acquired, timeout = self._poll(lane_id, ticket, deadline)
+                    if acquired:
+                        break
+                    self._cond.wait(timeout)
+            finally:
+                self._dequeue(lane_id, ticket)
+        self._observe_wait(lane_id, started)
+
+    async def aacquire(self, lane_id):
+        """То же для корутин: очередь общая с потоками, ожидание не блокирует event loop."""
+        started = time.monotonic()
+        deadline = self._deadline(lane_id, started)
+        with self._cond:
+            ticket = self._enqueue(lane_id)
+        try:
+            while True:
+                with self._cond:
+                    acquired, timeout = self._poll(lane_id, ticket, deadline)
+                if acquired:
+                    break
+                await asyncio.sleep(ASYNC_POLL_INTERVAL if timeout is None
+                                    else min(timeout, ASYNC_POLL_INTERVAL))
+        finally:
+            with self._cond:
+                self._dequeue(lane_id, ticket)
+        self._observe_wait(lane_id, started)
+
+    def _deadline(self, lane_id, started):
+        max_wait = self.lanes[lane_id].max_wait
+        return started + max_wait if max_wait is not None else None
+
+    def _enqueue(self, lane_id):
+        ticket = object()
+        self._queues[lane_id].append(ticket)
+        # Новый вызов может оказаться выше текущей головы
+        self._cond.notify_all()
+        return ticket
+
+    def _dequeue(self, lane_id, ticket):
+        queue = self._queues[lane_id]
+        if queue[0] is ticket:
+            queue.popleft()
+        else:
+            queue.remove(ticket)
+        self._cond.notify_all()
+
+    def _poll(self, lane_id, ticket, deadline):
+        """Под self._cond: (True, None), если токен получен, иначе (False, сколько ждать)."""
+        spec = self.lanes[lane_id]
+        timeout = None
+        if self._head() is ticket:
+            timeout = self.bucket.try_acquire(self._reserves[lane_id])
+            if not timeout:
+                return True, None
+        if deadline is not None:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                registry.inc("meetup_telegram_lane_shed_total", ("lane", spec.name),
+                             help="Вызовы Bot API, сброшенные из-за лимита")
+                raise LaneShed(f"Полоса {spec.name}: лимит не освободился за {spec.max_wait} с")
+            timeout = left if timeout is None else min(timeout, left)
+        return False, timeout
+
+    def _observe_wait(self, lane_id, started):
+        registry.histogram("meetup_telegram_lane_wait_seconds", ("lane", self.lanes[lane_id].name),
+                           time.monotonic() - started, help="Ожидание лимита Bot API по полосам")
+
+    def _head(self):
+        for queue in self._queues:
+            if queue:
+                return queue[0]
+        return None
+
+
+def gated_request(request, gate):
+    """Оборачивает отправку HTTP-запросов к Bot API: сначала токен полосы, на 429 — пауза.
+
+    Для корутины (asyncio_helper._process_request режима --async) url — имя
+    метода, а ошибки приходят исключением ApiTelegramException.
+    """
+    if inspect.iscoroutinefunction(request):
+        return _agated_request(request, gate)
+
+    @functools.wraps(request)
+    def wrapper(method, url, *args, **kwargs):
+        if url.rsplit("/", 1)[-1].lower() in UNGATED_METHODS:
+            return request(method, url, *args, **kwargs)
+        gate.acquire(current_lane())
+        response = request(method, url, *args, **kwargs)
+        if response.status_code == 429:
+            try:
+                delay = json.loads(response.text)["parameters"]["retry_after"]
+            except (ValueError, KeyError, TypeError):
+                delay = 1
+            gate.pause(delay)
+        return response
+    return wrapper
+
+
+def _agated_request(request, gate):
+    from telebot.asyncio_helper import ApiTelegramException
+
+    @functools.wraps(request)
+    async def wrapper(token, url, *args, **kwargs):
+        if url.rsplit("/", 1)[-1].lower() in UNGATED_METHODS:
+            return await request(token, url, *args, **kwargs)
+        await gate.aacquire(current_lane())
+        try:
+            return await request(token, url, *args, **kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                parameters = (e.result_json or {}).get("parameters") or {}
+                gate.pause(parameters.get("retry_after", 1))
+            raise
+    return wrapper
+
+
+_gate = None
+_gate_lock = threading.Lock()
+_rate_parts = 1
+
+
+def share_rate(parts):
+    """Оставляет процессу 1/parts лимита TELEGRAM_QOS_RATE.
+
+    Лимит Telegram общий для бота, а PriorityGate свой в каждом процессе,
+    поэтому при --workers лимит делится между отправляющими процессами.
+    Вызывается до первого get_gate().
+    """
+    global _rate_parts
+    with _gate_lock:
+        if _gate is not None:
+            raise RuntimeError("PriorityGate уже создан")
+        _rate_parts = parts
+
+
+def get_gate() -> PriorityGate:
+    global _gate
+    with _gate_lock:
+        if _gate is None:
+            lanes = list(LANES)
+            lanes[TIMER] = lanes[TIMER]._replace(
+                max_wait=getattr(settings, "TELEGRAM_QOS_TIMER_MAX_WAIT", 2.0)
+            )
+            rate = getattr(settings, "TELEGRAM_QOS_RATE", 30) / _rate_parts
+            _gate = PriorityGate(rate=rate, lanes=tuple(lanes))
+        return _gate
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import UserProfile
+
+# Ответы Bot API, после которых писать в чат бессмысленно
+UNREACHABLE_400 = ("chat not found", "user not found", "peer_id_invalid")
+
+
+def is_unreachable(result):
+    """Пользователь заблокировал бота, удалил аккаунт или чата больше нет."""
+    if result.ok:
+        return False
+    if result.error_code == 403:
+        return True
+    return result.error_code == 400 and any(
+        text in (result.error or "").lower() for text in UNREACHABLE_400
+    )
+
+
+def iter_recipients(batch_size=None):
+    """Стримит (profile_id, telegram_id) подписчиков, до которых можно доставить рассылку.
+
+    Keyset-пагинация по id вместо одного большого запроса: память постоянна,
+    а между пачками не держится открытый курсор и транзакция чтения.
+    """
+    batch_size = batch_size or getattr(settings, "RECIPIENT_BATCH_SIZE", 500)
+    recipients = (
+        UserProfile.objects.filter(subscribed_to_notifications=True, unreachable_at__isnull=True)
+        .exclude(telegram_id="")
+        .order_by("id")
+        .values_list("id", "telegram_id")
+    )
+    last_id = 0
+    while True:
+        count = 0
+        for profile_id, telegram_id in recipients.filter(id__gt=last_id)[:batch_size].iterator():
+            count += 1
+            last_id = profile_id
+            yield profile_id, telegram_id
+        if count < batch_size:
+            return
+
+
+def record_deliveries(profile_ids, results):
+    """Сохраняет итоги доставки по профилям тремя запросами на пачку.
+
+    Недоступные чаты помечаются unreachable_at и выпадают из следующих
+    рассылок; у остальных неудач растёт счётчик, успех его сбрасывает.
+    Возвращает число недоступных.
+    """
+    now = timezone.now()
+    ok, failed, unreachable = [], {}, {}
+    for profile_id, result in zip(profile_ids, results):
+        if result.ok:
+            ok.append(profile_id)
+        elif is_unreachable(result):
+            unreachable.setdefault(result.error, []).append(profile_id)
+        else:
+            failed.setdefault(result.error, []).append(profile_id)
+    if ok:
+        UserProfile.objects.filter(id__in=ok, delivery_failures__gt=0).update(
+            delivery_failures=0, last_delivery_error=None
+        )
+    for error, ids in failed.items():
+        UserProfile.objects.filter(id__in=ids).update(
+            delivery_failures=F("delivery_failures") + 1, last_delivery_error=(error or "")[:255]
+        )
+    for error, ids in unreachable.items():
+        UserProfile.objects.filter(id__in=ids).update(
+            unreachable_at=now, delivery_failures=F("delivery_failures") + 1,
+            last_delivery_error=(error or "")[:255],
+        )
+    return sum(map(len, unreachable.values()))
+
+
+def mark_unreachable(telegram_ids, error=None):
+    """Помечает недоступными профили по telegram_id (для личных сообщений из очереди)."""
+    return UserProfile.objects.filter(telegram_id__in=telegram_ids, unreachable_at__isnull=True).update(
+        unreachable_at=timezone.now(), last_delivery_error=(error or "")[:255] or None
+    )
+
+
+def mark_reachable(telegram_id):
+    """Пользователь снова написал боту: возвращаем его в рассылки."""
+    return UserProfile.objects.filter(telegram_id=str(telegram_id), unreachable_at__isnull=False).update(
+        unreachable_at=None, delivery_failures=0, last_delivery_error=None
+    )
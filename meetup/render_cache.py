@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Event, Talk
+
+
+ACTIVE_EVENT_KEY = "meetup:active_event"
+_NO_EVENT = 0
+
+
+def _program_key(event_id):
+    return f"meetup:program:{event_id}"
+
+
+def get_program(event_id):
+    """Возвращает (event, talks) из кеша; talks — доклады с подгруженными event и speaker.
+
+    Кеш сбрасывается сигналами при сохранении или удалении Event/Talk. Сигналы
+    срабатывают только в процессе, где сделано изменение, поэтому правки из
+    админки видны боту сразу лишь с общим кешем (CACHE_BACKEND=db или redis);
+    с locmem они появятся по истечении PROGRAM_CACHE_TTL.
+    """
+    key = _program_key(event_id)
+    program = cache.get(key)
+    if program is None:
+        event = Event.objects.filter(pk=event_id).first()
+        if event is None:
+            return None, []
+        talks = list(
+            Talk.objects.filter(event_id=event_id)
+            .select_related("event", "speaker")
+            .order_by("start_time")
+        )
+        program = (event, talks)
+        cache.set(key, program, getattr(settings, "PROGRAM_CACHE_TTL", 60))
+    return program
+
+
+def get_talk(event_id, talk_id):
+    _, talks = get_program(event_id)
+    return next((talk for talk in talks if talk.id == talk_id), None)
+
+
+def invalidate_program(event_id):
+    cache.delete(_program_key(event_id))
+
+
+def get_active_event():
+    """Текущее активное мероприятие из кеша с коротким TTL.
+
+    Кеш сбрасывается при сохранении или удалении любого Event/Talk.
+    """
+    event = cache.get(ACTIVE_EVENT_KEY)
+    if event is None:
+        event = Event.objects.active_event() or _NO_EVENT
+        cache.set(ACTIVE_EVENT_KEY, event, getattr(settings, "ACTIVE_EVENT_CACHE_TTL", 30))
+    return event or None
+
+
+def invalidate_active_event():
+    cache.delete(ACTIVE_EVENT_KEY)
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import UserProfile
+
+
+class ProfileRoles:
+    """Компактная запись о профиле: то, что нужно обработчикам бота для проверки ролей."""
+
+    __slots__ = ("profile_id", "user_id", "is_speaker", "is_organizer")
+
+    def __init__(self, profile_id, user_id, is_speaker, is_organizer):
+        self.profile_id = profile_id
+        self.user_id = user_id
+        self.is_speaker = is_speaker
+        self.is_organizer = is_organizer
+
+
+class _Entry:
+    __slots__ = ("roles", "expires")
+
+    def __init__(self, roles, expires):
+        self.roles = roles
+        self.expires = expires
+
+
+class RoleCache:
+    """LRU-кеш ролей по telegram_id, в том числе отрицательных ответов (нет профиля).
+
+    Записи сбрасываются сигналами UserProfile; TTL нужен для изменений,
+    сделанных в другом процессе (например, в админке).
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id):
+        key = str(telegram_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > now:
+                self._entries.move_to_end(key)
+                return entry.roles
+        row = (
+            UserProfile.objects.filter(telegram_id=key)
+            .values_list("id", "user_id", "is_speaker", "is_organizer")
+            .first()
+        )
+        roles = ProfileRoles(*row) if row else None
+        with self._lock:
+            self._entries[key] = _Entry(roles, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return roles
+
+    def invalidate(self, telegram_id):
+        with self._lock:
+            self._entries.pop(str(telegram_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+role_cache = RoleCache(
+    maxsize=getattr(settings, "ROLE_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "ROLE_CACHE_TTL", 300),
+)
+
+
+def get_roles(telegram_id):
+    """Возвращает ProfileRoles для telegram_id или None, если пользователь не зарегистрирован."""
+    return role_cache.get(telegram_id)
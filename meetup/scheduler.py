@@ -0,0 +1,175 @@
+import asyncio
+import heapq
+import logging
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .db import db_task
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    __slots__ = ("key", "func", "interval", "due", "seq")
+
+    def __init__(self, key, func, interval, due, seq):
+        self.key = key
+        self.func = func
+        self.interval = interval
+        self.due = due
+        self.seq = seq
+
+
+class LiveScheduler:
+    """Один поток-планировщик для всех периодически обновляемых сообщений.
+
+    Задачи хранятся в куче по времени запуска, а по ключу (обычно chat_id) —
+    в словаре, поэтому отмена занимает O(1): задача просто удаляется из словаря,
+    а её запись в куче отбрасывается при извлечении. Сами обновления выполняются
+    в ограниченном пуле потоков. func() возвращает True, чтобы продолжить
+    обновления, и False, чтобы остановиться.
+    """
+
+    def __init__(self, workers=4):
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="live")
+        self._thread = None
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def schedule(self, key, func, interval=60, delay=None):
+        """Заменяет задачу с ключом key новой, первый запуск через delay (по умолчанию interval)."""
+        with self._cond:
+            job = _Job(key, func, interval, time.monotonic() + (interval if delay is None else delay),
+                       next(self._seq))
+            self._jobs[key] = job
+            self._push(job)
+            self._ensure_thread()
+            self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            return self._jobs.pop(key, None) is not None
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.due, job.seq, job))
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._heap = [(j.due, j.seq, j) for j in self._jobs.values() if j.due is not None]
+            heapq.heapify(self._heap)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="live-scheduler", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, seq, job = self._heap[0]
+                    if self._jobs.get(job.key) is not job or job.seq != seq:
+                        heapq.heappop(self._heap)
+                        continue
+                    wait = due - time.monotonic()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    heapq.heappop(self._heap)
+                    job.due = None
+                    break
+            self._executor.submit(self._run, job, seq)
+
+    def _run(self, job, seq):
+        try:
+            with db_task():
+                keep = job.func()
+        except Exception:
+            logger.exception("Ошибка живого обновления %s", job.key)
+            keep = True
+        with self._cond:
+            if self._jobs.get(job.key) is not job or job.seq != seq:
+                return
+            if not keep:
+                del self._jobs[job.key]
+                return
+            job.due = time.monotonic() + job.interval
+            job.seq = next(self._seq)
+            self._push(job)
+            self._cond.notify()
+
+
+class AsyncLiveScheduler:
+    """Живые обновления для режима --async: по задаче asyncio на ключ.
+
+    Ожидающая задача стоит лишь запись в event loop, поэтому куча и пул
+    потоков не нужны. func — корутинная функция с тем же контрактом, что у
+    LiveScheduler: True — продолжать, False — остановиться.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def schedule(self, key, func, interval=60, delay=None):
+        """Заменяет задачу с ключом key новой, первый запуск через delay (по умолчанию interval)."""
+        self.cancel(key)
+        delay = interval if delay is None else delay
+        self._tasks[key] = asyncio.get_running_loop().create_task(self._run(key, func, interval, delay))
+
+    def cancel(self, key):
+        task = self._tasks.pop(key, None)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def _run(self, key, func, interval, delay):
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                delay = interval
+                try:
+                    keep = await func()
+                except Exception:
+                    logger.exception("Ошибка живого обновления %s", key)
+                    keep = True
+                if not keep:
+                    return
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LiveScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LiveScheduler(workers=getattr(settings, "LIVE_UPDATE_WORKERS", 4))
+        return _scheduler
+
+
+_async_scheduler = None
+
+
+def get_async_scheduler() -> AsyncLiveScheduler:
+    global _async_scheduler
+    if _async_scheduler is None:
+        _async_scheduler = AsyncLiveScheduler()
+    return _async_scheduler
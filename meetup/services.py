@@ -1,35 +1,78 @@
+import logging
+from itertools import islice
+from typing import NamedTuple
+
 from django.conf import settings
 from django.utils import timezone
-import telebot
-from telebot.apihelper import ApiTelegramException as TelegramError
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
 
+from .delivery import get_delivery_engine
+from .metrics import instrumented
 from .models import Event, Talk, UserProfile
+from .outbox import coalesce_broadcast, enqueue, enqueue_broadcast, enqueue_many
+from .qos import BROADCAST, lane
+from .recipients import iter_recipients, record_deliveries
+from .transport import get_bot
+
+logger = logging.getLogger(__name__)
 
 
 def get_telegram_bot():
-    token = getattr(settings, "TELEGRAM_BOT_TOKEN", None)
-    return telebot.TeleBot(token) if token else None
+    return get_bot()
 
 
+@instrumented("send_telegram_message")
 def send_telegram_message(telegram_id, message):
     """Отправляет сообщение пользователю в Telegram."""
     bot = get_telegram_bot()
     if not bot:
         return False
 
-    try:
-        bot.send_message(
-            chat_id=telegram_id,
-            text=message,
-            parse_mode="HTML"
-        )
-        return True
-    except TelegramError:
-        return False
+    result = get_delivery_engine().send_one(_send_html, telegram_id, message, bot=bot)
+    return result.ok
+
+
+def _send_html(telegram_id, message, bot, reply_markup=None):
+    bot.send_message(chat_id=telegram_id, text=message, parse_mode="HTML", reply_markup=reply_markup)
+
+
+class BroadcastResult(NamedTuple):
+    sent: int
+    failed: int
+    unreachable: int
+
+
+@instrumented("broadcast")
+def broadcast(message, recipients=None):
+    """Рассылает сообщение через движок доставки пачками по RECIPIENT_BATCH_SIZE.
+
+    recipients — итератор пар (profile_id, telegram_id), по умолчанию все
+    доступные подписчики (iter_recipients). Итоги доставки записываются в
+    профили, недоступные чаты исключаются из следующих рассылок.
+    """
+    bot = get_telegram_bot()
+    if not bot:
+        return BroadcastResult(0, 0, 0)
+    recipients = iter(recipients if recipients is not None else iter_recipients())
+    batch_size = getattr(settings, "RECIPIENT_BATCH_SIZE", 500)
+    engine = get_delivery_engine()
+    sent = failed = unreachable = 0
+    while True:
+        batch = list(islice(recipients, batch_size))
+        if not batch:
+            break
+        profile_ids, chat_ids = zip(*batch)
+        with lane(BROADCAST):
+            results = engine.fan_out(_send_html, chat_ids, message, bot=bot)
+        ok = sum(result.ok for result in results)
+        sent += ok
+        failed += len(results) - ok
+        unreachable += record_deliveries(profile_ids, results)
+    return BroadcastResult(sent, failed, unreachable)
 
 
 def notify_upcoming_event(event):
-    """Отправляет уведомления о новом мероприятии."""
+    """Ставит в очередь уведомления о новом мероприятии."""
     message = (
         f"🎉 <b>Новое мероприятие!</b>\n\n"
         f"<b>{event.title}</b>\n"
@@ -37,17 +80,11 @@ def notify_upcoming_event(event):
         f"{event.description}"
     )
 
-    profiles = UserProfile.objects.filter(
-        subscribed_to_notifications=True,
-        telegram_id__isnull=False
-    ).select_related("user")
-
-    for profile in profiles:
-        send_telegram_message(profile.telegram_id, message)
+    return enqueue_broadcast(message)
 
 
 def notify_event_change(event, message):
-    """Отправляет уведомления об изменении мероприятия."""
+    """Ставит в очередь уведомления об изменении мероприятия."""
     full_message = (
         f"📢 <b>Обновление мероприятия</b>\n\n"
         f"<b>{event.title}</b>\n"
@@ -55,21 +92,15 @@ def notify_event_change(event, message):
         f"{message}"
     )
 
-    profiles = UserProfile.objects.filter(
-        subscribed_to_notifications=True,
-        telegram_id__isnull=False
-    ).select_related("user")
-
-    for profile in profiles:
-        send_telegram_message(profile.telegram_id, full_message)
+    return enqueue_broadcast(full_message)
 
 
 def notify_speaker(talk):
-    """Отправляет уведомление докладчику о новом докладе."""
+    """Ставит в очередь уведомление докладчику о новом докладе."""
     try:
         profile = talk.speaker.userprofile
         if not profile.telegram_id:
-            return
+            return None
 
         message = (
             f"🎤 <b>У вас новый доклад</b>\n\n"
@@ -79,33 +110,108 @@ def notify_speaker(talk):
             f"{talk.description}"
         )
 
-        send_telegram_message(profile.telegram_id, message)
+        return enqueue(profile.telegram_id, message)
     except UserProfile.DoesNotExist:
-        pass 
+        return None
+
+
+def speaker_notification(question):
+    """Уведомление докладчику о новом вопросе: (chat_id, текст, кнопки) или None."""
+    try:
+        profile = question.talk.speaker.userprofile
+    except UserProfile.DoesNotExist:
+        return None
+    # Докладчик со сводкой получит вопрос в следующем обновлении сводки (meetup.inbox)
+    if not profile.telegram_id or profile.question_digest:
+        return None
+    tg_id = profile.telegram_id
+    text = (
+        f"Вопрос к докладу «{question.talk.title}»\n"
+        f"От: @{question.user.username if question.user else 'аноним'}\n\n"
+        f"{question.text}"
+    )
+    markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("Ответить на вопрос", callback_data=f"reply_{question.id}")]
+    ])
+    return tg_id, text, markup
 
 
 def notify_program_change(talk):
-    """Уведомляет всех пользователей об изменении программы (докладов)."""
+    """Ставит в очередь рассылку об изменении программы.
+
+    Изменения докладов одного мероприятия в течение PROGRAM_CHANGE_WINDOW
+    секунд собираются в одно сообщение со списком всех изменённых докладов.
+    """
     try:
-        event = talk.event
-        message = (
-            f"📌 <b>Изменения в программе мероприятия</b>\n\n"
+        return _coalesce_program_change(talk.event, [talk.id])
+    except Exception:
+        # Рассылка вторична: сохранение доклада из-за неё не откатываем
+        logger.exception("Не удалось поставить в очередь изменение программы (доклад %s)", talk.id)
+        return None
+
+
+def _coalesce_program_change(event, talk_ids):
+    def merge(payload):
+        merged = payload.setdefault("talk_ids", [])
+        merged.extend(talk_id for talk_id in talk_ids if talk_id not in merged)
+        talks = Talk.objects.filter(id__in=merged).select_related("speaker").order_by("start_time")
+        return program_change_message(event, talks)
+
+    return coalesce_broadcast(
+        f"program:{event.id}", getattr(settings, "PROGRAM_CHANGE_WINDOW", 60), merge
+    )
+
+
+def notify_program_import(event, event_created, talks):
+    """Уведомления после импорта программы: одна рассылка и по сообщению каждому докладчику."""
+    talks = sorted(talks, key=lambda talk: talk.start_time)
+    if event_created:
+        enqueue_broadcast(
+            f"🎉 <b>Новое мероприятие!</b>\n\n"
             f"<b>{event.title}</b>\n"
+            f"📅 {event.date.strftime('%d.%m.%Y %H:%M')}\n\n"
+            f"{event.description}\n\n"
+            + "\n".join(
+                f"⏰ {talk.start_time.strftime('%H:%M')} {talk.title} — "
+                f"{talk.speaker.get_full_name() or talk.speaker.username}"
+                for talk in talks
+            )
+        )
+    elif talks:
+        _coalesce_program_change(event, [talk.id for talk in talks])
+
+    by_speaker = {}
+    for talk in talks:
+        by_speaker.setdefault(talk.speaker_id, []).append(talk)
+    profiles = UserProfile.objects.filter(user_id__in=by_speaker).exclude(telegram_id="")
+    enqueue_many(
+        (
+            profile.telegram_id,
+            f"🎤 <b>Ваши доклады на «{event.title}»</b>\n"
             f"📅 {event.date.strftime('%d.%m.%Y')}\n\n"
-            f"Обновлён доклад:\n"
-            f"<b>{talk.title}</b>\n"
-            f"⏰ {talk.start_time.strftime('%H:%M')} - {talk.end_time.strftime('%H:%M')}\n"
-            f"🎤 {talk.speaker.get_full_name() or talk.speaker.username}\n\n"
-            f"{talk.description}"
+            + "\n".join(
+                f"⏰ {talk.start_time.strftime('%H:%M')} - {talk.end_time.strftime('%H:%M')} "
+                f"<b>{talk.title}</b>"
+                for talk in by_speaker[profile.user_id]
+            ),
+            None,
         )
+        for profile in profiles
+    )
 
-        profiles = UserProfile.objects.filter(
-            subscribed_to_notifications=True,
-            telegram_id__isnull=False
-        ).select_related("user")
-
-        for profile in profiles:
-            send_telegram_message(profile.telegram_id, message)
 
-    except Exception as e:
-        pass
\ No newline at end of file
+def program_change_message(event, talks):
+    blocks = [
+        f"<b>{talk.title}</b>\n"
+        f"⏰ {talk.start_time.strftime('%H:%M')} - {talk.end_time.strftime('%H:%M')}\n"
+        f"🎤 {talk.speaker.get_full_name() or talk.speaker.username}\n\n"
+        f"{talk.description}"
+        for talk in talks
+    ]
+    return (
+        f"📌 <b>Изменения в программе мероприятия</b>\n\n"
+        f"<b>{event.title}</b>\n"
+        f"📅 {event.date.strftime('%d.%m.%Y')}\n\n"
+        f"{'Обновлён доклад' if len(blocks) == 1 else 'Обновлены доклады'}:\n"
+        + "\n\n".join(blocks)
+    )
@@ -0,0 +1,76 @@
+import logging
+import multiprocessing
+
+from django.db import connections
+
+from .db import db_task
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update):
+    """chat_id, к которому относится обновление, или 0, если его не определить."""
+    message = (
+        update.message
+        or update.edited_message
+        or (update.callback_query.message if update.callback_query else None)
+    )
+    if message is not None:
+        return message.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    return 0
+
+
+class ShardedDispatcher:
+    """Раздаёт обновления N процессам-обработчикам по chat_id.
+
+    Обновления одного чата всегда попадают в один и тот же процесс и
+    обрабатываются там последовательно, поэтому порядок внутри чата сохраняется.
+    worker_target(queue, *worker_args) выполняется в дочернем процессе (spawn),
+    сам настраивает Django и бота и вызывает serve_shard. Метод process_new_updates совместим с
+    TeleBot, поэтому диспетчер подставляется вместо обработки внутри процесса-приёмника.
+    """
+
+    def __init__(self, workers, worker_target, queue_size=1000, worker_args=()):
+        ctx = multiprocessing.get_context("spawn")
+        self.queues = [ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.processes = [
+            ctx.Process(target=worker_target, args=(q, *worker_args), name=f"shard-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def stop(self):
+        """Дожидается, пока шарды разберут свои очереди, и останавливает их."""
+        for q, process in zip(self.queues, self.processes):
+            if process.is_alive():
+                q.put(None)
+        for process in self.processes:
+            process.join()
+
+    def shard_for(self, chat_id):
+        return chat_id % len(self.queues)
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            self.queues[self.shard_for(update_chat_id(update))].put(update)
+
+
+def serve_shard(queue, bot):
+    """Цикл дочернего процесса: обрабатывает обновления своей очереди по одному."""
+    try:
+        while True:
+            update = queue.get()
+            if update is None:
+                return
+            try:
+                with db_task():
+                    bot.process_new_updates([update])
+            except Exception:
+                logger.exception("Ошибка обработки обновления %s", update.update_id)
+    finally:
+        connections.close_all()
@@ -1,3 +1,832 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import time, timedelta
+from queue import Empty
+from time import monotonic, sleep
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import site
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from telebot import TeleBot, apihelper, asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+
+from . import transport
+from .conversation import ANSWER_QUESTION, ASK_QUESTION, ConversationStore, StateRouter
+from .fake_telegram import FakeTelegramServer, make_callback, make_update
+from .inbox import unanswered_page
+from .delivery import DeliveryEngine, DeliveryResult
+from .ingest import QuestionBuffer
+from .media import MediaCache
+from .metrics import Registry, instrumented, registry, timed_api_request
+from .models import Event, MediaAsset, OutboxMessage, Talk, Question, UserProfile
+from .outbox import claim_messages, drain, enqueue, enqueue_broadcast
+from .program_import import ProgramImportError, import_program, parse_csv, parse_ics, parse_json
+from .qos import (
+    BROADCAST, INTERACTIVE, LANES, TIMER, LaneShed, PriorityGate, gated_request, get_gate, lane, share_rate,
+)
+from .recipients import iter_recipients, record_deliveries
+from .render_cache import get_active_event, get_program
+from .roles import RoleCache, role_cache
+from .scheduler import LiveScheduler
+from .services import BroadcastResult
+from .sharding import ShardedDispatcher, update_chat_id
+from .webhook import WebhookApp
+
+
+class AdminChangelistQueriesTests(TestCase):
+    """Число запросов в списках админки не зависит от количества строк."""
+
+    QUERY_BUDGET = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_rows(self, start, count):
+        for i in range(start, start + count):
+            speaker = User.objects.create(username=f"speaker{i}")
+            UserProfile.objects.create(user=speaker, telegram_id=str(i), is_speaker=True)
+            event = Event.objects.create(
+                title=f"Митап {i}",
+                date=timezone.now() + timedelta(days=i),
+                description="",
+            )
+            talk = Talk.objects.create(
+                event=event, speaker=speaker, title=f"Доклад {i}", description="",
+                start_time=time(10), end_time=time(11),
+            )
+            Question.objects.create(talk=talk, user=speaker, text="?")
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assert_fixed_budget(self, model_name):
+        url = reverse(f"admin:meetup_{model_name}_changelist")
+        self.create_rows(0, 2)
+        few = self.count_queries(url)
+        self.create_rows(2, 20)
+        many = self.count_queries(url)
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, self.QUERY_BUDGET)
+
+    def test_event_changelist(self):
+        self.assert_fixed_budget("event")
+
+    def test_talk_changelist(self):
+        self.assert_fixed_budget("talk")
+
+    def test_userprofile_changelist(self):
+        self.assert_fixed_budget("userprofile")
+
+    def test_userprofile_counts_without_joins(self):
+        self.create_rows(0, 2)
+        speaker = User.objects.get(username="speaker0")
+        talk = Talk.objects.create(event=Event.objects.first(), speaker=speaker, title="Ещё доклад",
+                                   description="", start_time=time(12), end_time=time(13))
+        Question.objects.bulk_create(Question(talk=talk, user=speaker, text="?") for _ in range(2))
+        request = mock.Mock(user=self.admin)
+        queryset = site._registry[UserProfile].get_queryset(request)
+        self.assertNotIn("JOIN", str(queryset.query))
+        counts = {p.telegram_id: (p._talks_count, p._questions_count) for p in queryset}
+        self.assertEqual(counts, {"0": (2, 3), "1": (1, 1)})
+
+
+def post_webhook(app, payload, secret=None, path="/"):
+    headers = [(b"content-type", b"application/json")]
+    if secret is not None:
+        headers.append((b"x-telegram-bot-api-secret-token", secret.encode()))
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    messages = [{"type": "http.request", "body": json.dumps(payload).encode(), "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"]
+
+
+class WebhookAppTests(TestCase):
+    def setUp(self):
+        self.bot = TeleBot("123:test")
+        self.app = WebhookApp(self.bot, secret_token="s3cret", queue_size=1, workers=1)
+
+    def test_requires_secret(self):
+        with self.assertRaises(ValueError):
+            WebhookApp(self.bot, secret_token=None)
+
+    def test_rejects_missing_or_wrong_secret(self):
+        self.assertEqual(post_webhook(self.app, make_update(1, "hi")), 403)
+        self.assertEqual(post_webhook(self.app, make_update(1, "hi"), secret="wrong"), 403)
+        self.assertTrue(self.app.queue.empty())
+
+    def test_handler_runs_in_webhook_worker(self):
+        handled = []
+
+        @self.bot.message_handler(content_types=["text"])
+        def remember(msg):
+            handled.append((msg.text, threading.current_thread().name))
+
+        self.app.start()
+        self.assertEqual(post_webhook(self.app, make_update(1, "ping"), secret="s3cret"), 200)
+        self.app.queue.join()
+        self.app.stop()
+        self.assertEqual(handled, [("ping", "webhook-0")])
+
+    def test_acknowledges_and_sheds_when_queue_full(self):
+        self.assertEqual(post_webhook(self.app, make_update(1, "hi"), secret="s3cret"), 200)
+        self.assertEqual(post_webhook(self.app, make_update(2, "hi"), secret="s3cret"), 503)
+
+    def test_processes_updates_against_fake_api(self):
+        @self.bot.message_handler(content_types=["text"])
+        def echo(msg):
+            self.bot.send_message(msg.chat.id, msg.text)
+
+        with FakeTelegramServer() as server, \
+                mock.patch.object(apihelper, "API_URL", server.url + "/bot{0}/{1}"):
+            self.app.start()
+            self.assertEqual(post_webhook(self.app, make_update(1, "ping"), secret="s3cret"), 200)
+            self.app.queue.join()
+            self.app.stop()
+        self.assertEqual(server.calls, ["sendMessage"])
+
+
+class QuestionBufferTests(TestCase):
+    def setUp(self):
+        speaker = User.objects.create(username="speaker")
+        UserProfile.objects.create(user=speaker, telegram_id="42")
+        event = Event.objects.create(title="Митап", date=timezone.now(), description="")
+        self.talk = Talk.objects.create(event=event, speaker=speaker, title="Доклад", description="",
+                                        start_time=time(10), end_time=time(11))
+        self.buffer = QuestionBuffer(flush_interval=60, max_batch=1000)
+
+    def test_close_writes_pending_questions_in_one_batch(self):
+        for n in range(20):
+            self.buffer.submit(self.talk.id, None, f"Вопрос {n}")
+        self.buffer.submit(self.talk.id + 100, None, "К удалённому докладу")
+        self.assertEqual(Question.objects.count(), 0)
+        with CaptureQueriesContext(connection) as ctx:
+            self.buffer.close()
+        self.assertEqual(Question.objects.count(), 20)
+        self.assertEqual(OutboxMessage.objects.filter(text__startswith="Вопрос к докладу").count(), 20)
+        self.assertLessEqual(len(ctx.captured_queries), 6)
+
+    def test_failed_batch_is_kept_and_retried(self):
+        bulk_create = Question.objects.bulk_create
+        calls = []
+
+        def locked_once(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError("database is locked")
+            return bulk_create(*args, **kwargs)
+
+        for n in range(5):
+            self.buffer.submit(self.talk.id, None, f"Вопрос {n}")
+        with mock.patch.object(Question.objects, "bulk_create", side_effect=locked_once):
+            with self.assertRaises(OperationalError):
+                self.buffer.flush()
+            self.assertEqual(len(self.buffer), 5)
+            self.buffer.close()
+        self.assertEqual(sorted(Question.objects.values_list("text", flat=True)),
+                         [f"Вопрос {n}" for n in range(5)])
+
+
+class SpeakerInboxTests(TestCase):
+    def test_keyset_pages_cover_unanswered_questions_once(self):
+        speaker = User.objects.create(username="speaker")
+        event = Event.objects.create(title="Митап", date=timezone.now(), description="")
+        talk = Talk.objects.create(event=event, speaker=speaker, title="Доклад", description="",
+                                   start_time=time(10), end_time=time(11))
+        created = timezone.now()
+        Question.objects.bulk_create(
+            Question(talk=talk, text=f"Вопрос {n}", answer="Ответ" if n % 4 == 0 else None)
+            for n in range(12)
+        )
+        # Одинаковый created_at: порядок внутри страницы решает id
+        Question.objects.update(created_at=created)
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = unanswered_page(talk.id, speaker.id, cursor, limit=4)
+            seen += [q.text for q in page]
+            if not cursor:
+                break
+        self.assertEqual(seen, [f"Вопрос {n}" for n in range(12) if n % 4])
+        self.assertEqual(unanswered_page(talk.id, speaker.id + 1)[0], [])
+
+
+class TrackedFieldsTests(TestCase):
+    def setUp(self):
+        self.speaker = User.objects.create(username="speaker")
+        event = Event.objects.create(title="Митап", date=timezone.now(), description="")
+        Talk.objects.create(event=event, speaker=self.speaker, title="Доклад", description="",
+                            start_time=time(10), end_time=time(11))
+
+    def test_detects_changes_without_extra_query(self):
+        talk = Talk.objects.get()
+        talk.description = "Новое описание"
+        with self.assertNumQueries(0):
+            self.assertEqual(talk.changed_fields(), {"description"})
+        talk.save()
+        self.assertEqual(talk.changed_fields(), set())
+
+    def test_program_broadcast_only_for_visible_changes(self):
+        talk = Talk.objects.get()
+        event = Event.objects.get()
+        # Рассылки о создании уже ушли
+        OutboxMessage.objects.update(status=OutboxMessage.SENT)
+        before = OutboxMessage.objects.count()
+        talk.save()
+        event.save()
+        self.assertEqual(OutboxMessage.objects.count(), before)
+        talk.start_time = time(10, 30)
+        talk.save()
+        self.assertEqual(OutboxMessage.objects.count(), before + 1)
+
+    def test_program_change_failure_is_logged(self):
+        talk = Talk.objects.get()
+        talk.start_time = time(9)
+        with mock.patch("meetup.services.coalesce_broadcast", side_effect=OperationalError("locked")), \
+                self.assertLogs("meetup.services", "ERROR"):
+            talk.save()
+        self.assertEqual(Talk.objects.get().start_time, time(9))
+
+    def test_program_changes_coalesce_into_one_broadcast(self):
+        event = Event.objects.get()
+        Talk.objects.create(event=event, speaker=self.speaker, title="Второй доклад", description="",
+                            start_time=time(12), end_time=time(13))
+        for talk in Talk.objects.all():
+            talk.end_time = time(talk.end_time.hour, 30)
+            talk.save()
+        row = OutboxMessage.objects.get(coalesce_key=f"program:{event.id}")
+        self.assertEqual(len(row.payload["talk_ids"]), 2)
+        self.assertIn("Второй доклад", row.text)
+        self.assertIn("11:30", row.text)
+
+
+class RenderCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        speaker = User.objects.create(username="speaker")
+        self.event = Event.objects.create(title="Митап", date=timezone.now() + timedelta(days=1),
+                                          description="")
+        self.talk = Talk.objects.create(event=self.event, speaker=speaker, title="Доклад",
+                                        description="", start_time=time(10), end_time=time(11))
+        OutboxMessage.objects.update(status=OutboxMessage.SENT)
+
+    def test_program_render_is_invalidated_only_by_real_changes(self):
+        get_program(self.event.id)
+        with self.assertNumQueries(0):
+            get_program(self.event.id)
+
+        before = OutboxMessage.objects.count()
+        self.talk.save()
+        self.assertEqual(OutboxMessage.objects.count(), before)
+
+        self.talk.start_time = time(10, 30)
+        self.talk.save()
+        self.assertEqual(OutboxMessage.objects.count(), before + 1)
+        with self.assertNumQueries(2):
+            _, talks = get_program(self.event.id)
+        self.assertEqual(talks[0].start_time, time(10, 30))
+
+    def test_active_event_is_cached_until_an_event_changes(self):
+        self.assertEqual(get_active_event(), self.event)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_active_event(), self.event)
+
+        self.event.title = "Новое название"
+        self.event.save()
+        self.assertEqual(get_active_event().title, "Новое название")
+        with self.assertNumQueries(0):
+            get_active_event()
+
+        self.event.delete()
+        self.assertIsNone(get_active_event())
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_active_event())
+
+
+class ProgramImportTests(TestCase):
+    PROGRAM = {
+        "event": {"title": "Импорт", "date": "2030-05-01T18:00:00", "description": ""},
+        "talks": [
+            {"title": f"Доклад {n}", "start_time": f"{10 + n}:00", "end_time": f"{10 + n}:45",
+             "speaker": f"speaker{n % 2}", "telegram_id": str(700 + n % 2)}
+            for n in range(6)
+        ],
+    }
+
+    def test_one_broadcast_and_one_message_per_speaker(self):
+        event_data, rows = parse_json(io.StringIO(json.dumps(self.PROGRAM)))
+        result = import_program(event_data, rows)
+        self.assertEqual(len(result.created), 6)
+        self.assertEqual(OutboxMessage.objects.filter(chat_id=None).count(), 1)
+        self.assertEqual(sorted(OutboxMessage.objects.exclude(chat_id=None)
+                                .values_list("chat_id", flat=True)), ["700", "701"])
+
+        rows[0] = rows[0]._replace(description="Обновлено")
+        result = import_program({}, rows, event=result.event)
+        self.assertEqual((len(result.created), len(result.updated)), (0, 1))
+
+    def test_csv_errors(self):
+        header = "title,start_time,end_time,speaker\n"
+        _, rows = parse_csv(io.StringIO(header + "Доклад,10:00,10:45,alice\n"))
+        self.assertEqual((rows[0].speaker, rows[0].start_time), ("alice", time(10, 0)))
+        for body in ("Доклад,10:00,10:45,\n", "Доклад,утро,10:45,alice\n", "Доклад,10:00\n"):
+            with self.subTest(body=body), self.assertRaisesRegex(ProgramImportError, "Строка 2"):
+                parse_csv(io.StringIO(header + body))
+
+    def test_json_non_string_values(self):
+        program = {"talks": [{"title": "Доклад", "start_time": 10, "end_time": "10:45", "speaker": "a"}]}
+        with self.assertRaises(ProgramImportError):
+            parse_json(io.StringIO(json.dumps(program)))
+        with self.assertRaises(ProgramImportError):
+            parse_json(io.StringIO("[]"))
+
+    def test_ics(self):
+        def calendar(dtstart="DTSTART;TZID=Europe/Moscow:20300501T180000",
+                     organizer='ORGANIZER;CN="alice":mailto:alice@example.com'):
+            return io.StringIO("\r\n".join([
+                "BEGIN:VCALENDAR", "X-WR-CALNAME:Импорт", "BEGIN:VEVENT", "SUMMARY:Доклад\\, первый",
+                dtstart, "DTEND;TZID=Europe/Moscow:20300501T184500", organizer,
+                "END:VEVENT", "END:VCALENDAR",
+            ]))
+
+        event, rows = parse_ics(calendar())
+        self.assertEqual(event["title"], "Импорт")
+        self.assertEqual((rows[0].title, rows[0].speaker), ("Доклад, первый", "alice"))
+        for broken in (calendar(dtstart="DTSTART;VALUE=DATE:20300501"),
+                       calendar(dtstart="DTSTART;TZID=Mars/Olympus:20300501T180000"),
+                       calendar(organizer="ORGANIZER:mailto:alice@example.com")):
+            with self.subTest(), self.assertRaises(ProgramImportError):
+                parse_ics(broken)
+
+    def test_duplicate_telegram_id(self):
+        UserProfile.objects.create(user=User.objects.create(username="someone"), telegram_id="700")
+        event_data, rows = parse_json(io.StringIO(json.dumps(self.PROGRAM)))
+        with self.assertRaisesRegex(ProgramImportError, "someone"):
+            import_program(event_data, rows)
+        self.assertFalse(Event.objects.filter(title="Импорт").exists())
+
+        rows = [row._replace(telegram_id="800") for row in rows]
+        with self.assertRaisesRegex(ProgramImportError, "800"):
+            import_program(event_data, rows)
+
+
+class TalkScheduleTests(TestCase):
+    def setUp(self):
+        self.speaker = User.objects.create(username="speaker")
+        self.event = Event.objects.create(
+            title="Ночной митап",
+            date=timezone.make_aware(timezone.datetime(2030, 5, 1, 22, 0)),
+            description="",
+        )
+        self.talk = Talk.objects.create(event=self.event, speaker=self.speaker, title="Полночь",
+                                        description="", start_time=time(23, 30), end_time=time(0, 30))
+
+    def test_talk_crossing_midnight_ends_next_day(self):
+        self.assertEqual(self.talk.ends_at - self.talk.starts_at, timedelta(hours=1))
+        after_midnight = self.talk.starts_at + timedelta(minutes=45)
+        self.assertEqual(list(Talk.objects.live(after_midnight)), [self.talk])
+        self.assertEqual(Event.objects.active_event(after_midnight), self.event)
+
+    def test_event_date_change_moves_talks(self):
+        self.event.date += timedelta(days=1)
+        self.event.save()
+        self.talk.refresh_from_db()
+        self.assertEqual(timezone.localdate(self.talk.starts_at), timezone.localdate(self.event.date))
+
+
+class MediaCacheTests(TestCase):
+    def test_uploads_once_and_again_after_file_changes(self):
+        bot = TeleBot("123:test", threaded=False)
+        with tempfile.TemporaryDirectory() as tmpdir, FakeTelegramServer() as server, \
+                mock.patch.object(apihelper, "API_URL", server.url + "/bot{0}/{1}"):
+            path = os.path.join(tmpdir, "logo.png")
+            with open(path, "wb") as f:
+                f.write(b"\x89PNG" + b"0" * 4096)
+            MediaCache().send_photo(bot, 1, path)
+            uploaded = server.bytes_received
+            # Новый экземпляр кеша (как после перезапуска) берёт file_id из БД
+            MediaCache().send_photo(bot, 2, path)
+            self.assertLess(server.bytes_received - uploaded, 1024)
+
+            with open(path, "ab") as f:
+                f.write(b"1")
+            MediaCache().send_photo(bot, 3, path)
+            self.assertGreater(server.bytes_received - uploaded, 4096)
+        self.assertEqual(MediaAsset.objects.count(), 2)
+
+    def test_file_id_is_forgotten_only_for_file_errors(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "logo.png")
+            with open(path, "wb") as f:
+                f.write(b"\x89PNG")
+            cache = MediaCache()
+            bot = mock.Mock()
+            bot.send_photo.return_value.photo = [mock.Mock(file_id="first")]
+            cache.send_photo(bot, 1, path)
+
+            bot.send_photo.side_effect = telegram_error(400, "Bad Request: chat not found")
+            with self.assertRaises(apihelper.ApiTelegramException):
+                cache.send_photo(bot, 2, path)
+            self.assertEqual(MediaAsset.objects.get().file_id, "first")
+
+            uploaded = mock.Mock()
+            uploaded.photo = [mock.Mock(file_id="second")]
+            bot.send_photo.side_effect = [
+                telegram_error(400, "Bad Request: wrong file identifier/HTTP URL specified"),
+                uploaded,
+            ]
+            self.assertIs(cache.send_photo(bot, 3, path), uploaded)
+            self.assertEqual(MediaAsset.objects.get().file_id, "second")
+
+
+class RecipientTests(TestCase):
+    def setUp(self):
+        for n in range(5):
+            user = User.objects.create(username=f"user{n}")
+            UserProfile.objects.create(user=user, telegram_id=str(100 + n),
+                                       subscribed_to_notifications=n != 4)
+
+    def test_blocked_chats_are_skipped_by_later_broadcasts(self):
+        recipients = list(iter_recipients(batch_size=2))
+        self.assertEqual([tg for _, tg in recipients], ["100", "101", "102", "103"])
+
+        results = [DeliveryResult(tg, True, 1) for _, tg in recipients]
+        results[1] = DeliveryResult("101", False, 1, "Forbidden: bot was blocked by the user", 403)
+        results[2] = DeliveryResult("102", False, 1, "Internal Server Error", 500)
+        self.assertEqual(record_deliveries([pid for pid, _ in recipients], results), 1)
+
+        self.assertEqual([tg for _, tg in iter_recipients(batch_size=2)], ["100", "102", "103"])
+        self.assertEqual(UserProfile.objects.get(telegram_id="102").delivery_failures, 1)
+
+
+class AsyncRuntimeTests(TestCase):
+    async def test_register_through_async_handlers(self):
+        from .management.commands.run_askthespeakerbot import register_async_handlers
+
+        bot = AsyncTeleBot("123:test")
+        register_async_handlers(bot)
+        with FakeTelegramServer() as server, \
+                mock.patch.object(asyncio_helper, "API_URL", server.url + "/bot{0}/{1}"):
+            await bot.process_new_updates([Update.de_json(make_callback(1, "register", user_id=7))])
+            await bot.close_session()
+        self.assertTrue(await UserProfile.objects.filter(telegram_id="7").aexists())
+        self.assertEqual(server.calls, ["answerCallbackQuery", "editMessageText"])
+
+    async def test_async_calls_go_through_gate(self):
+        gate = PriorityGate(rate=1000)
+        request = gated_request(timed_api_request(asyncio_helper._process_request), gate)
+        bot = AsyncTeleBot("123:test")
+        with FakeTelegramServer() as server, \
+                mock.patch.object(asyncio_helper, "API_URL", server.url + "/bot{0}/{1}"), \
+                mock.patch.object(asyncio_helper, "_process_request", request), \
+                mock.patch.object(gate, "aacquire", wraps=gate.aacquire) as aacquire:
+            with lane(TIMER):
+                await bot.send_message(1, "Программа")
+            await bot.close_session()
+        aacquire.assert_awaited_once_with(TIMER)
+        self.assertEqual(server.calls, ["sendMessage"])
+        self.assertIn('meetup_telegram_api_duration_seconds_count{method="sendMessage"}', registry.render())
+
+    async def test_async_flood_pauses_gate(self):
+        async def flood(token, url, *args, **kwargs):
+            raise asyncio_helper.ApiTelegramException(url, None, {
+                "ok": False, "error_code": 429, "description": "Too Many Requests",
+                "parameters": {"retry_after": 3},
+            })
+
+        gate = PriorityGate(rate=1000)
+        with mock.patch.object(gate, "pause") as pause, \
+                self.assertRaises(asyncio_helper.ApiTelegramException):
+            await gated_request(flood, gate)("123:test", "sendMessage")
+        pause.assert_called_once_with(3)
+
+
+class PriorityGateTests(TestCase):
+    def test_lower_lanes_leave_headroom_and_yield(self):
+        lanes = list(LANES)
+        lanes[TIMER] = lanes[TIMER]._replace(max_wait=0.01)
+        gate = PriorityGate(rate=10, capacity=4, lanes=tuple(lanes))
+        # Рассылка берёт токены, пока в bucket остаётся её резерв (половина)
+        gate.acquire(BROADCAST)
+        gate.acquire(BROADCAST)
+        started = monotonic()
+        gate.acquire(INTERACTIVE)
+        self.assertLess(monotonic() - started, 0.05)
+        with self.assertRaises(LaneShed):
+            gate.acquire(TIMER)
+
+        order = []
+        waiting = threading.Thread(target=lambda: (gate.acquire(BROADCAST), order.append("broadcast")))
+        waiting.start()
+        sleep(0.02)
+        gate.acquire(INTERACTIVE)
+        order.append("interactive")
+        waiting.join()
+        self.assertEqual(order, ["interactive", "broadcast"])
+        self.assertEqual(set(gate.depth().values()), {0})
+
+    def test_rate_is_shared_between_shard_processes(self):
+        with mock.patch("meetup.qos._gate", None), mock.patch("meetup.qos._rate_parts", 1):
+            share_rate(4)
+            self.assertEqual(get_gate().bucket.rate, settings.TELEGRAM_QOS_RATE / 4)
+            with self.assertRaises(RuntimeError):
+                share_rate(2)
+
+
+class OutboxClaimTests(TestCase):
+    def test_rows_are_claimed_by_one_pass_until_lease_expires(self):
+        for n in range(5):
+            enqueue(100 + n, f"Сообщение {n}")
+        first, second = claim_messages(3), claim_messages(10)
+        self.assertEqual((len(first), len(second)), (3, 2))
+        self.assertFalse({row.id for row in first} & {row.id for row in second})
+        self.assertEqual(claim_messages(10), [])
+
+        # Воркер упал, не дописав итоги: после lease строки снова доступны
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(len(claim_messages(10)), 5)
+
+    def test_direct_results_are_saved_before_broadcasts(self):
+        enqueue(100, "Личное")
+        enqueue(101, "Личное")
+        failed = enqueue_broadcast("Рассылка")
+        partial = enqueue_broadcast("Рассылка")
+        results = iter([RuntimeError("База недоступна"), BroadcastResult(sent=3, failed=1, unreachable=1)])
+
+        def broadcast(text):
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        with mock.patch("meetup.services.get_telegram_bot", return_value=mock.Mock()), \
+                mock.patch("meetup.services._send_html"), \
+                mock.patch("meetup.services.broadcast", side_effect=broadcast), \
+                self.assertLogs("meetup.outbox", "ERROR"):
+            self.assertEqual(drain(), 4)
+        statuses = dict(OutboxMessage.objects.values_list("id", "status"))
+        self.assertEqual(sorted(statuses.values()), ["failed", "partial", "sent", "sent"])
+        self.assertEqual((statuses[failed.id], statuses[partial.id]),
+                         (OutboxMessage.FAILED, OutboxMessage.PARTIAL))
+        self.assertFalse(OutboxMessage.objects.exclude(claim_token=None).exists())
+
+
+def telegram_error(code, description, retry_after=None):
+    result_json = {"ok": False, "error_code": code, "description": description}
+    if retry_after is not None:
+        result_json["parameters"] = {"retry_after": retry_after}
+    return apihelper.ApiTelegramException("sendMessage", None, result_json)
+
+
+class DeliveryEngineTests(TestCase):
+    def setUp(self):
+        self.engine = DeliveryEngine(global_rate=1000, chat_rate=100, workers=4, max_attempts=3)
+        self.sent = []
+
+    def send(self, chat_id, failures):
+        error = failures.get(chat_id)
+        if callable(error):
+            error = error()
+        if error:
+            raise error
+        self.sent.append(chat_id)
+
+    def test_results_per_recipient_with_retry_after(self):
+        flood = iter([telegram_error(429, "Too Many Requests", retry_after=0.01)])
+        failures = {
+            "2": telegram_error(403, "Forbidden: bot was blocked by the user"),
+            "3": lambda: next(flood, None),
+            "4": telegram_error(429, "Too Many Requests", retry_after=0.01),
+        }
+        results = self.engine.fan_out(self.send, ["1", "2", "3", "4"], failures)
+        self.assertEqual([r.chat_id for r in results], ["1", "2", "3", "4"])
+        self.assertEqual([(r.ok, r.attempts, r.error_code) for r in results],
+                         [(True, 1, None), (False, 1, 403), (True, 2, None), (False, 3, 429)])
+        self.assertEqual(sorted(self.sent), ["1", "3"])
+
+    def test_busy_chat_is_deferred_instead_of_blocking_a_worker(self):
+        engine = DeliveryEngine(global_rate=1000, chat_rate=1, workers=1)
+        started = monotonic()
+        results = engine.send_many(self.send, [("7", {"failures": {}})] * 3 + [("8", {"failures": {}})])
+        self.assertLess(monotonic() - started, 0.5)
+        self.assertEqual(self.sent, ["7", "8"])
+        self.assertEqual([r.ok for r in results], [True, False, False, True])
+        self.assertTrue(all(r.retry_in > 0 for r in results[1:3]))
+
+
+class LiveSchedulerTests(TestCase):
+    def setUp(self):
+        self.scheduler = LiveScheduler(workers=2)
+        self.calls = []
+        self.ran = threading.Event()
+
+    def job(self, name, keep=True):
+        def func():
+            self.calls.append(name)
+            self.ran.set()
+            return keep
+        return func
+
+    def test_schedule_replaces_job_with_same_key(self):
+        self.scheduler.schedule(1, self.job("old"), interval=0.01, delay=0.05)
+        self.scheduler.schedule(1, self.job("new", keep=False), interval=0.01, delay=0)
+        self.assertTrue(self.ran.wait(1))
+        sleep(0.1)
+        self.assertEqual(self.calls, ["new"])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_cancel_by_key(self):
+        self.scheduler.schedule(1, self.job("cancelled"), interval=0.01, delay=0.05)
+        self.scheduler.schedule(2, self.job("kept", keep=False), interval=0.01, delay=0.05)
+        self.assertTrue(self.scheduler.cancel(1))
+        self.assertFalse(self.scheduler.cancel(1))
+        self.assertTrue(self.ran.wait(1))
+        sleep(0.1)
+        self.assertEqual(self.calls, ["kept"])
+
+    def test_failing_job_is_logged_and_kept(self):
+        def fail():
+            self.calls.append("fail")
+            if len(self.calls) == 2:
+                self.ran.set()
+                return False
+            raise RuntimeError("boom")
+
+        with self.assertLogs("meetup.scheduler", "ERROR") as logs:
+            self.scheduler.schedule(5, fail, interval=0.01, delay=0)
+            self.assertTrue(self.ran.wait(1))
+        self.assertEqual(self.calls, ["fail", "fail"])
+        self.assertIn("5", logs.output[0])
+
+
+class RoleCacheTests(TestCase):
+    def setUp(self):
+        for n in range(3):
+            UserProfile.objects.create(user=User.objects.create(username=f"user{n}"), telegram_id=str(n))
+        role_cache.clear()
+
+    def test_lru_eviction(self):
+        cache = RoleCache(maxsize=2)
+        with self.assertNumQueries(3):
+            cache.get(0)
+            cache.get(1)
+            cache.get(0)
+            cache.get(2)
+        self.assertEqual(len(cache), 2)
+        # Вытеснена запись 1, к которой дольше всего не обращались
+        with self.assertNumQueries(0):
+            cache.get(0)
+            cache.get(2)
+        with self.assertNumQueries(1):
+            cache.get(1)
+
+    def test_missing_profile_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(role_cache.get(999))
+            self.assertIsNone(role_cache.get(999))
+
+    def test_profile_signals_invalidate(self):
+        self.assertFalse(role_cache.get(1).is_speaker)
+        profile = UserProfile.objects.get(telegram_id="1")
+        profile.is_speaker = True
+        profile.save()
+        self.assertTrue(role_cache.get(1).is_speaker)
+        profile.delete()
+        self.assertIsNone(role_cache.get(1))
+
+
+class ConversationStoreTests(TestCase):
+    def test_states_expire_after_ttl(self):
+        store = ConversationStore(ttl=60)
+        with mock.patch("meetup.conversation.time.time", return_value=1000.0):
+            store.set(1, ASK_QUESTION, 5)
+        with mock.patch("meetup.conversation.time.time", return_value=1030.0):
+            store.set(2, ANSWER_QUESTION)
+            self.assertEqual(store.get(1), (ASK_QUESTION, 5))
+        with mock.patch("meetup.conversation.time.time", return_value=1061.0):
+            self.assertIsNone(store.get(1))
+            self.assertIsNone(store.pop(1))
+            self.assertEqual(store.count(), 1)
+            self.assertEqual(store.count(ANSWER_QUESTION), 1)
+
+    def test_states_survive_restart_in_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "states.sqlite3")
+            store = ConversationStore(ttl=60, path=path)
+            store.set(1, ASK_QUESTION, {"talk_id": 5})
+            store.set(2, ANSWER_QUESTION)
+            store.set(3, ANSWER_QUESTION)
+            store.pop(3)
+            with mock.patch("meetup.conversation.time.time", return_value=0.0):
+                store.set(4, ANSWER_QUESTION)
+
+            reloaded = ConversationStore(ttl=60, path=path)
+            self.assertEqual(reloaded.get(1), (ASK_QUESTION, {"talk_id": 5}))
+            self.assertEqual(reloaded.get(2), (ANSWER_QUESTION, None))
+            self.assertIsNone(reloaded.get(3))
+            self.assertEqual(reloaded.count(), 2)
+
+    def test_router_pops_state_and_falls_back_to_default(self):
+        store = ConversationStore()
+        router = StateRouter(store)
+        router.route(ASK_QUESTION)(lambda msg, payload: ("question", payload))
+        message = mock.Mock(**{"from_user.id": 1})
+        store.set(1, ASK_QUESTION, 5)
+        self.assertEqual(router.dispatch(message, default=lambda msg: "default"), ("question", 5))
+        self.assertEqual(router.dispatch(message, default=lambda msg: "default"), "default")
+        self.assertIsNone(router.dispatch(message))
+
+
+class MetricsTests(TestCase):
+    def test_dict_gauges_use_their_label(self):
+        metrics = Registry()
+        metrics.gauge("meetup_telegram_lane_depth", lambda: {"broadcast": 3, "interactive": 0},
+                      help="Очередь", label="lane")
+        metrics.gauge("meetup_pending_states", lambda: {"question": 1}, help="Ввод")
+        text = metrics.render()
+        self.assertIn('meetup_telegram_lane_depth{lane="broadcast"} 3', text)
+        self.assertIn('meetup_pending_states{state="question"} 1', text)
+
+    def test_instrumented_counts_calls_queries_and_errors(self):
+        @instrumented("metrics_test_handler")
+        def handler():
+            User.objects.count()
+            UserProfile.objects.count()
+            raise RuntimeError("boom")
+
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                handler()
+        text = registry.render()
+        label = '{handler="metrics_test_handler"}'
+        self.assertIn(f"meetup_handler_duration_seconds_count{label} 2", text)
+        self.assertIn(f"meetup_handler_errors_total{label} 2", text)
+        self.assertIn(f"meetup_handler_db_queries_sum{label} 4", text)
+        self.assertIn(f"meetup_handler_db_queries_count{label} 2", text)
+
+
+class ShardedDispatcherTests(TestCase):
+    def test_updates_of_one_chat_reach_one_queue_in_order(self):
+        dispatcher = ShardedDispatcher(3, worker_target=None)
+        self.assertEqual([dispatcher.shard_for(chat_id) for chat_id in (7, 7, 8, 9, 10)], [1, 1, 2, 0, 1])
+
+        updates = [Update.de_json(make_update(n, f"Сообщение {n}", user_id=7 + n % 2)) for n in range(6)]
+        updates.append(Update.de_json(make_callback(6, "register", user_id=7)))
+        dispatcher.process_new_updates(updates)
+
+        received = {}
+        for i, q in enumerate(dispatcher.queues):
+            while True:
+                try:
+                    update = q.get(timeout=0.2)
+                except Empty:
+                    break
+                received.setdefault(i, []).append((update_chat_id(update), update.update_id))
+        self.assertEqual(received, {
+            dispatcher.shard_for(7): [(7, 0), (7, 2), (7, 4), (7, 6)],
+            dispatcher.shard_for(8): [(8, 1), (8, 3), (8, 5)],
+        })
+
+
+class TransportTests(TestCase):
+    @override_settings(TELEGRAM_HTTP_POOL_SIZE=7, TELEGRAM_HTTP_RETRIES=2,
+                       TELEGRAM_CONNECT_TIMEOUT=3, TELEGRAM_READ_TIMEOUT=11)
+    def test_session_pool_retries_and_timeouts(self):
+        with mock.patch.object(transport, "_session", None), \
+                mock.patch.object(apihelper, "CONNECT_TIMEOUT", None), \
+                mock.patch.object(apihelper, "READ_TIMEOUT", None), \
+                mock.patch.object(apihelper, "CUSTOM_REQUEST_SENDER", None):
+            session = transport.get_session()
+            self.assertEqual((apihelper.CONNECT_TIMEOUT, apihelper.READ_TIMEOUT), (3, 11))
+            self.assertIsNotNone(apihelper.CUSTOM_REQUEST_SENDER)
+        adapter = session.get_adapter("https://api.telegram.org")
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertTrue(adapter._pool_block)
+        retry = adapter.max_retries
+        self.assertEqual((retry.total, retry.connect, retry.read, retry.status), (2, 2, 0, 0))
@@ -0,0 +1,118 @@
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from telebot import TeleBot, apihelper
+from urllib3.util.retry import Retry
+
+from .db import AsyncDbConnectionMiddleware, DbConnectionMiddleware
+from .metrics import timed_api_request
+from .qos import gated_request, get_gate
+
+_lock = threading.Lock()
+_session = None
+_bot = None
+_async_bot = None
+_async_configured = False
+
+
+def build_session() -> requests.Session:
+    """Создаёт HTTP-сессию с ограниченным пулом keep-alive соединений и повторами.
+
+    urllib3 повторяет только ошибки соединения: запрос ещё не отправлен, и повтор
+    безопасен для любого метода. После таймаута чтения или 5xx sendMessage мог
+    уже дойти, поэтому такие повторы оставлены DeliveryEngine.
+    """
+    retry = Retry(
+        total=getattr(settings, "TELEGRAM_HTTP_RETRIES", 3),
+        connect=getattr(settings, "TELEGRAM_HTTP_RETRIES", 3),
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=getattr(settings, "TELEGRAM_HTTP_BACKOFF", 0.5),
+        allowed_methods=None,
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    pool_size = getattr(settings, "TELEGRAM_HTTP_POOL_SIZE", 16)
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            _session = build_session()
+            apihelper.CONNECT_TIMEOUT = getattr(settings, "TELEGRAM_CONNECT_TIMEOUT", 5)
+            apihelper.READ_TIMEOUT = getattr(settings, "TELEGRAM_READ_TIMEOUT", 15)
+            # Очередь полос снаружи, чтобы время ожидания лимита не попадало во время вызова
+            apihelper.CUSTOM_REQUEST_SENDER = gated_request(timed_api_request(_session.request), get_gate())
+            api_url = getattr(settings, "TELEGRAM_API_URL", None)
+            if api_url:
+                apihelper.API_URL = api_url.rstrip("/") + "/bot{0}/{1}"
+        return _session
+
+
+def get_bot():
+    """Возвращает общий для процесса TeleBot, работающий через пул соединений."""
+    global _bot
+    token = getattr(settings, "TELEGRAM_BOT_TOKEN", None)
+    if not token:
+        return None
+    get_session()
+    with _lock:
+        if _bot is None:
+            _bot = TeleBot(token, parse_mode="HTML", use_class_middlewares=True)
+            _bot.setup_middleware(DbConnectionMiddleware())
+        return _bot
+
+
+def configure_asyncio_helper():
+    """Настраивает asyncio_helper: пул и таймаут, PriorityGate и метрики вызовов."""
+    global _async_configured
+    from telebot import asyncio_helper
+
+    with _lock:
+        if _async_configured:
+            return
+        asyncio_helper.REQUEST_LIMIT = getattr(settings, "TELEGRAM_HTTP_POOL_SIZE", 16)
+        asyncio_helper.REQUEST_TIMEOUT = getattr(settings, "TELEGRAM_READ_TIMEOUT", 15)
+        api_url = getattr(settings, "TELEGRAM_API_URL", None)
+        if api_url:
+            asyncio_helper.API_URL = api_url.rstrip("/") + "/bot{0}/{1}"
+        # Модульные функции asyncio_helper находят _process_request при каждом вызове
+        asyncio_helper._process_request = gated_request(
+            timed_api_request(asyncio_helper._process_request), get_gate()
+        )
+        _async_configured = True
+
+
+def get_async_bot():
+    """AsyncTeleBot для режима --async: один event loop и пул aiohttp-соединений.
+
+    Лимит соединений и таймаут берутся из тех же настроек, что и у пула requests.
+    Вызовы идут через тот же PriorityGate и учитываются в тех же метриках, что
+    и в синхронном режиме.
+    """
+    global _async_bot
+    from telebot.async_telebot import AsyncTeleBot
+
+    token = getattr(settings, "TELEGRAM_BOT_TOKEN", None)
+    if not token:
+        return None
+    configure_asyncio_helper()
+    with _lock:
+        if _async_bot is None:
+            _async_bot = AsyncTeleBot(token, parse_mode="HTML")
+            _async_bot.setup_middleware(AsyncDbConnectionMiddleware())
+        return _async_bot
@@ -0,0 +1,152 @@
+import asyncio
+import hmac
+import inspect
+import json
+import logging
+import queue
+import threading
+
+from telebot.types import Update
+
+from .db import db_task
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class WebhookApp:
+    """ASGI-приложение, принимающее обновления Telegram через webhook.
+
+    Проверяет заголовок X-Telegram-Bot-Api-Secret-Token, разбирает Update,
+    кладёт его в ограниченную очередь и сразу отвечает 200. Обработку ведут
+    рабочие потоки. При переполнении очереди отвечает 503, и Telegram
+    повторит доставку позже.
+
+    С AsyncTeleBot (режим --async) потоков нет: каждое обновление
+    обрабатывается задачей в event loop сервера, а queue_size ограничивает
+    число одновременно обрабатываемых обновлений.
+    """
+
+    def __init__(self, bot, secret_token, path="/", queue_size=1000, workers=4):
+        if not secret_token:
+            # Без секрета публичный адрес примет поддельные обновления от кого угодно
+            raise ValueError("WebhookApp требует secret_token")
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = workers
+        self._threads = []
+        self.is_async = inspect.iscoroutinefunction(bot.process_new_updates)
+        if not self.is_async:
+            # Иначе TeleBot перекладывает обновления в свою неограниченную очередь,
+            # и ни queue_size, ни workers, ни db_task() ничего не ограничивают
+            bot.threaded = False
+        self._tasks = set()
+
+    def start(self):
+        if self.is_async:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"webhook-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        while True:
+            update = self.queue.get()
+            try:
+                if update is None:
+                    return
+                with db_task():
+                    self.bot.process_new_updates([update])
+            except Exception:
+                logger.exception("Ошибка обработки обновления")
+            finally:
+                self.queue.task_done()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if scope["path"] != self.path:
+            await self._respond(send, 404)
+            return
+        if scope["method"] != "POST":
+            await self._respond(send, 405)
+            return
+        headers = dict(scope.get("headers") or [])
+        token = headers.get(b"x-telegram-bot-api-secret-token", b"")
+        if not hmac.compare_digest(token, self.secret_token.encode()):
+            await self._respond(send, 403)
+            return
+
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+            if len(body) > MAX_BODY_SIZE:
+                await self._respond(send, 413)
+                return
+        try:
+            update = Update.de_json(json.loads(body))
+        except (ValueError, TypeError, KeyError):
+            await self._respond(send, 400)
+            return
+
+        if self.is_async:
+            if len(self._tasks) >= self.queue.maxsize:
+                await self._respond(send, 503)
+                return
+            task = asyncio.get_running_loop().create_task(self._process_async(update))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            await self._respond(send, 200)
+            return
+        try:
+            self.queue.put_nowait(update)
+        except queue.Full:
+            await self._respond(send, 503)
+            return
+        await self._respond(send, 200)
+
+    async def _process_async(self, update):
+        try:
+            await self.bot.process_new_updates([update])
+        except Exception:
+            logger.exception("Ошибка обработки обновления")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if not self._threads:
+                    self.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._tasks:
+                    await asyncio.wait(list(self._tasks))
+                self.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _respond(send, status):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain")],
+        })
+        await send({"type": "http.response.body", "body": b""})
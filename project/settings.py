@@ -34,6 +34,66 @@ ALLOWED_HOSTS = []
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
+# Лимиты рассылки: сообщений в секунду в один чат и число потоков отправки
+# (общий лимит — TELEGRAM_QOS_RATE)
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_DELIVERY_WORKERS = int(os.getenv('TELEGRAM_DELIVERY_WORKERS', '8'))
+
+# Приоритетные полосы вызовов Bot API: общий лимит вызовов в секунду и сколько секунд
+# обновление живого сообщения может ждать лимита, прежде чем его пропустят.
+# Лимит на бота; с --workers он делится между процессами
+TELEGRAM_QOS_RATE = float(os.getenv('TELEGRAM_QOS_RATE', '30'))
+TELEGRAM_QOS_TIMER_MAX_WAIT = float(os.getenv('TELEGRAM_QOS_TIMER_MAX_WAIT', '2'))
+
+# HTTP-транспорт Telegram: размер пула соединений, таймауты и повторы при ошибках соединения
+TELEGRAM_HTTP_POOL_SIZE = int(os.getenv('TELEGRAM_HTTP_POOL_SIZE', '16'))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', '5'))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', '15'))
+TELEGRAM_HTTP_RETRIES = int(os.getenv('TELEGRAM_HTTP_RETRIES', '3'))
+TELEGRAM_HTTP_BACKOFF = float(os.getenv('TELEGRAM_HTTP_BACKOFF', '0.5'))
+
+# Адрес Bot API, например локального тестового сервера; по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL') or None
+
+# Режим webhook (run_askthespeakerbot --webhook)
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')
+TELEGRAM_WEBHOOK_PATH = os.getenv('TELEGRAM_WEBHOOK_PATH', '/')
+TELEGRAM_WEBHOOK_QUEUE_SIZE = int(os.getenv('TELEGRAM_WEBHOOK_QUEUE_SIZE', '1000'))
+TELEGRAM_WEBHOOK_WORKERS = int(os.getenv('TELEGRAM_WEBHOOK_WORKERS', '4'))
+
+# Порт HTTP-эндпоинта метрик бота (/metrics, /metrics.json); пусто — эндпоинт выключен
+METRICS_PORT = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+
+# Число потоков, которые обновляют живые сообщения программы и докладов
+LIVE_UPDATE_WORKERS = int(os.getenv('LIVE_UPDATE_WORKERS', '4'))
+
+# Сколько секунд хранить в кеше программу и текущее активное мероприятие
+PROGRAM_CACHE_TTL = int(os.getenv('PROGRAM_CACHE_TTL', '60'))
+ACTIVE_EVENT_CACHE_TTL = int(os.getenv('ACTIVE_EVENT_CACHE_TTL', '30'))
+
+# Кеш ролей пользователей бота: максимум записей и время жизни записи в секундах
+ROLE_CACHE_SIZE = int(os.getenv('ROLE_CACHE_SIZE', '10000'))
+ROLE_CACHE_TTL = int(os.getenv('ROLE_CACHE_TTL', '300'))
+
+# Состояния диалогов бота: время жизни в секундах и необязательный SQLite-файл для сохранения
+CONVERSATION_TTL = int(os.getenv('CONVERSATION_TTL', '900'))
+CONVERSATION_STORE_PATH = os.getenv('CONVERSATION_STORE_PATH') or None
+
+# Буфер вопросов: запись в БД пачкой раз в QUESTION_FLUSH_INTERVAL секунд или по QUESTION_BATCH_SIZE штук
+QUESTION_FLUSH_INTERVAL = float(os.getenv('QUESTION_FLUSH_INTERVAL', '0.25'))
+QUESTION_BATCH_SIZE = int(os.getenv('QUESTION_BATCH_SIZE', '200'))
+
+# Входящие докладчика: вопросов на странице и период обновления сводки (воркер drain_outbox)
+INBOX_PAGE_SIZE = int(os.getenv('INBOX_PAGE_SIZE', '5'))
+QUESTION_DIGEST_INTERVAL = int(os.getenv('QUESTION_DIGEST_INTERVAL', '60'))
+
+# Изменения программы одного мероприятия за это число секунд уходят одной рассылкой
+PROGRAM_CHANGE_WINDOW = int(os.getenv('PROGRAM_CHANGE_WINDOW', '60'))
+
+# Рассылки читают получателей из БД и отправляют пачками по столько профилей
+RECIPIENT_BATCH_SIZE = int(os.getenv('RECIPIENT_BATCH_SIZE', '500'))
+
 
 # Application definition
 
@@ -81,12 +141,77 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# DB_ENGINE=postgresql включает PostgreSQL; по умолчанию используется SQLite-файл.
+# DB_CONN_MAX_AGE — время жизни постоянного подключения в секундах,
+# DB_POOL=true — пул подключений psycopg (Django 5.1+), несовместим с CONN_MAX_AGE.
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE in ('postgresql', 'postgres'):
+    DB_POOL = os.getenv('DB_POOL', 'False').lower() in ('true', '1', 'yes', 'on')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'meetup'),
+            'USER': os.getenv('DB_USER', 'meetup'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+                    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '20')),
+                    'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+                },
+            } if DB_POOL else {},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+
+# DB_SQLITE_TUNING=true включает для SQLite WAL, synchronous=NORMAL, busy_timeout, mmap и
+# увеличенный кеш страниц (см. meetup.db.SQLITE_PRAGMAS), а также периодический PRAGMA optimize.
+SQLITE_TUNING = os.getenv('DB_SQLITE_TUNING', 'False').lower() in ('true', '1', 'yes', 'on')
+SQLITE_OPTIMIZE_INTERVAL = int(os.getenv('DB_SQLITE_OPTIMIZE_INTERVAL', '3600'))
+
+if SQLITE_TUNING and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Запись сразу берёт блокировку, и busy_timeout работает вместо мгновенного "database is locked"
+    DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE', 'timeout': 5}
+    # Подключение переживает обработчик, и PRAGMA выполняются при открытии, а не на каждое обновление
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+
+# CACHE_BACKEND: locmem (по умолчанию) живёт внутри одного процесса, и правки из админки
+# доходят до бота только по истечении PROGRAM_CACHE_TTL. Чтобы сигналы сбрасывали кеш
+# во всех процессах, нужен общий кеш: db (таблица из createcachetable) или redis (CACHE_LOCATION).
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'db':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', 'meetup_cache'),
+        }
+    }
+elif CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', 'redis://localhost:6379/0'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
 
 
 # Password validation